@@ -130,17 +130,14 @@ if __name__ == '__main__':
     if opts.aggregate:
         treecuts = []
         for i in range(0, n):
-            treecut = TreeCutModel.from_pickle(
-                os.path.join(opts.grammars[i], 'noun_treecut.pickle')).treecut
+            treecut = TreeCutModel.from_folder(opts.grammars[i], 'n').treecut
             treecuts.append(treecut)
 
         plot_many(treecuts)
     else:
-        treecut = TreeCutModel.from_pickle(
-            os.path.join(opts.grammars[0], 'noun_treecut.pickle')).treecut
+        treecut = TreeCutModel.from_folder(opts.grammars[0], 'n').treecut
         fig, ax = plot(treecut, show=n == 1)
 
         for i in range(1, n):
-            treecut = TreeCutModel.from_pickle(
-                os.join(opts.grammars[0], 'noun_treecut.pickle')).treecut
+            treecut = TreeCutModel.from_folder(opts.grammars[0], 'n').treecut
             fig, ax = plot(treecut, fig, ax, show=i == n - 1)
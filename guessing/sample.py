@@ -1,20 +1,146 @@
 """
 Outputs a password sample of a given size from a grammar.
+
+The sample can be drawn by several processes. Each worker gets its own
+random stream, spawned from a single seed with numpy.random.SeedSequence,
+and outputs its passwords in chunks of CHUNK_SIZE. Chunks are written to
+stdout in round-robin order of the workers or to one file per worker,
+so the output only depends on the seed and the number of workers.
 """
 import argparse
+import logging
+import sys
+from multiprocessing import Process, Queue
+
+import numpy as np
 
 from learning import model
+from learning.sampler import GrammarSampler
+from misc.util import check_workers, get_checked
+
+logger = logging.getLogger(__name__)
+
+# passwords drawn (and written) at once by each worker
+CHUNK_SIZE = 2 ** 16
 
 
 def options():
     parser = argparse.ArgumentParser()
     parser.add_argument('N', type=int, default=1000)
     parser.add_argument('grammar_dir')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of sampling processes. Default is 1.')
+    parser.add_argument('--seed', type=int,
+                        help='seed of the random streams. The sample is the same '
+                             'for the same seed and number of workers.')
+    parser.add_argument('--log', action='store_true',
+                        help='output log2 probabilities')
+    parser.add_argument('-o', '--output',
+                        help='if present, worker i writes its sample to OUTPUT.i '
+                             'rather than all workers to stdout')
     return parser.parse_args()
 
 
+def shares(N, num_workers):
+    """Split N passwords among workers, the first ones take the remainder."""
+    return [N // num_workers + (i < N % num_workers) for i in range(num_workers)]
+
+
+def worker_seeds(seed, num_workers):
+    """ Return one independent SeedSequence per worker. If seed is None,
+    fresh entropy is used, which is logged so the sample can be redrawn.
+    """
+    seq = np.random.SeedSequence(seed)
+    logger.info("Sampling with seed {}".format(seq.entropy))
+    return seq.spawn(num_workers)
+
+
+def chunks(sampler, N, seed, log=False):
+    """ Draw N passwords with the random stream of a seed, with log2
+    probabilities if log is True.
+
+    Return:
+        a generator of strings with one line per password, in the form
+        password<TAB>probability, each with up to CHUNK_SIZE lines
+    """
+    rng = np.random.default_rng(seed)
+    while N > 0:
+        n = min(N, CHUNK_SIZE)
+        yield ''.join('{}\t{}\n'.format(password, p)
+                      for password, base_struct, p in sampler.sample(n, rng, n, log))
+        N -= n
+
+
+def sample(sampler, N, seed=None, num_workers=1, log=False):
+    """ Draw N passwords with num_workers processes.
+
+    Return:
+        a generator of chunks (see chunks()), in round-robin order of the
+        workers
+    """
+    seeds = worker_seeds(seed, num_workers)
+    counts = shares(N, num_workers)
+
+    if num_workers == 1:
+        yield from chunks(sampler, N, seeds[0], log)
+        return
+
+    # bounded, so that workers don't run far ahead of the output
+    queues = [Queue(maxsize=4) for i in range(num_workers)]
+
+    def do_work(i):
+        for chunk in chunks(sampler, counts[i], seeds[i], log):
+            queues[i].put(chunk)
+        queues[i].put(None)
+
+    pool = [Process(target=do_work, args=(i,)) for i in range(num_workers)]
+    for p in pool:
+        p.start()
+
+    active = list(range(num_workers))
+    while active:
+        for i in list(active):
+            chunk = get_checked(queues[i], pool)
+            if chunk is None:
+                active.remove(i)
+            else:
+                yield chunk
+
+    for p in pool:
+        p.join()
+    check_workers(pool)
+
+
+def sample_to_files(sampler, N, prefix, seed=None, num_workers=1, log=False):
+    """ Same as sample(), but worker i writes its chunks to the file
+    prefix.i. Raises RuntimeError if a worker fails, as its file is then
+    incomplete.
+    """
+    seeds = worker_seeds(seed, num_workers)
+    counts = shares(N, num_workers)
+
+    def do_work(i):
+        with open('{}.{}'.format(prefix, i), 'w') as f:
+            for chunk in chunks(sampler, counts[i], seeds[i], log):
+                f.write(chunk)
+
+    pool = [Process(target=do_work, args=(i,)) for i in range(num_workers)]
+    for p in pool:
+        p.start()
+    for p in pool:
+        p.join()
+    check_workers(pool)
+
+
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     opts = options()
     grammar = model.Grammar.from_files(opts.grammar_dir)
-    for password, base_struct, p in grammar.sample(opts.N):
-        print("{}\t{}".format(password, p))
+    # built once, inherited by the workers
+    sampler = GrammarSampler(grammar)
+
+    if opts.output:
+        sample_to_files(sampler, opts.N, opts.output, opts.seed, opts.workers, opts.log)
+    else:
+        for chunk in sample(sampler, opts.N, opts.seed, opts.workers, opts.log):
+            sys.stdout.write(chunk)
@@ -3,7 +3,8 @@
 import argparse
 import configparser
 import functools
-import pickle
+import math
+import operator
 import re
 import sys
 from collections import deque
@@ -16,6 +17,7 @@ from wordsegment import Segmenter
 
 from learning import model
 from learning.pos import ExhaustiveTagger
+from learning.synsets import SynsetIndex, SYNSET_INDEX_FILE
 from learning.tagset_conversion import TagsetConverter
 
 segmenter = Segmenter()
@@ -72,13 +74,14 @@ def score_segmentation(result):
 
 
 class MemoTagger():
-    def __init__(self, postagger, tc_nouns, tc_verbs, grammar):
+    def __init__(self, postagger, tc_nouns, tc_verbs, grammar, synset_index=None):
         self.postagger = postagger
         self.tc_nouns = tc_nouns
         self.tc_verbs = tc_verbs
         self.grammar = grammar
+        # words missing from the index are looked up in wn
+        self.synset_index = synset_index if synset_index is not None else SynsetIndex()
         self.tagconv = TagsetConverter()
-        self.tag_prob_cache = dict()
 
     @functools.lru_cache(maxsize=10000)
     def get_pos(self, string):
@@ -99,8 +102,9 @@ class MemoTagger():
         tc_model = self.tc_nouns if wnpos == 'n' else self.tc_verbs
 
         syns = [None]
-        for syn in wn.synsets(string, wnpos):
-            syns.extend(tc_model.predict(syn))
+        names = self.synset_index.synsets(string, wnpos, wn)
+        for classes in tc_model.predict_many(names, ()):
+            syns.extend(classes)
 
         return set(syns)
 
@@ -109,27 +113,7 @@ class MemoTagger():
         return self.grammar.tagger._get_tag(string, pos, synset, self.grammar.tagtype)
 
     def prob(self, tag, string):
-        tag_prob_cache = self.tag_prob_cache
-        grammar = self.grammar
-
-        if tag not in tag_prob_cache:
-            tag_prob_cache[tag] = dict()
-            samplesize = sum(grammar.tag_dicts[tag].values())
-            vocabsize = len(grammar.tag_dicts[tag])
-
-            if grammar.estimator == 'laplace':
-                estimator = model.LaplaceEstimator(samplesize, vocabsize, 1)
-            else:
-                estimator = model.MleEstimator(samplesize)
-
-            entries = map(lambda x, e=estimator: (x[0], e.probability(x[1])), grammar.tag_dicts[tag].items())
-
-            tag_prob_cache[tag].update(entries)
-
-        try:
-            return tag_prob_cache[tag][string]
-        except KeyError:
-            return 0
+        return self.grammar.probability_table.prob(tag, string)
 
     @functools.lru_cache(maxsize=10000)
     def get_tags(self, word):
@@ -231,9 +215,13 @@ class GrammarGraph():
 
 
 class PrefixTreeNode():
-    def __init__(self, word, p=0, tag=None, parent=None):
+    def __init__(self, word, p=0, tag=None, parent=None, combine=operator.mul):
+        """ combine is the function (p, p) -> p that gives the probability
+        of a sequence, operator.add for log probabilities.
+        """
         self.word = word
         self.p = p
+        self.combine = combine
         self.parent = parent
         self.children = []
         self.depth = 0
@@ -245,7 +233,7 @@ class PrefixTreeNode():
         self.children.append(node)
         node.parent = self
         node.depth = self.depth + 1
-        node.sequence_p = node.p * self.sequence_p
+        node.sequence_p = self.combine(node.p, self.sequence_p)
         node.base_struct = self.base_struct + node.base_struct
 
     def dfs(self):
@@ -269,11 +257,15 @@ class PrefixTreeNode():
 
 
 def score(passwords, grammar, tc_nouns,
-          tc_verbs, postagger=None, vocab=None):
+          tc_verbs, postagger=None, vocab=None, synset_index=None, log=False):
     """
     For each password finds the most probable rule that outputs
     it, if any. The test is done with a lowercased version of the
     password.
+
+    synset_index is the SynsetIndex saved by training, if any.
+    If log is True, probabilities are log2 (-inf for 0) and are summed
+    rather than multiplied, so long segmentations don't underflow.
     """
 
     if postagger is None:
@@ -281,8 +273,14 @@ def score(passwords, grammar, tc_nouns,
     if vocab is None:
         vocab = grammar.get_vocab()
 
-    memotagger = MemoTagger(postagger, tc_nouns, tc_verbs, grammar)
+    memotagger = MemoTagger(postagger, tc_nouns, tc_verbs, grammar, synset_index)
     base_struct_dist = dict(grammar.base_structure_probabilities())
+
+    if log:
+        combine, zero, one = operator.add, -math.inf, 0.0
+        base_struct_dist = {k: model.log2(p) for k, p in base_struct_dist.items()}
+    else:
+        combine, zero, one = operator.mul, 0, 1
     checker = BaseStructChecker(grammar)
 
     # optimize for ordered lists with repeated passwords
@@ -302,18 +300,18 @@ def score(passwords, grammar, tc_nouns,
             base_struct = 'number' + str(len(password))
             try:
                 print(password, base_struct_dist[base_struct], file=sys.stderr)
-                yield (password, base_struct, base_struct_dist[base_struct])
+                yield (password, base_struct, [password], base_struct_dist[base_struct])
                 continue
             except:
                 pass
 
         segs = deque()
-        root = PrefixTreeNode('', tag=None, p=1)
+        root = PrefixTreeNode('', tag=None, p=one, combine=combine)
         segs.append((root, password))
 
         # leaves = []
 
-        max_p = 0
+        max_p = zero
         max_base_struct = None
         max_segmentation = None
 
@@ -328,6 +326,9 @@ def score(passwords, grammar, tc_nouns,
                         newsplit[1] and newsplit[1][0].isdigit(): continue
 
                 for tag, p in memotagger.get_tags(newsplit[0].lower()):
+                    if log:
+                        p = model.log2(p)
+
                     # if this tag never occurs after the head tag in the grammar
                     # then ignore this split
                     bs = head.base_struct + '(' + tag + ')'
@@ -335,12 +336,12 @@ def score(passwords, grammar, tc_nouns,
                     if not checker.exists(bs):
                         continue
 
-                    newhead = PrefixTreeNode(newsplit[0], tag=tag, p=p)
+                    newhead = PrefixTreeNode(newsplit[0], tag=tag, p=p, combine=combine)
                     head.append_child(newhead)
 
                     if newsplit[1] == '':  # success!
                         if newhead.base_struct in base_struct_dist:
-                            p = newhead.sequence_p * base_struct_dist[newhead.base_struct]
+                            p = combine(newhead.sequence_p, base_struct_dist[newhead.base_struct])
                             if p > max_p:
                                 max_p = p
                                 max_base_struct = newhead.base_struct
@@ -405,6 +406,9 @@ def options():
                         help='produce a match even when a password is capitalized')
     parser.add_argument('--print_split', action='store_true')
     parser.add_argument('--session_name')
+    parser.add_argument('--log',
+                        action='store_true',
+                        help='output log2 probabilities (-inf if not guessed)')
 
     return parser.parse_args()
 
@@ -419,12 +423,17 @@ if __name__ == '__main__':
     accept_capital = opts.capitalized
 
     session_name = opts.session_name
+    zero = -math.inf if opts.log else 0
 
     postagger = ExhaustiveTagger.from_pickle()
-    tc_nouns = pickle.load(open(grammar_dir / 'noun_treecut.pickle', 'rb'))
-    tc_verbs = pickle.load(open(grammar_dir / 'verb_treecut.pickle', 'rb'))
+    tc_nouns = model.TreeCutModel.from_folder(grammar_dir, 'n')
+    tc_verbs = model.TreeCutModel.from_folder(grammar_dir, 'v')
     grammar = model.Grammar.from_files(opts.grammar_dir)
 
+    synset_index = None
+    if (grammar_dir / SYNSET_INDEX_FILE).exists():
+        synset_index = SynsetIndex.load(grammar_dir / SYNSET_INDEX_FILE)
+
     skip = 0
     if session_name:
         progress = load_progress(session_name)
@@ -438,9 +447,10 @@ if __name__ == '__main__':
     # noinspection PyBroadException
     try:
         for password, struct, split, prob in score(passwords, grammar,
-                                                   tc_nouns, tc_verbs, postagger, grammar.get_vocab()):
+                                                   tc_nouns, tc_verbs, postagger, grammar.get_vocab(),
+                                                   synset_index, opts.log):
 
-            if prob == 0:
+            if prob == zero:
                 print(password, struct, prob)
                 continue
 
@@ -458,7 +468,7 @@ if __name__ == '__main__':
                 if opts.print_split:
                     print(password, struct, "\x03".join(split), prob)
                 else:
-                    print(password, None, 0)
+                    print(password, None, zero)
 
             n_processed += 1
 
@@ -10,7 +10,6 @@ Estimate strength as described in Dell'Amico and Filippone (2015)*.
 """
 
 import argparse
-import pickle
 import sys
 from pathlib import Path
 
@@ -64,6 +63,11 @@ def options():
                              'for when each guess is modified by a number of mangling '
                              'rules.')
 
+    parser.add_argument('--log',
+                        action='store_true',
+                        help='probabilities in the sample and in the passwords file '
+                             'are log2 (see sample.py --log and score.py --log)')
+
     return parser.parse_args()
 
 
@@ -83,7 +87,7 @@ def read_sample(f):
                        quoting=3)
 
 
-def password_score_iterator(password_file, grammar_path):
+def password_score_iterator(password_file, grammar_path, log=False):
     if grammar_path is None:
         for line in password_file:
             if line == '': break
@@ -96,12 +100,13 @@ def password_score_iterator(password_file, grammar_path):
     else:
         grammar_dir = Path(grammar_path)
 
-        tc_nouns = pickle.load(open(grammar_dir / 'noun_treecut.pickle', 'rb'))
-        tc_verbs = pickle.load(open(grammar_dir / 'verb_treecut.pickle', 'rb'))
+        tc_nouns = model.TreeCutModel.from_folder(grammar_dir, 'n')
+        tc_verbs = model.TreeCutModel.from_folder(grammar_dir, 'v')
         grammar = model.Grammar.from_files(grammar_path)
 
-        return score((line.lower().rstrip() for line in password_file),
-                     grammar, tc_nouns, tc_verbs)
+        for password, struct, split, p in score((line.lower().rstrip() for line in password_file),
+                                                grammar, tc_nouns, tc_verbs, log=log):
+            yield (password, struct, p)
 
 
 def main():
@@ -121,7 +126,12 @@ def main():
     # process where the grammar's language is output in highest probability order
     # see Session 3.2 in Dell'Amico and Filippone (2015)
     n = len(sample)
-    sample['strength'] = (1 / sample['p']).cumsum() * 1 / n
+    if opts.log:
+        # 1 / p / n = 2 ** (-log2(p) - log2(n))
+        sample['strength'] = np.exp2(-sample['p'] - np.log2(n)).cumsum()
+    else:
+        sample['strength'] = (1 / sample['p']).cumsum() * 1 / n
+    zero = -np.inf if opts.log else 0
 
     # now sort it ascending, cause that's the only way binary search
     # will work in pandas (asc p is desc strength)
@@ -130,8 +140,8 @@ def main():
     # restore index
     sample = sample.reset_index().drop("index", axis=1)
 
-    for password, struct, p in password_score_iterator(opts.passwords, opts.grammar):
-        if p == 0:  # password isn't guessed by this grammar
+    for password, struct, p in password_score_iterator(opts.passwords, opts.grammar, opts.log):
+        if p == zero:  # password isn't guessed by this grammar
             if opts.zeroes:
                 sys.stdout.write("{}\t{:.2f}\n".format(password, 0))
             continue
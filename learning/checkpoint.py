@@ -0,0 +1,99 @@
+"""
+On-disk artifacts for the stages of the training pipeline (tagged chunks,
+tree leaf counts, tree cut models), so that an interrupted training run can
+be resumed from the last completed stage.
+
+Each artifact is a pickle file holding a header followed by the data. The
+header records the format version and the parameters the stage depends on;
+an artifact is only reused when both match.
+"""
+
+import os
+import stat
+import pickle
+import logging
+
+log = logging.getLogger(__name__)
+
+# bump whenever the data stored by a stage changes shape
+FORMAT_VERSION = 2
+
+
+def input_signature(password_file):
+    """ Identify a password file by name, size and modification time, so
+    that artifacts derived from it are not reused for a different input.
+
+    Return None if the input is not a regular file (e.g., stdin or a
+    pipe): its contents can't be told apart from another run's, so
+    nothing derived from it may be checkpointed.
+    """
+    name = getattr(password_file, 'name', None)
+    try:
+        info = os.fstat(password_file.fileno())
+    except (AttributeError, OSError):
+        return None
+
+    if not isinstance(name, str) or not os.path.isfile(name) or \
+            not stat.S_ISREG(info.st_mode):
+        return None
+
+    return {'passwords': os.path.abspath(name),
+            'size': info.st_size,
+            'mtime': info.st_mtime}
+
+
+class Checkpoint(object):
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, stage):
+        return os.path.join(self.folder, stage + '.pickle')
+
+    def _header(self, stage, params):
+        return {'version': FORMAT_VERSION, 'stage': stage, 'params': params}
+
+    def load(self, stage, params):
+        """ Return the artifact saved for a stage, or None if there is none
+        or it was produced with different parameters or format version.
+        """
+        path = self._path(stage)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+            if header != self._header(stage, params):
+                log.info("Checkpoint {} is stale, recomputing it.".format(path))
+                return None
+
+            log.info("Resuming from checkpoint {}".format(path))
+            return pickle.load(f)
+
+    def run(self, stage, params, compute):
+        """ Return the artifact saved for a stage or, if there is none,
+        compute() it and save it. If params is None (see input_signature()),
+        the stage is computed and neither loaded nor saved.
+        """
+        if params is None:
+            log.warning("Input is not a regular file, not checkpointing {}".format(stage))
+            return compute()
+
+        data = self.load(stage, params)
+        if data is None:
+            data = self.save(stage, params, compute())
+        return data
+
+    def save(self, stage, params, data):
+        """ Persist the artifact of a stage. The file is written under a
+        temporary name and then renamed, so a run killed while saving does
+        not leave a truncated artifact behind.
+        """
+        path = self._path(stage)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(self._header(stage, params), f, -1)
+            pickle.dump(data, f, -1)
+        os.replace(path + '.tmp', path)
+
+        return data
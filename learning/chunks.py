@@ -0,0 +1,318 @@
+"""
+A compact, columnar representation for POS-tagged password chunks.
+
+The training pipeline passes tagged passwords between stages. Stored as
+a list of (list of (string, pos), count) tuples, every chunk costs a few
+Python objects, which makes the list several times larger than the raw
+text. TaggedChunks interns strings and POS tags and keeps flat arrays of
+ids instead.
+"""
+
+import os
+import weakref
+from array import array
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from misc.arrays import StringPool
+
+
+class TaggedChunks(object):
+    """ A sequence of tagged passwords stored in flat NumPy arrays:
+
+        tokens    - StringPool of distinct chunk strings
+        pos_tags  - list of distinct POS tags
+        offsets   - chunks of password i are offsets[i]:offsets[i + 1]
+        token_ids - index of each chunk's string in tokens
+        pos_ids   - index of each chunk's tag in pos_tags (-1 for None)
+        counts    - number of occurrences of each password
+
+    Items are (list of (string, pos), count) tuples, as returned by
+    train.tally_chunk_tag(), so consumers can iterate over it like a list.
+    Slicing returns a view that shares the arrays. share() and release()
+    only change the object they are called on and the views taken from it
+    afterwards.
+    """
+
+    _arrays = ('offsets', 'token_ids', 'pos_ids', 'counts')
+
+    # passwords decoded at a time while iterating
+    block_size = 65536
+
+    def __init__(self, tokens, pos_tags, offsets, token_ids, pos_ids, counts,
+                 start=0, stop=None, triples=False):
+        self.tokens = tokens
+        self.pos_tags = pos_tags
+        self.offsets = offsets
+        self.token_ids = token_ids
+        self.pos_ids = pos_ids
+        self.counts = counts
+        self.start = start
+        self.stop = len(counts) if stop is None else stop
+        self.triples = triples
+        self._shm = []  # blocks created by share() on this object
+        self._blocks = []  # blocks holding the arrays, by _named_arrays()
+        self._attached = []  # blocks owned by another process
+        self._views = weakref.WeakSet()  # views sharing the arrays
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def _view(self, start, stop, triples):
+        view = TaggedChunks(StringPool(self.tokens.data, self.tokens.offsets),
+                            self.pos_tags, self.offsets, self.token_ids,
+                            self.pos_ids, self.counts, start, stop, triples)
+        view._blocks = list(self._blocks)
+        view._attached = self._attached
+        view._views = self._views
+        self._views.add(view)
+        return view
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError("TaggedChunks slices must be contiguous")
+            return self._view(self.start + start, self.start + max(start, stop),
+                              self.triples)
+
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        return next(iter(self[i:i + 1]))
+
+    def with_null_synsets(self):
+        """ A view whose items are (list of (string, pos, None), count)
+        tuples, the input format of Grammar.fit().
+        """
+        return self._view(self.start, self.stop, True)
+
+    def __iter__(self):
+        pos_tags = self.pos_tags + [None]  # pos_id -1 is None
+        triples = self.triples
+
+        for block in range(self.start, self.stop, self.block_size):
+            end = min(block + self.block_size, self.stop)
+
+            offsets = self.offsets[block:end + 1]
+            first = offsets[0]
+            offsets = (offsets - first).tolist()
+            token_ids = self.token_ids[first:first + offsets[-1]]
+            pos_ids = self.pos_ids[first:first + offsets[-1]].tolist()
+            counts = self.counts[block:end].tolist()
+
+            tokens = {i: self.tokens[i] for i in np.unique(token_ids).tolist()}
+            token_ids = token_ids.tolist()
+
+            for k, count in enumerate(counts):
+                a, b = offsets[k], offsets[k + 1]
+                if triples:
+                    chunks = [(tokens[t], pos_tags[p], None)
+                              for t, p in zip(token_ids[a:b], pos_ids[a:b])]
+                else:
+                    chunks = [(tokens[t], pos_tags[p])
+                              for t, p in zip(token_ids[a:b], pos_ids[a:b])]
+                yield chunks, count
+
+    def vocabulary(self):
+        """Return the distinct (string, pos) pairs in this sequence."""
+        first, last = self.offsets[self.start], self.offsets[self.stop]
+        n_pos = len(self.pos_tags) + 1
+        keys = np.unique(self.token_ids[first:last].astype(np.int64) * n_pos +
+                         self.pos_ids[first:last] + 1)
+        token_ids, pos_ids = np.divmod(keys, n_pos)
+
+        pos_tags = [None] + self.pos_tags
+        return [(self.tokens[t], pos_tags[p])
+                for t, p in zip(token_ids.tolist(), pos_ids.tolist())]
+
+    def share(self):
+        """ Move the arrays to shared memory (see multiprocessing.shared_memory),
+        so that pickling this object, e.g., to send it to a Pool worker, only
+        pickles the names of the memory blocks. Call release() when done.
+        """
+        if self._shm:
+            return self
+
+        for obj, name in self._named_arrays():
+            arr = getattr(obj, name)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            shared = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+            shared[:] = arr
+            setattr(obj, name, shared)
+            self._shm.append(shm)
+
+        self._blocks = list(self._shm)
+        # views taken before keep the private arrays
+        self._views.discard(self)
+        self._views = weakref.WeakSet()
+        return self
+
+    def release(self):
+        """ Free the shared memory blocks allocated by share(), copying the
+        arrays back to private memory. The views taken since share() get
+        the private copies too, but arrays taken from any of them, e.g.,
+        by iterating, must no longer be in use.
+        """
+        if not self._shm:
+            return
+
+        arrays = [np.array(getattr(obj, name)) for obj, name in self._named_arrays()]
+        for chunks in [self] + list(self._views):
+            for (obj, name), arr in zip(chunks._named_arrays(), arrays):
+                setattr(obj, name, arr)
+            chunks._blocks = []
+
+        for shm in self._shm:
+            shm.unlink()
+            shm.close()
+        del self._shm[:]
+
+    def close(self):
+        """ Close the shared memory blocks attached when this object was
+        unpickled, e.g., in a Pool worker, once it is no longer used. The
+        blocks remain available to the process that called share().
+        """
+        if not self._attached:
+            return
+
+        for chunks in [self] + list(self._views):
+            for obj, name in chunks._named_arrays():
+                setattr(obj, name, None)
+            chunks._blocks = []
+        for shm in self._attached:
+            try:
+                shm.close()
+            except BufferError:  # arrays taken from it are still in use
+                pass
+        del self._attached[:]
+
+    def _named_arrays(self):
+        return [(self, name) for name in self._arrays] + \
+               [(self.tokens, 'data'), (self.tokens, 'offsets')]
+
+    def __getstate__(self):
+        if self._blocks:
+            arrays = [getattr(obj, name) for obj, name in self._named_arrays()]
+            blocks = [(shm.name, arr.dtype.str, arr.shape)
+                      for shm, arr in zip(self._blocks, arrays)]
+            return {'pos_tags': self.pos_tags, 'start': self.start,
+                    'stop': self.stop, 'triples': self.triples,
+                    'blocks': blocks, 'tracker': _tracker_id()}
+
+        # only pickle the rows of this view
+        first, last = self.offsets[self.start], self.offsets[self.stop]
+        return {'pos_tags': self.pos_tags, 'start': 0,
+                'stop': len(self), 'triples': self.triples,
+                'tokens': (self.tokens.data, self.tokens.offsets),
+                'offsets': self.offsets[self.start:self.stop + 1] - first,
+                'token_ids': self.token_ids[first:last],
+                'pos_ids': self.pos_ids[first:last],
+                'counts': self.counts[self.start:self.stop]}
+
+    def __setstate__(self, d):
+        self.pos_tags = d['pos_tags']
+        self.start = d['start']
+        self.stop = d['stop']
+        self.triples = d['triples']
+        self._shm = []
+        self._blocks = []
+        self._attached = []
+        self._views = weakref.WeakSet()
+
+        if 'blocks' in d:
+            arrays = []
+            for name, dtype, shape in d['blocks']:
+                shm = _attach(name, d['tracker'])
+                arrays.append(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+                # keep a reference, or the buffer is unmapped
+                self._attached.append(shm)
+            self._blocks = list(self._attached)
+            offsets, token_ids, pos_ids, counts, data, token_offsets = arrays
+        else:
+            offsets, token_ids, pos_ids, counts = \
+                [d[name] for name in self._arrays]
+            data, token_offsets = d['tokens']
+
+        self.tokens = StringPool(data, token_offsets)
+        self.offsets = offsets
+        self.token_ids = token_ids
+        self.pos_ids = pos_ids
+        self.counts = counts
+
+
+def _tracker_id():
+    """ Identify the resource tracker of this process by its pipe, which
+    processes started with multiprocessing inherit.
+    """
+    if os.name != 'posix':  # shared memory is only tracked on POSIX
+        return None
+    info = os.fstat(resource_tracker.getfd())
+    return info.st_dev, info.st_ino
+
+
+def _attach(name, tracker):
+    """ Attach the shared memory block created by another process, whose
+    resource tracker is identified by tracker (see _tracker_id()), without
+    tracking it: the creator unlinks it, and another tracker would report it
+    as leaked, or unlink it, when this process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 always tracks it
+        shm = shared_memory.SharedMemory(name=name)
+        # the registration of a shared tracker is the creator's
+        if tracker is not None and _tracker_id() != tracker:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class TaggedChunksBuilder(object):
+    """ Accumulates (list of (string, pos), count) tuples, interning strings
+    and POS tags, and builds a TaggedChunks.
+    """
+
+    def __init__(self):
+        self.token_index = dict()
+        self.pos_index = dict()
+        self.offsets = array('q', [0])
+        self.token_ids = array('i')
+        self.pos_ids = array('i')
+        self.counts = array('q')
+
+    def append(self, chunks, count):
+        token_index = self.token_index
+        pos_index = self.pos_index
+
+        for string, pos in chunks:
+            t = token_index.get(string)
+            if t is None:
+                t = token_index[string] = len(token_index)
+            if pos is None:
+                p = -1
+            else:
+                p = pos_index.get(pos)
+                if p is None:
+                    p = pos_index[pos] = len(pos_index)
+            self.token_ids.append(t)
+            self.pos_ids.append(p)
+
+        self.offsets.append(len(self.token_ids))
+        self.counts.append(count)
+
+    def extend(self, items):
+        for chunks, count in items:
+            self.append(chunks, count)
+
+    def build(self):
+        tokens = StringPool.from_strings(self.token_index.keys())
+        pos_tags = list(self.pos_index.keys())
+
+        return TaggedChunks(tokens, pos_tags,
+                            np.frombuffer(self.offsets, dtype=np.int64),
+                            np.frombuffer(self.token_ids, dtype=np.int32),
+                            np.frombuffer(self.pos_ids, dtype=np.int32),
+                            np.frombuffer(self.counts, dtype=np.int64))
@@ -1,10 +1,15 @@
-from learning.tree.wordnet import IndexedWordNetTree
-from learning.tree.default_tree import TreeCut
-from learning.tree.cut import wagner, li_abe
+from learning.tree.wordnet import IndexedWordNetTree, ArrayWordNetTree
+from learning.tree.default_tree import TreeCut, ArrayTreeCut
+from learning.tree.cut import wagner, li_abe, SearchState
+from learning.tree.array_tree import ArrayTree
+from learning.sampler import GrammarSampler
 from collections import defaultdict, Counter
+from collections.abc import Mapping
 from multiprocessing import Process, Manager, Pool, Queue
 
 from misc import util
+from misc.arrays import save_packed, load_packed, is_packed, StringPool, HashIndex, \
+    reduce_segments
 
 import shutil
 import re
@@ -14,10 +19,23 @@ import logging
 import numpy as np
 import pickle
 import math
+import numbers
+import itertools
 import multiprocessing
+import array
 
 log = logging.getLogger(__name__)
 
+# first bytes and version of the files written by TreeCutModel.save()
+TREECUT_MAGIC = b'TREECUT\0'
+TREECUT_VERSION = 2
+
+# first bytes and version of the files written by CompactGrammar.save()
+GRAMMAR_MAGIC = b'GRAMMAR\0'
+GRAMMAR_VERSION = 1
+# name of that file in a grammar folder
+GRAMMAR_FILE = 'grammar.bin'
+
 
 class TreeCutModel():
     def __init__(self, pos='n', estimator='mle', specificity=None):
@@ -30,6 +48,7 @@ class TreeCutModel():
         self.treecut = None
         self.specificity = specificity
         self.estimator = estimator
+        self._search_state = None  # see update()
 
     def fit(self, X):
         """ Fit a tree cut model.
@@ -63,25 +82,123 @@ class TreeCutModel():
 
         self.treecut = TreeCut(tree, cut)
 
-    def fit_tree(self, tree):
+    def fit_tree(self, tree, dirty=None, num_workers=1):
+        """ Fit a tree cut model to a tree whose counts are up to date.
+
+        Args:
+          tree: a tree, e.g., ArrayWordNetTree, whose counts were updated
+            with updateCounts()
+          dirty: optional - if tree is an ArrayTree already fitted by this
+            model, the ids of the nodes whose values changed since, so that
+            only their cut decisions and their ancestors' are re-evaluated
+          num_workers: number of processes that search subtrees of the
+            tree in parallel
+        """
         pos = self.pos
         specificity = self.specificity
         self.tree = tree
 
-        N = tree.root.value
-        if self.estimator == 'mle':
-            estimator = MleEstimator(N)
+        estimator = self._tree_estimator(tree)
+
+        if isinstance(tree, ArrayTree):
+            if dirty is None or self._search_state is None:
+                self._search_state = SearchState()
+            state = self._search_state
         else:
-            k = tree.root.leaf_count
-            estimator = LaplaceEstimator(N, k, 1)
+            state = dirty = None
 
         if specificity:
-            cut = wagner.findcut(tree, specificity, estimator)
+            cut = wagner.findcut(tree, specificity, estimator, state, dirty, num_workers)
         else:
-            cut = li_abe.findcut(tree, estimator)
+            cut = li_abe.findcut(tree, estimator, state, dirty, num_workers)
 
         self.treecut = TreeCut(tree, cut)
 
+    def update(self, X):
+        """ Add synset counts to a fitted model and refit its tree cut.
+        The result is the model that fit() would return for the original
+        counts plus X.
+
+        Only the values of the leaves of the synsets in X and of their
+        ancestors are recomputed. Cut decisions are re-evaluated on those
+        ancestors only if the sample size is unchanged (e.g., counts were
+        moved between synsets). Otherwise, since description lengths
+        depend on the sample size, every decision is re-evaluated.
+
+        Args:
+          X: An iterable for tuples of the form (synset, count), where
+            synset is a wordnet.Synset or a synset name.
+
+        Returns:
+          self
+        """
+        tree = self.tree
+        if not isinstance(tree, ArrayTree):
+            # e.g., a model pickled before trees were stored as arrays
+            tree = ArrayTree.from_tree(tree)
+            tree.updateCounts()
+            self._search_state = None
+
+        samplesize = tree.root.value
+
+        changed = set()
+        for synset, count in X:
+            key = synset if isinstance(synset, str) else synset.name()
+            if key not in tree.ids:
+                log.warning("{} is not in the tree".format(key))
+                continue
+
+            ids = tree.ids[key]
+            count = float(count) / len(ids)
+            for n in tree.index[key]:
+                if n.has_children():
+                    n = n.find('s.' + n.key)
+                n.increment_value(count, cumulative=False)
+                changed.add(n.id)
+
+        tree.updateAncestors(changed)
+
+        dirty = changed if tree.root.value == samplesize else None
+        self.fit_tree(tree, dirty)
+
+        return self
+
+    @classmethod
+    def sweep(cls, tree, specificities, pos='n', estimator='mle'):
+        """ Fit one model per specificity (the weight of the Wagner variant)
+        with a single traversal of a tree whose counts are up to date.
+
+        Returns:
+            a list of TreeCutModel, in the order of specificities
+        """
+        models = [cls(pos, estimator, specificity) for specificity in specificities]
+        if not models:
+            return models
+
+        cuts = wagner.findcuts(tree, specificities, models[0]._tree_estimator(tree))
+
+        for model, cut in zip(models, cuts):
+            model.tree = tree
+            model.treecut = TreeCut(tree, cut)
+
+        return models
+
+    def _tree_estimator(self, tree):
+        N = tree.root.value
+        if self.estimator == 'mle':
+            return MleEstimator(N)
+        else:
+            k = tree.root.leaf_count
+            return LaplaceEstimator(N, k, 1)
+
+    @property
+    def classes(self):
+        """ A mapping from synset names to the tuple of keys of the classes
+        that represent them in the tree cut model, i.e., predict() for
+        every synset in the tree (see TreeCut.class_table()).
+        """
+        return self.treecut.class_table()
+
     def predict(self, X):
         """
         For each synset, return a list of classes that represent it in the tree
@@ -89,25 +206,37 @@ class TreeCutModel():
         multiple subtrees (multiple inheritance).
 
         Args:
-            X - an iterable or a wordnet.Synset
+            X - an iterable or a wordnet.Synset or a synset name (str)
 
         Return:
             if X is an iterable, return a list of lists of node keys (str)
-            if X is a Synset, return a list of node keys (str)
+            if X is a Synset or a name, return a list of node keys (str)
         """
+        classes = self.classes
 
         try:
+            if isinstance(X, str):
+                raise TypeError
             iter(X)
         except:
-            return list(set([node.key for node in self.treecut.abstract_synset(X)]))
+            return list(classes[_synset_name(X)])
 
-        labels = []
+        return [list(classes[_synset_name(synset)]) for synset in X]
 
-        for synset in X:
-            keys = set([node.key for node in self.treecut.abstract_synset(synset)])
-            labels.append(list(keys))
+    def predict_many(self, names, default=None):
+        """ Like predict() for many synsets at once, without building a
+        list per synset: tuples are returned, as found in the class table
+        (see classes).
 
-        return labels
+        Args:
+            names - an iterable of synset names (str)
+            default - returned for names that are not in the tree
+
+        Return:
+            a list with a tuple of node keys (str) for each name
+        """
+        get = self.classes.get
+        return [get(name, default) for name in names]
 
     def _increment_synset_count(self, synset, count=1):
         """ Given  a  WordNetTree, increases the  count  (frequency)
@@ -156,6 +285,7 @@ class TreeCutModel():
         self.specificity = d['specificity']
         self.estimator = d['estimator']
         self.tree = self.treecut.tree
+        self._search_state = None
 
     def pickle(self, outfolder):
         name = 'noun_treecut.pickle' if self.pos == 'n' else 'verb_treecut.pickle'
@@ -165,7 +295,104 @@ class TreeCutModel():
 
     @classmethod
     def from_pickle(cls, f):
-        return pickle.load(open(f, 'rb'))
+        """Load a model from a pickle or from a file written by save()."""
+        return cls.load(f)
+
+    @staticmethod
+    def filename(pos, specificity=None, ext='.tcm'):
+        """ Name of the file of a model in a grammar folder, e.g.,
+        noun_treecut.tcm or, for models saved by a sweep, noun_treecut.a5.tcm
+        """
+        name = 'noun_treecut' if pos == 'n' else 'verb_treecut'
+        if specificity is not None:
+            name += '.a{}'.format(specificity)
+        return name + ext
+
+    def save(self, path):
+        """ Save the model to a file that load() memory-maps: the arrays
+        of the tree (see ArrayTree), of the leaf -> cut mapping and of the
+        class table (see ArrayTreeCut), so that loading and the first
+        predict() take no time regardless of the size of the tree.
+        """
+        treecut = ArrayTreeCut.from_treecut(self.treecut)
+
+        arrays = treecut.tree.to_arrays()
+        arrays['cut_ids'] = treecut.node_ids
+        arrays['leaf_keys'] = treecut.leaf_keys
+        arrays['leaf_ptr'] = treecut.leaf_ptr
+        arrays['leaf_cut'] = treecut.leaf_cut
+        arrays['class_names'], arrays['class_ptr'], arrays['class_cut'] = \
+            treecut.class_arrays()
+
+        meta = {
+            'pos': self.pos,
+            'specificity': self.specificity,
+            'estimator': self.estimator
+        }
+
+        save_packed(path, TREECUT_MAGIC, TREECUT_VERSION, arrays, meta)
+
+    @classmethod
+    def load(cls, path):
+        """ Load a model saved with save() or pickled (older grammars).
+        The tree of a saved model is memory-mapped: its structure is
+        shared by every process that loads it and values are
+        copy-on-write (see ArrayTree.load()).
+        """
+        if not is_packed(path, TREECUT_MAGIC):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+
+        version, meta, arrays = load_packed(path, TREECUT_MAGIC,
+                                            ArrayTree._copy_on_write)
+        if version > TREECUT_VERSION:
+            raise ValueError("{} has version {} of the tree cut format, "
+                             "this version reads up to {}".format(
+                                 path, version, TREECUT_VERSION))
+
+        tree = ArrayWordNetTree.from_arrays(arrays)
+        tree.pos = meta['pos']
+
+        model = cls(meta['pos'], meta['estimator'], meta['specificity'])
+        model.tree = tree
+        # version 1 has no class table, it is built on first use
+        class_arrays = None if version < 2 else \
+            (arrays['class_names'], arrays['class_ptr'], arrays['class_cut'])
+        model.treecut = ArrayTreeCut(tree, arrays['cut_ids'], arrays['leaf_keys'],
+                                     arrays['leaf_ptr'], arrays['leaf_cut'],
+                                     class_arrays)
+        return model
+
+    @classmethod
+    def from_folder(cls, folder, pos):
+        """ Load the noun (pos='n') or verb (pos='v') model of a grammar
+        folder, saved with save() or, in older grammars, pickled. Return
+        None if the grammar has no such model.
+        """
+        for ext in ('.tcm', '.pickle'):
+            path = os.path.join(folder, cls.filename(pos, ext=ext))
+            if os.path.exists(path):
+                return cls.load(path)
+        return None
+
+
+def _synset_name(synset):
+    return synset if isinstance(synset, str) else synset.name()
+
+
+def log2(p):
+    """Return the log2 of a probability, -inf for 0."""
+    return math.log2(p) if p > 0 else -math.inf
+
+
+def joint_probability(probs, log=False):
+    """ Return the probability of independent events, given their
+    probabilities. If log is True, return its log2, as the sum of the
+    log2 of the probabilities, which doesn't underflow.
+    """
+    if log:
+        return math.fsum(map(log2, probs))
+    return math.prod(probs)
 
 
 class Estimator(object):
@@ -182,8 +409,16 @@ class MleEstimator(Estimator):
         """
         self.n = n
 
-    def probability(self, x):
-        if type(x) == int or type(x) == float:
+    def probability(self, x, leaf_counts=None):
+        """
+        @params:
+            x - a frequency (any number, including NumPy scalars), a node
+                or an array of frequencies
+            leaf_counts - ignored, see LaplaceEstimator.probability()
+        """
+        if isinstance(x, np.ndarray):
+            return x / self.n
+        elif isinstance(x, numbers.Number):
             return self._probability(x, self.n)
         else:
             return self.node_probability(x)
@@ -212,8 +447,18 @@ class LaplaceEstimator(Estimator):
         self.k = k
         self.alpha = alpha
 
-    def probability(self, x):
-        if type(x) == int or type(x) == float:
+    def probability(self, x, leaf_counts=None):
+        """
+        @params:
+            x - a frequency (any number, including NumPy scalars), a node
+                or an array of frequencies
+            leaf_counts - optional - if x is an array, the # of classes
+                (leaves) of each element, 1 by default
+        """
+        if isinstance(x, np.ndarray):
+            c = 1 if leaf_counts is None else leaf_counts
+            return self._probability(x, c, self.n, self.k, self.alpha)
+        elif isinstance(x, numbers.Number):
             return self._probability(x, 1, self.n, self.k, self.alpha)
         else:
             return self.node_probability(x)
@@ -224,6 +469,8 @@ class LaplaceEstimator(Estimator):
         return self._probability(f, c, self.n, self.k, self.alpha)
 
     def _probability(self, f, c, n, k, alpha, *args):
+        if isinstance(f, np.ndarray):
+            return (f + c * alpha) / (n + k * alpha)
         return float(f + c * alpha) / (n + k * alpha)
 
 
@@ -397,10 +644,191 @@ class Processor(object):
 
             base_structures[base_structure] += count
 
+        if hasattr(data, 'close'):  # a TaggedChunks in shared memory
+            data.close()
+
         # log.info("Process {} has done its share. Time to rest.".format(process_id))
         return (tags, base_structures)
 
 
+class VariationCounter(object):
+    """ Accumulates the tag and base structure counts of passwords whose
+    chunks have several semantic variations, e.g., one per synset of an
+    ambiguous noun.
+
+    A password with chunk variations X[0], ..., X[n-1] stands for every
+    combination in the cross product of the X[i], each weighted by
+    count / (|X[0]| * ... * |X[n-1]|). Rather than enumerating the
+    combinations, the count of a tag in position i is derived directly
+    as count / |X[i]|, and base structures are built from the distinct
+    tags of each position.
+    """
+
+    def __init__(self, tagger, tagtype):
+        self.tagger = tagger
+        self.tagtype = tagtype
+        self.tags = defaultdict(Counter)
+        self.base_structures = Counter()
+
+    def add(self, X, count):
+        """
+        Args:
+            X - a list of lists of tuples (string, pos, str(synset)). X[i]
+                holds the variations of chunk i, which share the same string.
+            count - the number of occurrences of the password
+        """
+        if len(X) == 0:
+            return
+
+        n_variations = 1
+        positions = []  # (string, Counter of tags) of each chunk
+        for chunkset in X:
+            n_variations *= len(chunkset)
+            tags = Counter()
+            for string, pos, synset in chunkset:
+                tags[self.tagger._get_tag(string, pos, synset, self.tagtype)] += 1
+            positions.append((chunkset[0][0], tags))
+
+        # the variations of a single chunk are not split, each counts in full
+        single = len(X) == 1
+        weight = count if single else count / n_variations
+
+        for (string, tags), chunkset in zip(positions, X):
+            share = count if single else count / len(chunkset)
+            for tag, multiplicity in tags.items():
+                self.tags[tag][string] += share * multiplicity
+
+        structures = [list(tags.items()) for string, tags in positions]
+        for combination in itertools.product(*structures):
+            base_structure = ''
+            multiplicity = 1
+            for tag, m in combination:
+                base_structure += '({})'.format(tag)
+                multiplicity *= m
+            self.base_structures[base_structure] += weight * multiplicity
+
+
+class ProbabilityTable(object):
+    """ The probability of every terminal of every tag of a grammar,
+    computed once from its counts and then read-only. Rows are grouped by
+    tag, in decreasing order of probability within a tag:
+
+        tags       - name of each tag, by tag id
+        samplesize - sum of the counts of the terminals of each tag
+        vocabsize  - number of terminals of each tag
+        tag_ptr    - the rows of tag t are tag_ptr[t]:tag_ptr[t + 1]
+        keys       - StringPool with 'tag<TAB>terminal', by row
+        probs      - probability of the terminal of each row
+        index      - HashIndex of keys
+
+    Tags never contain tabs, but terminals may, as password segments are
+    taken as they are: keys are split at their first tab only.
+    """
+
+    def __init__(self, estimator, tags, samplesize, vocabsize, tag_ptr, keys, probs,
+                 index=None):
+        self.estimator = estimator
+        self.tags = tags
+        self.tag_ids = {tag: i for i, tag in enumerate(tags)}
+        self.samplesize = samplesize
+        self.vocabsize = vocabsize
+        self.tag_ptr = tag_ptr
+        self.keys = keys
+        self.probs = probs
+        self.index = index if index is not None else HashIndex(keys)
+        self._cache = util.LRUCache(2 ** 16)
+
+    @classmethod
+    def from_grammar(cls, grammar):
+        tags = list(grammar.tag_dicts.keys())
+        samplesize = np.zeros(len(tags))
+        vocabsize = np.zeros(len(tags), dtype=np.int64)
+        keys = []
+        probs = []
+
+        for t, tag in enumerate(tags):
+            terminals = grammar.tag_dicts[tag]
+            counts = np.fromiter(terminals.values(), dtype=np.float64, count=len(terminals))
+            order = np.argsort(-counts, kind='stable')
+            samplesize[t] = sum(terminals.values())
+            vocabsize[t] = len(terminals)
+
+            estimator = _tag_estimator(grammar.estimator, samplesize[t].item(), len(terminals))
+            probs.append(estimator.probability(counts[order]))
+            words = list(terminals.keys())
+            keys.extend('{}\t{}'.format(tag, words[i]) for i in order.tolist())
+
+        tag_ptr = np.zeros(len(tags) + 1, dtype=np.int64)
+        np.cumsum(vocabsize, out=tag_ptr[1:])
+        probs = np.concatenate(probs) if probs else np.zeros(0)
+
+        return cls(grammar.estimator, tags, samplesize, vocabsize, tag_ptr,
+                   StringPool.from_strings(keys), probs)
+
+    def tag_estimator(self, tag):
+        """Return the estimator of the probabilities of the terminals of a tag."""
+        t = self.tag_ids.get(tag)
+        if t is None:
+            return _tag_estimator(self.estimator, 0, 0)
+        return _tag_estimator(self.estimator, self.samplesize[t].item(),
+                              self.vocabsize[t].item())
+
+    def prob(self, tag, string):
+        """Return the probability of a terminal of a tag, 0 if it has none."""
+        key = (tag, string)
+        p = self._cache.get(key)
+        if p is None:
+            row = self.index.find('{}\t{}'.format(tag, string))
+            p = self.probs[row].item() if row >= 0 else 0
+            self._cache.put(key, p)
+        return p
+
+    def probs_many(self, tags, strings):
+        """ Like prob() for many pairs of tags and terminals at once.
+
+        Return:
+            an array with the probability of each pair
+        """
+        rows = self.index.find_many(['{}\t{}'.format(tag, string)
+                                     for tag, string in zip(tags, strings)])
+        probs = np.zeros(len(rows))
+        found = rows >= 0
+        probs[found] = self.probs[rows[found]]
+        return probs
+
+    def rows(self, tag):
+        """Return the range of rows of a tag (empty for unknown tags)."""
+        t = self.tag_ids.get(tag)
+        if t is None:
+            return range(0)
+        return range(self.tag_ptr[t], self.tag_ptr[t + 1])
+
+    def terminals(self, rows):
+        """Return the terminal of each row in a range of rows."""
+        keys = StringPool(self.keys.data, self.keys.offsets[rows.start:rows.stop + 1])
+        return [key.split('\t', 1)[1] for key in keys.tolist()]
+
+    def items(self, tag):
+        """Return a list of (terminal, probability) of a tag, most probable first."""
+        rows = self.rows(tag)
+        return list(zip(self.terminals(rows), self.probs[rows.start:rows.stop].tolist()))
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        del d['_cache']
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self._cache = util.LRUCache(2 ** 16)
+
+
+def _tag_estimator(estimator, samplesize, vocabsize):
+    if estimator == 'laplace':
+        return LaplaceEstimator(samplesize, vocabsize, 1)
+    return MleEstimator(samplesize)
+
+
 class Grammar(object):
 
     def __init__(self, tagtype='backoff', estimator='mle'):
@@ -417,7 +845,19 @@ class Grammar(object):
         self.lowres = None
         self.tagtype = tagtype
 
+        self._table = None
+
+    @property
+    def probability_table(self):
+        """ The ProbabilityTable of this grammar. It is computed on first
+        use after the counts change and saved with the grammar.
+        """
+        if getattr(self, '_table', None) is None:
+            self._table = ProbabilityTable.from_grammar(self)
+        return self._table
+
     def add_vocabulary(self, vocab):
+        self._table = None
         tagger = GrammarTagger()
         for string, pos, synset in vocab:
             tag = tagger._get_tag(string, pos, synset, self.tagtype)
@@ -431,14 +871,7 @@ class Grammar(object):
         return vocab
 
     def _get_tag_prob_estimator(self, tag):
-        samplesize = sum(self.tag_dicts[tag].values())
-        vocabsize = len(self.tag_dicts[tag])
-        if self.estimator == 'laplace':
-            estimator = LaplaceEstimator(samplesize, vocabsize, 1)
-        else:
-            estimator = MleEstimator(samplesize)
-
-        return estimator
+        return self.probability_table.tag_estimator(tag)
 
     def fit_parallel(self, X, num_workers=4):
         import gc
@@ -456,18 +889,28 @@ class Grammar(object):
         i = 0
         for result in pool.imap(Processor(tagger, self.tagtype), x_gen):
             tag_results, base_struct_results = result
-            for base_struct, count in base_struct_results.items():
-                self.base_structures[base_struct] += count
-                self.counter += count
-            for tag, terminals in tag_results.items():
-                # log.info("tag: %s" % tag)
-                for string, count in terminals.items():
-                    self.tag_dicts[tag][string] += count
+            self.merge(tag_results, base_struct_results)
             i += 1
             log.info("Processed {}/{} result batches...".format(i, num_parts))
 
         log.info("Fitting completed.")
 
+    def merge(self, tags, base_structures):
+        """ Add tag and base structure counts, e.g., computed by a worker,
+        to this grammar.
+
+        Args:
+            tags - a dict mapping tags to Counters of strings
+            base_structures - a Counter of base structures
+        """
+        self._table = None
+        for base_struct, count in base_structures.items():
+            self.base_structures[base_struct] += count
+            self.counter += count
+        for tag, terminals in tags.items():
+            for string, count in terminals.items():
+                self.tag_dicts[tag][string] += count
+
     def fit(self, X, num_workers=None):
         if num_workers:
             self.fit_parallel(X, num_workers)
@@ -482,6 +925,7 @@ class Grammar(object):
             x - a list of tuples in the form (string, pos, str(synset))
         """
         log.debug(x)
+        self._table = None
         base_structure = ''
         for string, pos, synset in x:
             tag = self.tagger._get_tag(string, pos, synset, self.tagtype)
@@ -491,102 +935,44 @@ class Grammar(object):
         self.base_structures[base_structure] += count
         log.debug(base_structure)
 
-    def sample(self, N):
+    def sample(self, N, rng=None, log=False):
         """ Sample N observations from this probabilistic model.
 
+        Args:
+            N - number of observations
+            rng - optional - a numpy.random.Generator
+            log - if True, return log2 probabilities
+
         Return:
-            list of tuples (password, base_struct, probability)
-        """
-        # Prepare data structures for fast-ish sampling
-
-        base_structs = []
-        base_struct_probs = []
-        tag2words = dict()  # tag2words['jj'] = ['hot', 'cold', ...]
-        tag2probs = dict()  # tag2probs['jj'] = np.array([.1, .005, ...])
-
-        for k, v in self.base_structures.items():
-            base_structs.append(k)
-            base_struct_probs.append(v)
-        base_struct_probs = np.array(base_struct_probs)
-        base_struct_probs = base_struct_probs / np.sum(base_struct_probs)  # calculate MLE
-
-        for tag, v in self.tag_dicts.items():
-            W = []
-            P = []
-            estimator = self._get_tag_prob_estimator(tag)
-            for word, count in v.items():
-                W.append(word)
-                P.append(estimator.probability(count))
-            tag2words[tag] = W
-            tag2probs[tag] = P
-
-        # Sample
-
-        base_struct_sample_indices = np.random.choice(  # sample from base structures
-            len(base_structs), size=N,
-            replace=True, p=base_struct_probs
-        )
-
-        # outcomes = []                            # final sample outcome:
-        #                                          # list of tuples (string, prob)
-
-        for i in base_struct_sample_indices:  # for each base structure,
-            base_struct = base_structs[i]  # sample a word from each of its tags
-            outcome = ''  # one sampling outcome
-            outcome_prob = base_struct_probs[i]
-
-            for tag in re.findall(r'\(([^()]+)\)', base_struct):
-                pdist = tag2probs[tag]
-                j = np.random.choice(len(pdist), replace=True, p=pdist)
-                outcome += tag2words[tag][j]
-                outcome_prob *= pdist[j]
-
-            yield (outcome, base_struct, outcome_prob)
+            generator of tuples (password, base_struct, probability)
+        """
+        return GrammarSampler(self).sample(N, rng, log=log)
 
-    def predict(self, X):
+    def predict(self, X, log=False):
         """
         A generator that returns the probabilities of strings under
         this grammar.
 
         Args:
             X - a list of lists of tuples in the form (string, pos, str(synset))
+            log - if True, return log2 probabilities (-inf for 0)
         """
-
-        tag_prob_cache = dict()  # tag_prob_cache[tag][word] = p
-
-        def prob(tag, string):
-            if tag not in tag_prob_cache:
-                tag_prob_cache[tag] = dict()
-                samplesize = sum(self.tag_dicts[tag].values())
-                vocabsize = len(self.tag_dicts[tag].keys())
-
-                if self.estimator == 'laplace':
-                    estimator = LaplaceEstimator(samplesize, vocabsize, 1)
-                else:
-                    estimator = MleEstimator(samplesize)
-
-                for k, count in self.tag_dicts[tag].items():
-                    tag_prob_cache[tag][k] = estimator.probability(count)
-
-            try:
-                return tag_prob_cache[tag][string]
-            except KeyError:
-                return 0
+        prob = self.probability_table.prob
 
         for x in X:
             base_structure = ''
-            p = 1
+            probs = []
             for string, pos, synset in x:
                 tag = self.tagger._get_tag(string, pos, synset, self.tagtype)
                 base_structure += '({})'.format(tag)
 
-                p *= prob(tag, string)
+                probs.append(prob(tag, string))
 
-            p *= self.base_structures[base_structure] / self.counter
+            probs.append(self.base_structures[base_structure] / self.counter)
 
-            yield p
+            yield joint_probability(probs, log)
 
-    def predict_async(self):
+    def predict_async(self, log=False):
         """
         An asynchronous generator that returns the probabilities of
         strings under this grammar. This is useful for when the next
@@ -600,42 +986,69 @@ class Grammar(object):
 
         Args:
             x - a list of tuples in the form (string, pos, str(synset))
+            log - if True, return log2 probabilities (-inf for 0)
         """
-
-        tag_prob_cache = dict()  # tag_prob_cache[tag][word] = p
-
-        def prob(tag, string):
-            if tag not in tag_prob_cache:
-                tag_prob_cache[tag] = dict()
-                samplesize = sum(self.tag_dicts[tag].values())
-                vocabsize = len(self.tag_dicts[tag].keys())
-
-                if self.estimator == 'laplace':
-                    estimator = LaplaceEstimator(samplesize, vocabsize, 1)
-                else:
-                    estimator = MleEstimator(samplesize)
-
-                for k, count in self.tag_dicts[tag].items():
-                    tag_prob_cache[tag][k] = estimator.probability(count)
-
-            try:
-                return tag_prob_cache[tag][string]
-            except KeyError:
-                return 0
+        prob = self.probability_table.prob
 
         while True:
             x = yield
             base_structure = ''
-            p = 1
+            probs = []
             for string, pos, synset in x:
                 tag = self.tagger._get_tag(string, pos, synset, self.tagtype)
                 base_structure += '({})'.format(tag)
 
-                p *= prob(tag, string)
+                probs.append(prob(tag, string))
+
+            probs.append(self.base_structures[base_structure] / self.counter)
 
-            p *= self.base_structures[base_structure] / self.counter
+            yield joint_probability(probs, log)
 
-            yield p
+    def predict_many(self, strings, pos, synsets, lengths, log=False):
+        """ Same as predict() for many passwords at once, given as columns:
+        the segments of every password, one after the other.
+
+        Example:
+            > grammar.predict_many(['hot', 'dogs', '123'],
+                                   ['jj', 'nn2', None],
+                                   [None, 's.dog.n.01', None],
+                                   [2, 1])  # 'hotdogs' and '123'
+
+        Args:
+            strings - the string of each segment
+            pos - the POS tag of each segment (None if it has none)
+            synsets - the synset of each segment (None if it has none)
+            lengths - the number of segments of each password
+            log - if True, return log2 probabilities (-inf for 0)
+
+        Return:
+            an array with the probability of each password
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+
+        # tag and look up each distinct segment once
+        segments = list(zip(strings, pos, synsets))
+        distinct = list(dict.fromkeys(segments))
+        distinct_ids = {segment: i for i, segment in enumerate(distinct)}
+        tags = [self.tagger._get_tag(string, pos, synset, self.tagtype)
+                for string, pos, synset in distinct]
+        probs = self.probability_table.probs_many(tags, [s[0] for s in distinct])
+
+        segment_ids = np.fromiter((distinct_ids[s] for s in segments), dtype=np.int64,
+                                  count=len(segments))
+
+        # base structures, from the tags of the segments of each password
+        segment_tags = iter([tags[i] for i in segment_ids.tolist()])
+        structs = ['({})'.format(')('.join(itertools.islice(segment_tags, k))) if k else ''
+                   for k in lengths.tolist()]
+        distinct_structs = {s: self.base_structures[s] / self.counter for s in set(structs)}
+        struct_probs = np.array([distinct_structs[s] for s in structs], dtype=np.float64)
+
+        if log:
+            with np.errstate(divide='ignore'):
+                return reduce_segments(np.add, np.log2(probs)[segment_ids], lengths,
+                                       np.log2(struct_probs))
+        return reduce_segments(np.multiply, probs[segment_ids], lengths, struct_probs)
 
     def base_structure_probabilities(self):
         total = 0
@@ -646,20 +1059,11 @@ class Grammar(object):
         return [(struct, count / total) for struct, count in rank]
 
     def tag_probabilities(self):
-        tag_dicts = self.tag_dicts
+        table = self.probability_table
         probabilities = defaultdict(Counter)
 
-        for tag in tag_dicts.keys():
-            samplesize = sum(tag_dicts[tag].values())
-            vocabsize = len(tag_dicts[tag].keys())
-
-            if self.estimator == 'laplace':
-                est = LaplaceEstimator(samplesize, vocabsize, 1)
-            else:
-                est = MleEstimator(samplesize)
-
-            for lemma, freq in tag_dicts[tag].most_common():
-                probabilities[tag][lemma] = est.probability(freq)
+        for tag in table.tags:
+            probabilities[tag] = Counter(dict(table.items(tag)))
 
         return probabilities
 
@@ -695,8 +1099,13 @@ class Grammar(object):
                     #     print("{}\t{}\t{}".format(str(tag), lemma, p))
                     f.write("{}\t{}\n".format(lemma, p))
 
-        self_filepath = os.path.join(path, 'grammar.pickle')
-        pickle.dump(self, open(self_filepath, 'wb'), -1)
+        self.save(os.path.join(path, GRAMMAR_FILE))
+
+    def save(self, path):
+        """ Save the grammar to a file that from_files() memory-maps (see
+        CompactGrammar.save()).
+        """
+        CompactGrammar.from_grammar(self).save(path)
 
     def read(self, path):
         grammar_dir = util.abspath(path)
@@ -726,7 +1135,482 @@ class Grammar(object):
 
     @classmethod
     def from_files(cls, path):
+        """ Load the grammar of a folder written by write_to_disk(). It is
+        memory-mapped (see CompactGrammar.load()) or, in older grammars,
+        unpickled.
+        """
+        bpath = os.path.join(path, GRAMMAR_FILE)
+        if os.path.exists(bpath):
+            return CompactGrammar.load(bpath)
+
         gpath = os.path.join(path, 'grammar.pickle')
         g = pickle.load(open(gpath, "rb"))
         # g.read(path)
         return g
+
+
+class CompactGrammar(Grammar):
+    """ A Grammar that stores its counts in arrays rather than in Counters
+    of strings, taking a fraction of the memory:
+
+        tags          - the name of each tag, by tag id
+        words         - StringPool with every terminal, by word id
+        tag_ptr       - the terminals of tag t are term_words and
+        term_words      term_counts[tag_ptr[t]:tag_ptr[t + 1]], sorted
+        term_counts     by word id
+        struct_ptr    - base structure s is the sequence of tag ids
+        struct_tags     struct_tags[struct_ptr[s]:struct_ptr[s + 1]]
+        struct_counts - count of each base structure
+
+    Counts added by fit() or merge() are buffered and folded into the
+    arrays every buffer_size entries (see compact()). tag_dicts and
+    base_structures are read-only views with the same interface as the
+    Counters of Grammar, so the methods of Grammar (predict(), sample(),
+    write_to_disk(), ...) work unchanged.
+    """
+
+    def __init__(self, tagtype='backoff', estimator='mle', buffer_size=2 ** 20):
+        self.probabilities = dict()
+        self.estimator = estimator
+        self.tagger = GrammarTagger()
+        self.counter = 0
+        self.lowres = None
+        self.tagtype = tagtype
+        self.buffer_size = buffer_size
+        self._table = None
+
+        self.tags = []
+        self.tag_ids = dict()
+
+        self.words = StringPool.from_strings([])
+        self.word_index = HashIndex(self.words)
+        self.tag_ptr = np.zeros(1, dtype=np.int64)
+        self.term_words = np.zeros(0, dtype=np.int32)
+        self.term_counts = np.zeros(0)
+
+        self.struct_ptr = np.zeros(1, dtype=np.int64)
+        self.struct_tags = np.zeros(0, dtype=np.int32)
+        self.struct_counts = np.zeros(0)
+        self.struct_index = HashIndex(self._struct_pool())
+
+        self._clear_buffer()
+
+    @classmethod
+    def from_grammar(cls, grammar):
+        """Return a CompactGrammar with the counts of a Grammar."""
+        compact = cls(grammar.tagtype, grammar.estimator)
+        compact.merge(grammar.tag_dicts, grammar.base_structures)
+        compact.counter = grammar.counter
+        compact.compact()
+        return compact
+
+    @property
+    def tag_dicts(self):
+        self.compact()
+        return _TagDicts(self)
+
+    @property
+    def base_structures(self):
+        self.compact()
+        return _BaseStructures(self)
+
+    def add_vocabulary(self, vocab):
+        self._table = None
+        # like Grammar, the words get a count of 0, even if they had one
+        terminals = []
+        for string, pos, synset in vocab:
+            tag = self.tagger._get_tag(string, pos, synset, self.tagtype)
+            self._buffer_terminal(tag, string, 0)
+            terminals.append((tag, string))
+        self.compact()
+
+        for tag, string in terminals:
+            span = self.terminal_range(tag)
+            word_id = self.word_index.find(string)
+            i = span.start + np.searchsorted(self.term_words[span], word_id)
+            self.term_counts[i] = 0
+
+    def get_vocab(self):
+        self.compact()
+        used = np.zeros(len(self.words), dtype=bool)
+        used[self.term_words] = True
+        return set(self.words[i] for i in np.flatnonzero(used).tolist())
+
+    def merge(self, tags, base_structures):
+        self._table = None
+        self._buffered_structs.update(base_structures)
+        self.counter += sum(base_structures.values())
+        for tag, terminals in tags.items():
+            self._buffered_terminals[tag].update(terminals)
+            self._buffered += len(terminals)
+        self._buffered += len(base_structures)
+        self._flush_if_full()
+
+    def fit_incremental(self, x, count):
+        self._table = None
+        base_structure = ''
+        for string, pos, synset in x:
+            tag = self.tagger._get_tag(string, pos, synset, self.tagtype)
+            self._buffer_terminal(tag, string, count)
+            base_structure += '({})'.format(tag)
+
+        self._buffered_structs[base_structure] += count
+        self._buffered += 1
+        self._flush_if_full()
+
+    def _buffer_terminal(self, tag, string, count):
+        self._buffered_terminals[tag][string] += count
+        self._buffered += 1
+
+    def _flush_if_full(self):
+        if self._buffered >= self.buffer_size:
+            self.compact()
+
+    def _clear_buffer(self):
+        self._buffered_terminals = defaultdict(Counter)
+        self._buffered_structs = Counter()
+        self._buffered = 0
+
+    def _tag_id(self, tag):
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self.tag_ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return tag_id
+
+    def _struct_pool(self):
+        """The base structures as a StringPool of the bytes of tag ids."""
+        return StringPool(self.struct_tags.view(np.uint8), self.struct_ptr * 4)
+
+    def struct_key(self, tags):
+        """Return the bytes that identify a sequence of tag ids."""
+        return array.array('i', tags).tobytes()
+
+    def compact(self):
+        """ Fold the buffered counts into the arrays of the grammar. """
+        if not self._buffered_terminals and not self._buffered_structs:
+            return
+
+        # terminals are sorted by tag id, so tags are interned first
+        term_tags = np.repeat(np.arange(len(self.tags)), np.diff(self.tag_ptr))
+
+        # base structures like '(nn)(number4)' as lists of tags
+        structs = [s[1:-1].split(')(') if s else [] for s in self._buffered_structs]
+        struct_counts = list(self._buffered_structs.values())
+        for tag in set(itertools.chain.from_iterable(structs)):
+            self._tag_id(tag)
+
+        tags, strings, counts = [], [], []
+        for tag, terminals in self._buffered_terminals.items():
+            tag_id = self._tag_id(tag)
+            tags.extend([tag_id] * len(terminals))
+            strings.extend(terminals.keys())
+            counts.extend(terminals.values())
+
+        word_ids = self._intern_words(strings)
+        n_words = max(len(self.words), 1)
+
+        # terminals are sorted by (tag, word id), i.e., by key; buffered
+        # pairs are unique, so each one is either added to a terminal
+        # or inserted as a new one
+        keys = term_tags * n_words + self.term_words
+        new_keys = np.array(tags, dtype=np.int64) * n_words + word_ids
+        order = np.argsort(new_keys)
+        new_keys = new_keys[order]
+        counts = np.array(counts, dtype=np.float64)[order]
+
+        positions = np.searchsorted(keys, new_keys)
+        found = positions < len(keys)
+        found[found] = keys[positions[found]] == new_keys[found]
+
+        term_counts = self.term_counts.copy()
+        term_counts[positions[found]] += counts[found]
+        insert = positions[~found]
+        keys = np.insert(keys, insert, new_keys[~found])
+        term_counts = np.insert(term_counts, insert, counts[~found])
+        term_tags, term_words = np.divmod(keys, n_words)
+
+        self.term_words = term_words.astype(np.int32)
+        self.term_counts = term_counts
+        self.tag_ptr = np.zeros(len(self.tags) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_tags, minlength=len(self.tags)), out=self.tag_ptr[1:])
+
+        struct_ids = self._intern_structs(structs)
+        self.struct_counts = np.concatenate([
+            self.struct_counts, np.zeros(len(self.struct_ptr) - 1 - len(self.struct_counts))])
+        np.add.at(self.struct_counts, struct_ids, struct_counts)
+
+        self._clear_buffer()
+
+    def _intern_words(self, strings):
+        """Return the ids of strings, adding the new ones to words."""
+        unique = list(dict.fromkeys(strings))
+        ids = self.word_index.find_many(unique)
+
+        missing = ids < 0
+        if missing.any():
+            new = [string for string, m in zip(unique, missing.tolist()) if m]
+            ids[missing] = np.arange(len(self.words), len(self.words) + len(new))
+            self.words = self.words.extend(StringPool.from_strings(new))
+            self.word_index = self.word_index.extend(self.words)
+
+        ids = dict(zip(unique, ids.tolist()))
+        return np.fromiter(map(ids.__getitem__, strings), dtype=np.int64,
+                           count=len(strings))
+
+    def _intern_structs(self, structs):
+        """ Return the ids of distinct base structures, given as lists of
+        tags, adding the new ones to the grammar.
+        """
+        tags = np.fromiter(map(self.tag_ids.__getitem__, itertools.chain.from_iterable(structs)),
+                           dtype=np.int32)
+        ptr = np.zeros(len(structs) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in structs], out=ptr[1:])
+
+        ids = self.struct_index.find_many(StringPool(tags.view(np.uint8), ptr * 4))
+
+        missing = ids < 0
+        if missing.any():
+            n = len(self.struct_ptr) - 1
+            new = np.flatnonzero(missing)
+            ids[new] = np.arange(n, n + len(new))
+            lengths = ptr[new + 1] - ptr[new]
+            self.struct_tags = np.concatenate(
+                [self.struct_tags, tags[np.repeat(missing, np.diff(ptr))]])
+            self.struct_ptr = np.concatenate(
+                [self.struct_ptr, self.struct_ptr[-1] + np.cumsum(lengths)])
+            self.struct_index = self.struct_index.extend(self._struct_pool())
+        return ids
+
+    def terminal_range(self, tag):
+        """ Return the slice of term_words and term_counts with the
+        terminals of a tag, empty for unknown tags.
+        """
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            return slice(0, 0)
+        return slice(self.tag_ptr[tag_id], self.tag_ptr[tag_id + 1])
+
+    def struct_tag_names(self, i):
+        """Return the tags of base structure i."""
+        tags = self.tags
+        return [tags[t] for t in self.struct_tags[self.struct_ptr[i]:self.struct_ptr[i + 1]].tolist()]
+
+    def save(self, path):
+        """ Save the grammar to a file that load() memory-maps: the arrays
+        of the grammar, its probability table and their hash indexes, so
+        that loading takes no time regardless of the size of the grammar.
+        """
+        self.compact()
+        table = self.probability_table
+
+        arrays = {
+            'word_data': self.words.data,
+            'word_offsets': self.words.offsets,
+            'word_hashes': self.word_index.hashes,
+            'word_order': self.word_index.order,
+            'tag_ptr': self.tag_ptr,
+            'term_words': self.term_words,
+            'term_counts': self.term_counts,
+            'struct_ptr': self.struct_ptr,
+            'struct_tags': self.struct_tags,
+            'struct_counts': self.struct_counts,
+            'struct_hashes': self.struct_index.hashes,
+            'struct_order': self.struct_index.order,
+            'table_samplesize': table.samplesize,
+            'table_vocabsize': table.vocabsize,
+            'table_tag_ptr': table.tag_ptr,
+            'table_key_data': table.keys.data,
+            'table_key_offsets': table.keys.offsets,
+            'table_probs': table.probs,
+            'table_hashes': table.index.hashes,
+            'table_order': table.index.order
+        }
+
+        meta = {
+            'tagtype': self.tagtype,
+            'estimator': self.estimator,
+            'counter': np.asarray(self.counter).item(),
+            'lowres': self.lowres,
+            'tags': self.tags,
+            'table_tags': table.tags
+        }
+
+        save_packed(path, GRAMMAR_MAGIC, GRAMMAR_VERSION, arrays, meta)
+
+    @classmethod
+    def load(cls, path):
+        """ Memory-map a grammar saved with save(). Arrays are shared by
+        every process that loads the grammar, through the page cache.
+        Counts are copy-on-write: the grammar can still be fit, but
+        changes are private to the process.
+        """
+        version, meta, arrays = load_packed(path, GRAMMAR_MAGIC,
+                                            ('term_counts', 'struct_counts'))
+        if version > GRAMMAR_VERSION:
+            raise ValueError("{} has version {} of the grammar format, "
+                             "this version reads up to {}".format(
+                                 path, version, GRAMMAR_VERSION))
+
+        grammar = cls(meta['tagtype'], meta['estimator'])
+        grammar.counter = meta['counter']
+        grammar.lowres = meta['lowres']
+        grammar.tags = meta['tags']
+        grammar.tag_ids = {tag: i for i, tag in enumerate(grammar.tags)}
+
+        grammar.words = StringPool(arrays['word_data'], arrays['word_offsets'])
+        grammar.word_index = HashIndex(grammar.words, arrays['word_hashes'],
+                                       arrays['word_order'])
+        grammar.tag_ptr = arrays['tag_ptr']
+        grammar.term_words = arrays['term_words']
+        grammar.term_counts = arrays['term_counts']
+
+        grammar.struct_ptr = arrays['struct_ptr']
+        grammar.struct_tags = arrays['struct_tags']
+        grammar.struct_counts = arrays['struct_counts']
+        grammar.struct_index = HashIndex(grammar._struct_pool(), arrays['struct_hashes'],
+                                         arrays['struct_order'])
+
+        keys = StringPool(arrays['table_key_data'], arrays['table_key_offsets'])
+        grammar._table = ProbabilityTable(
+            meta['estimator'], meta['table_tags'], arrays['table_samplesize'],
+            arrays['table_vocabsize'], arrays['table_tag_ptr'], keys, arrays['table_probs'],
+            HashIndex(keys, arrays['table_hashes'], arrays['table_order']))
+        return grammar
+
+    def __getstate__(self):
+        self.compact()
+        d = dict(self.__dict__)
+        # rebuilt on load
+        del d['word_index'], d['struct_index']
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self.word_index = HashIndex(self.words)
+        self.struct_index = HashIndex(self._struct_pool())
+
+
+class _Terminals(Mapping):
+    """ Read-only view of the terminals of a tag of a CompactGrammar, with
+    the interface of the Counters in Grammar.tag_dicts.
+    """
+
+    def __init__(self, grammar, tag):
+        self.grammar = grammar
+        span = grammar.terminal_range(tag)
+        self.words = grammar.term_words[span]
+        self.counts = grammar.term_counts[span]
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def _find(self, string):
+        word_id = self.grammar.word_index.find(string)
+        i = int(np.searchsorted(self.words, word_id))
+        if word_id < 0 or i == len(self.words) or self.words[i] != word_id:
+            return -1
+        return i
+
+    def __contains__(self, string):
+        return self._find(string) >= 0
+
+    def __getitem__(self, string):
+        i = self._find(string)
+        return self.counts[i].item() if i >= 0 else 0
+
+    def keys(self):
+        return self.grammar.words.take(self.words).tolist()
+
+    def values(self):
+        return self.counts.tolist()
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def most_common(self, n=None):
+        order = np.argsort(-self.counts, kind='stable')[:n]
+        words = self.grammar.words.take(self.words[order]).tolist()
+        return list(zip(words, self.counts[order].tolist()))
+
+
+class _TagDicts(Mapping):
+    """ Read-only view of the tags of a CompactGrammar, with the interface
+    of Grammar.tag_dicts. Unknown tags have no terminals.
+    """
+
+    def __init__(self, grammar):
+        self.grammar = grammar
+
+    def _tags(self):
+        sizes = np.diff(self.grammar.tag_ptr)
+        return [self.grammar.tags[t] for t in np.flatnonzero(sizes).tolist()]
+
+    def __len__(self):
+        return len(self._tags())
+
+    def __iter__(self):
+        return iter(self._tags())
+
+    def __contains__(self, tag):
+        span = self.grammar.terminal_range(tag)
+        return span.stop > span.start
+
+    def __getitem__(self, tag):
+        return _Terminals(self.grammar, tag)
+
+
+class _BaseStructures(Mapping):
+    """ Read-only view of the base structures of a CompactGrammar, with
+    the interface of the Counter Grammar.base_structures, i.e., keys are
+    strings like '(nn)(number4)' and unknown keys count 0.
+    """
+
+    def __init__(self, grammar):
+        self.grammar = grammar
+
+    def _find(self, base_struct):
+        # malformed keys, e.g., 'nn' or '(nn)x', are missing rather than ''
+        if not isinstance(base_struct, str) or \
+                not re.fullmatch(r'(\([^()]+\))*', base_struct):
+            return -1
+        tag_ids = []
+        for tag in re.findall(r'\(([^()]+)\)', base_struct):
+            tag_id = self.grammar.tag_ids.get(tag)
+            if tag_id is None:
+                return -1
+            tag_ids.append(tag_id)
+        return self.grammar.struct_index.find(self.grammar.struct_key(tag_ids))
+
+    def __len__(self):
+        return len(self.grammar.struct_counts)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, base_struct):
+        return self._find(base_struct) >= 0
+
+    def __getitem__(self, base_struct):
+        i = self._find(base_struct)
+        return self.grammar.struct_counts[i].item() if i >= 0 else 0
+
+    def _key(self, i):
+        return ''.join('({})'.format(tag) for tag in self.grammar.struct_tag_names(i))
+
+    def keys(self):
+        return [self._key(i) for i in range(len(self))]
+
+    def values(self):
+        return self.grammar.struct_counts.tolist()
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def most_common(self, n=None):
+        counts = self.grammar.struct_counts
+        order = np.argsort(-counts, kind='stable')[:n]
+        return [(self._key(i), counts[i].item()) for i in order.tolist()]
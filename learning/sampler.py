@@ -0,0 +1,164 @@
+"""
+Fast sampling of passwords from a Grammar.
+
+Drawing one terminal at a time with np.random.choice() validates and
+sums the whole distribution of the tag on every call, so each token costs
+O(vocabulary). GrammarSampler computes the cumulative distribution of
+base structures and of the terminals of each tag once, then draws
+passwords in batches: all base structures of a batch with one binary
+search, and all terminals of a given tag with one binary search.
+"""
+
+import re
+import itertools
+
+import numpy as np
+
+from misc.arrays import reduce_segments
+
+
+class GrammarSampler(object):
+    """ Samples passwords from a grammar, whose counts must not change
+    while the sampler is in use.
+
+        structs         - the base structures, by struct id
+        struct_probs    - probability of each base structure
+        struct_logprobs - log2 of struct_probs
+        struct_cdf      - cumulative sum of struct_probs, divided by their sum
+        struct_ptr      - the tags of base structure s are
+        struct_tags       struct_tags[struct_ptr[s]:struct_ptr[s + 1]]
+        words           - every terminal, grouped by tag
+        word_probs      - probability of each terminal within its tag
+        word_logprobs   - log2 of word_probs (-inf for 0)
+        tag_ptr         - the terminals of tag t are words[tag_ptr[t]:tag_ptr[t + 1]]
+        word_cdf        - cumulative sum of word_probs within each tag,
+                          divided by the sum of the tag
+    """
+
+    def __init__(self, grammar):
+        table = grammar.probability_table
+        tag_ids = table.tag_ids
+
+        self.tags = table.tags
+        self.tag_ptr = table.tag_ptr
+        self.words = table.terminals(range(len(table.probs)))
+        self.word_probs = table.probs
+
+        # cumulative sums restart at every tag
+        word_cdf = []
+        for first, last in zip(self.tag_ptr[:-1].tolist(), self.tag_ptr[1:].tolist()):
+            cdf = np.cumsum(self.word_probs[first:last])
+            if len(cdf) and cdf[-1] > 0:
+                cdf /= cdf[-1]
+            word_cdf.append(cdf)
+        self.word_cdf = np.concatenate(word_cdf) if word_cdf else np.zeros(0)
+        with np.errstate(divide='ignore'):
+            self.word_logprobs = np.log2(self.word_probs)
+
+        self.structs = []
+        struct_counts = []
+        struct_tags = []
+        struct_sizes = []
+        for struct, count in grammar.base_structures.items():
+            ids = [tag_ids[tag] for tag in re.findall(r'\(([^()]+)\)', struct)]
+            self.structs.append(struct)
+            struct_counts.append(count)
+            struct_tags.extend(ids)
+            struct_sizes.append(len(ids))
+
+        struct_counts = np.array(struct_counts, dtype=np.float64)
+        self.struct_probs = struct_counts / np.sum(struct_counts)  # calculate MLE
+        self.struct_cdf = np.cumsum(self.struct_probs)
+        self.struct_cdf /= self.struct_cdf[-1]
+        with np.errstate(divide='ignore'):
+            self.struct_logprobs = np.log2(self.struct_probs)
+        self.struct_tags = np.array(struct_tags, dtype=np.int64)
+        self.struct_ptr = np.zeros(len(self.structs) + 1, dtype=np.int64)
+        np.cumsum(struct_sizes, out=self.struct_ptr[1:])
+
+    def draw(self, n, rng):
+        """ Draw n passwords.
+
+        Args:
+            n - number of passwords
+            rng - a numpy.random.Generator
+
+        Return:
+            a tuple (struct_ids, word_ids, lengths), where the password i
+            has base structure struct_ids[i] and is made of lengths[i]
+            terminals, taken in order from word_ids
+        """
+        struct_ids = _search(self.struct_cdf, rng.random(n))
+
+        starts = self.struct_ptr[struct_ids]
+        lengths = self.struct_ptr[struct_ids + 1] - starts
+
+        # position of every token of the batch in struct_tags
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(np.sum(lengths)) + np.repeat(starts - offsets, lengths)
+        token_tags = self.struct_tags[positions]
+
+        # tokens of the same tag are drawn together
+        word_ids = np.empty(len(token_tags), dtype=np.int64)
+        order = np.argsort(token_tags, kind='stable')
+        tags, bounds = np.unique(token_tags[order], return_index=True)
+        bounds = np.append(bounds, len(order))
+        u = rng.random(len(order))
+
+        for t, lo, hi in zip(tags.tolist(), bounds[:-1].tolist(), bounds[1:].tolist()):
+            first, last = self.tag_ptr[t], self.tag_ptr[t + 1]
+            tokens = order[lo:hi]
+            word_ids[tokens] = first + _search(self.word_cdf[first:last], u[lo:hi])
+
+        return struct_ids, word_ids, lengths
+
+    def probabilities(self, struct_ids, word_ids, lengths, log=False):
+        """ Return the probability of each password returned by draw(), or
+        its log2 if log is True. Log probabilities are sums of the log2 of
+        the terminals, so they don't underflow for long base structures.
+        """
+        if log:
+            return reduce_segments(np.add, self.word_logprobs[word_ids], lengths,
+                                   self.struct_logprobs[struct_ids])
+        return reduce_segments(np.multiply, self.word_probs[word_ids], lengths,
+                               self.struct_probs[struct_ids])
+
+    def passwords(self, word_ids, lengths):
+        """Return the strings of the passwords returned by draw()."""
+        words = self.words
+        tokens = iter([words[i] for i in word_ids.tolist()])
+        return [''.join(itertools.islice(tokens, k)) for k in lengths.tolist()]
+
+    def sample(self, N, rng=None, batch_size=2 ** 16, log=False):
+        """ Sample N passwords.
+
+        Args:
+            N - number of passwords
+            rng - optional - a numpy.random.Generator
+            batch_size - number of passwords drawn at once
+            log - if True, return log2 probabilities
+
+        Return:
+            a generator of tuples (password, base_struct, probability)
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+
+        while N > 0:
+            n = min(N, batch_size)
+            struct_ids, word_ids, lengths = self.draw(n, rng)
+            passwords = self.passwords(word_ids, lengths)
+            probs = self.probabilities(struct_ids, word_ids, lengths, log)
+
+            structs = self.structs
+            for password, s, p in zip(passwords, struct_ids.tolist(), probs.tolist()):
+                yield (password, structs[s], p)
+            N -= n
+
+
+def _search(cdf, u):
+    """ Inverse transform sampling, like np.random.choice(): return, for
+    each uniform draw in [0, 1), the index of the first element of cdf
+    greater than it. cdf must end in 1.
+    """
+    return np.searchsorted(cdf, u, side='right')
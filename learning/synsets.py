@@ -0,0 +1,69 @@
+"""
+A precomputed index of WordNet synsets, so that training stages and
+scoring can resolve words to synsets without querying NLTK's WordNet
+reader over and over.
+"""
+
+import pickle
+
+# file name of the index saved next to a grammar
+SYNSET_INDEX_FILE = 'synset_index.pickle'
+
+
+class SynsetIndex(object):
+    """ Maps (word, wn_pos) pairs to the names of the synsets returned by
+    wordnet.synsets(word, wn_pos), in WordNet's order (most frequent sense
+    first).
+    """
+
+    def __init__(self, entries=None):
+        self.entries = dict(entries) if entries else dict()
+
+    @classmethod
+    def build(cls, words, wordnet):
+        """
+        Args:
+            words - an iterable of (word, wn_pos) tuples
+            wordnet - an instance of WordNetCorpusReader
+        """
+        index = cls()
+        for word, wn_pos in words:
+            index.synsets(word, wn_pos, wordnet)
+        return index
+
+    def synsets(self, word, wn_pos, wordnet=None):
+        """ Return a tuple with the names of the synsets of a word. Words
+        missing from the index are looked up in wordnet, if given, and
+        added to the index; otherwise, they have no synsets.
+        """
+        key = (word, wn_pos)
+        names = self.entries.get(key)
+        if names is None:
+            if wordnet is None:
+                return ()
+            names = tuple(s.name() for s in wordnet.synsets(word, wn_pos))
+            self.entries[key] = names
+        return names
+
+    def first(self, word, wn_pos, wordnet=None):
+        """Return the name of the most frequent synset of a word or None."""
+        names = self.synsets(word, wn_pos, wordnet)
+        return names[0] if names else None
+
+    def update(self, other):
+        self.entries.update(other.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def dump(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self.entries, f, -1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls(pickle.load(f))
@@ -7,13 +7,15 @@ import multiprocessing
 import argparse
 import pickle
 import os
+import heapq
+import tempfile
+import zlib
 
 import wordsegment as ws
 import numpy as np
 
 from collections import Counter
-from functools import reduce
-from multiprocessing import Process, Manager
+from multiprocessing import Process, Manager, Pool, shared_memory
 from multiprocessing.managers import BaseManager
 from importlib import reload
 
@@ -24,12 +26,15 @@ from nltk.corpus.reader.wordnet import WordNetCorpusReader
 
 from learning.pos import BackoffTagger, SpacyTagger, COCATagger
 from learning.tagset_conversion import TagsetConverter
-from learning.tree.wordnet import IndexedWordNetTree
-from learning.model import TreeCutModel, Grammar, GrammarTagger
+from learning.tree.wordnet import ArrayWordNetTree
+from learning.model import TreeCutModel, Grammar, CompactGrammar, GrammarTagger, VariationCounter
+from learning.checkpoint import Checkpoint, input_signature
+from learning.chunks import TaggedChunksBuilder
+from learning.synsets import SynsetIndex, SYNSET_INDEX_FILE
 
 from pattern.en import pluralize, lexeme
 
-from misc.util import Timer
+from misc.util import Timer, LRUCache, check_workers, put_checked
 
 # load global resources
 
@@ -53,15 +58,120 @@ def new_wordnet_instance():
     )
 
 
+# approximate memory cost (bytes) of one Counter entry on top of the string
+# itself: hash table slot, key reference and int object
+TALLY_ENTRY_OVERHEAD = 100
+
+
+def _read_passwords(password_file):
+    return (line.rstrip('\n').lower() for line in password_file
+            if not re.fullmatch(r'\s+', line))
+
+
 def tally(password_file, lowercase=True):
     """Return a Counter for passwords."""
-    pwditer = (line.rstrip('\n').lower() for line in password_file
-               if not re.fullmatch(r'\s+', line))
+    return Counter(_read_passwords(password_file))
+
+
+def _spill(counts, folder, run, num_partitions):
+    """ Write the counts held in memory to disk as one sorted run file per
+    hash partition. Returns the paths of the files written, indexed by
+    partition.
+    """
+    partitions = [[] for i in range(num_partitions)]
+    for password, count in counts.items():
+        h = zlib.crc32(password.encode('utf-8', 'surrogateescape'))
+        partitions[h % num_partitions].append((password, count))
+
+    paths = []
+    for i, partition in enumerate(partitions):
+        path = os.path.join(folder, 'part{:03d}.run{:05d}'.format(i, run))
+        with open(path, 'w', encoding='utf-8', errors='surrogateescape',
+                  newline='\n') as f:
+            for password, count in sorted(partition):
+                f.write('{}\t{}\n'.format(password, count))
+        paths.append(path)
+
+    return paths
+
+
+def _read_run(path):
+    with open(path, encoding='utf-8', errors='surrogateescape',
+              newline='\n') as f:
+        for line in f:
+            password, count = line[:-1].rsplit('\t', 1)
+            yield password, int(count)
+
+
+def _merge_runs(paths):
+    """ K-way merge of sorted run files, adding up the counts of
+    passwords found in more than one run.
+    """
+    last_password, last_count = None, 0
+    for password, count in heapq.merge(*[_read_run(path) for path in paths]):
+        if password == last_password:
+            last_count += count
+            continue
+        if last_password is not None:
+            yield last_password, last_count
+        last_password, last_count = password, count
+
+    if last_password is not None:
+        yield last_password, last_count
+
+
+def tally_streaming(password_file, memory_budget, num_partitions=16):
+    """ A generator of (password, count) tuples that, unlike tally(),
+    does not need to hold every distinct password in memory.
+
+    Passwords are counted in memory until the estimated size of the counts
+    exceeds memory_budget (in MB). The counts are then spilled to disk as
+    sorted run files, hash-partitioned by password. Once the input is
+    exhausted, the runs of each partition are merged (k-way merge) and the
+    totals are yielded partition by partition.
+    """
+    budget = memory_budget * 2 ** 20
+
+    with tempfile.TemporaryDirectory(prefix='tally') as folder:
+        runs = [[] for i in range(num_partitions)]
+        counts = Counter()
+        size = 0
 
-    return Counter(pwditer)
+        for password in _read_passwords(password_file):
+            if password not in counts:
+                size += sys.getsizeof(password) + TALLY_ENTRY_OVERHEAD
+            counts[password] += 1
 
+            if size > budget:
+                run = len(runs[0])
+                log.info("Spilling {} passwords to disk (run {})..."
+                         .format(len(counts), run))
+                for i, path in enumerate(_spill(counts, folder, run, num_partitions)):
+                    runs[i].append(path)
+                counts = Counter()
+                size = 0
 
-def getchunks(password):
+        if len(runs[0]) == 0:  # everything fit in memory
+            yield from counts.items()
+            return
+
+        if len(counts):
+            for i, path in enumerate(_spill(counts, folder, len(runs[0]), num_partitions)):
+                runs[i].append(path)
+            counts = None
+
+        for paths in runs:
+            yield from _merge_runs(paths)
+
+
+SEGMENT_CACHE_FILE = 'segment_cache.pickle'
+
+
+def getchunks(password, cache=None):
+    """ Split a password into chunks of letters, digits and symbols, then
+    segment the letter chunks into words. If a cache (e.g. an LRUCache) is
+    given, segmentations are memoized by letter chunk.
+    """
     # split into character/digit/symbols chunks
     temp = re.findall(r'([\W_]+|[a-zA-Z]+|[0-9]+)', password)
 
@@ -69,7 +179,11 @@ def getchunks(password):
     chunks = []
     for chunk in temp:
         if chunk[0].isalpha() and len(chunk) > 1:
-            words = ws.segment(chunk)
+            words = cache.get(chunk) if cache is not None else None
+            if words is None:
+                words = ws.segment(chunk)
+                if cache is not None:
+                    cache.put(chunk, words)
             chunks.extend(words)
         else:
             chunks.append(chunk)
@@ -80,6 +194,27 @@ def getchunks(password):
     return chunks
 
 
+def wordnet_pos(word, pos, tag_converter, min_length_n=3, min_length_v=2):
+    """
+    Convert the CLAWS tag of a word to the WordNet POS under which the
+    word's synsets should be looked up. Returns None if the word has no
+    POS tag, is a proper noun, has no WordNet equivalent or is too short.
+    """
+    if pos is None or pos in proper_noun_tags:
+        return None
+
+    wn_pos = tag_converter.clawsToWordNet(pos)
+
+    if wn_pos is None:
+        return None
+
+    min_length = min_length_n if wn_pos == 'n' else min_length_v
+    if len(word) < min_length:
+        return None
+
+    return wn_pos
+
+
 def synset(word, pos, wordnet, tag_converter=None, min_length_n=3, min_length_v=2):
     """
     Given a POS-tagged word, determine its synset by converting the CLAWS tag
@@ -95,24 +230,52 @@ def synset(word, pos, wordnet, tag_converter=None, min_length_n=3, min_length_v=
     - pos: a part-of-speech tag from the CLAWS7 tagset
 
     """
-
-    if pos is None or pos in proper_noun_tags:
-        return None
-
-    wn_pos = tag_converter.clawsToWordNet(pos)
+    wn_pos = wordnet_pos(word, pos, tag_converter, min_length_n, min_length_v)
 
     if wn_pos is None:
         return None
 
-    min_length = min_length_n if wn_pos == 'n' else min_length_v
-    if len(word) < min_length:
-        return None
-
     synsets = wordnet.synsets(word, wn_pos)
 
     return synsets[0] if len(synsets) > 0 else None
 
 
+def _init_synset_worker():
+    global _worker_wordnet
+    _worker_wordnet = new_wordnet_instance()
+
+
+def _index_synsets(words):
+    return SynsetIndex.build(words, _worker_wordnet)
+
+
+def build_synset_index(passwords, num_workers):
+    """ Look up the synsets of every distinct noun and verb in the tagged
+    passwords once, so that later stages don't need to query WordNet.
+
+    Returns:
+        a SynsetIndex
+    """
+    words = set()
+    for string, pos in passwords.vocabulary():
+        wn_pos = wordnet_pos(string, pos, tag_converter)
+        if wn_pos == 'n' or wn_pos == 'v':
+            words.add((string, wn_pos))
+
+    words = sorted(words)
+    share = max(1, math.ceil(len(words) / (num_workers * 4)))
+    parts = [words[i:i + share] for i in range(0, len(words), share)]
+
+    index = SynsetIndex()
+    with Pool(num_workers, initializer=_init_synset_worker) as pool:
+        for part in pool.imap_unordered(_index_synsets, parts):
+            index.update(part)
+
+    log.info("Indexed the synsets of {} words".format(len(index)))
+
+    return index
+
+
 class POSBlacklist():
     def __init__(self):
         self.coca = COCATagger()
@@ -124,11 +287,32 @@ class POSBlacklist():
                  self.coca.tag_map[word][0][1] < 1000))
 
 
-def pos_tag(tokens, tagger, blacklist):
+TAG_CACHE_FILE = 'tag_cache.pickle'
+
+
+def tag_sequence(tokens, tagger, cache=None):
+    """ Tag a sequence of tokens with tagger, memoizing the result by the
+    token tuple if a cache (e.g. an LRUCache) is given. Results are cached
+    as tuples and returned as new lists, so callers may modify them.
+    """
+    if cache is None:
+        return tagger.tag(tokens)
+
+    key = tuple(tokens)
+    tags = cache.get(key)
+    if tags is None:
+        tags = tuple(tagger.tag(tokens))
+        cache.put(key, tags)
+    return list(tags)
+
+
+def pos_tag(tokens, tagger, blacklist, cache=None):
     """ Assign POS tags to alphabetic tokens, except when they are short (less
     than 3 chars) AND have no adjacent tokens of the same type (e.g. "1ab!!").
     Such tokens are likely to be short strings in a random password.
 
+    Tagger results are memoized in cache, if given (see tag_sequence()).
+
     Example:
         >>> pos_tag(['i', 'love', 'you', '2'])
         [('i', 'ppis1'), ('love', 'vv0'), ('you', 'ppy'), ('2', None)]
@@ -140,7 +324,7 @@ def pos_tag(tokens, tagger, blacklist):
     if len(tokens) == 1:
         token = tokens[0]
         if token.isalpha():
-            return tagger.tag(tokens)
+            return tag_sequence(tokens, tagger, cache)
         else:
             return [(token, None)]
 
@@ -158,7 +342,7 @@ def pos_tag(tokens, tagger, blacklist):
         if not isalpha or \
                 blacklist and blacklist.is_bad(tokens[i]):
             if len(buffer) > 0:
-                tags.extend(tagger.tag(buffer))
+                tags.extend(tag_sequence(buffer, tagger, cache))
                 buffer = []
 
             tags.append((tokens[i], None))
@@ -172,7 +356,7 @@ def pos_tag(tokens, tagger, blacklist):
             tags.append((tokens[i], None))
 
     if len(buffer) > 0:
-        tags.extend(tagger.tag(buffer))
+        tags.extend(tag_sequence(buffer, tagger, cache))
 
     return tags
 
@@ -289,73 +473,143 @@ def verb_vocab(tcm=None, postagger=None, min_length=0):
     return verbs
 
 
-def product(list_a, list_b):
-    for a in list_a:
-        for b in list_b:
+def read_spool(path):
+    """ Iterate over the result batches pickled one after another in a file.
+    Raises RuntimeError if the file ends in the middle of a batch.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        while f.tell() < size:
             try:
-                yield a + [b]
-            except TypeError:
-                yield [a, b]
-
+                yield pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                raise RuntimeError("Spool file {} is truncated".format(path))
 
-def tally_chunk_tag(path, num_workers):
-    def do_work(in_queue, out_list):
-        postagger = BackoffTagger.from_pickle()
-        blacklist = POSBlacklist()
-        postagger.set_wordnet_instance(new_wordnet_instance())
-        # postagger = SpacyTagger()
 
-        i = 0
-        while True:
-            batch = in_queue.get()
-            if len(batch) == 0:  # exit signal
-                return
+def tally_chunk_tag(path, num_workers, memory_budget=None, cache_folder=None,
+                    cache_size=100000):
+    """ Count, chunk and POS tag the passwords in a file.
 
-            result_buffer = []
-            for password, count in batch:
+    Workers share nothing but the input queue: each one pickles its tagged
+    batches to its own spool file, which the parent reads back once all
+    workers are done. This avoids funneling every result through a manager
+    process.
 
-                chunks = getchunks(password)
-                try:
-                    postagged_chunks = pos_tag(chunks, postagger, blacklist)
-                except:
-                    log.error("Error: {}".format(chunks))
-                    raise
+    Each worker memoizes word segmentations and POS tag sequences in caches
+    of cache_size entries. If cache_folder is given, the caches are
+    pre-warmed from the dumps found there and the merged caches are dumped
+    back when done. Tag sequences only depend on the tokens, so they remain
+    valid when the grammar is retrained with different options.
 
-                result_buffer.append((postagged_chunks, count))
-                i += 1
+    Returns:
+        a TaggedChunks, i.e., a compact sequence of tuples
+        (list of (string, pos), count)
+    """
+    cache_files = {'segment': SEGMENT_CACHE_FILE, 'tag': TAG_CACHE_FILE}
 
-                if i % 100000 == 0:
-                    process_id = multiprocessing.current_process()._identity[0]
-                    log.info("Process {} has worked on {} passwords..."
-                             .format(process_id, i))
+    def load_caches():
+        if not cache_folder:
+            return {name: LRUCache(cache_size) for name in cache_files}
+        return {name: LRUCache.load(os.path.join(cache_folder, fname), cache_size)
+                for name, fname in cache_files.items()}
 
-            out_list.extend(result_buffer)
+    def do_work(in_queue, spool_path):
+        postagger = BackoffTagger.from_pickle()
+        blacklist = POSBlacklist()
+        postagger.set_wordnet_instance(new_wordnet_instance())
+        # postagger = SpacyTagger()
 
-    manager = Manager()
+        caches = load_caches()
+        segment_cache, tag_cache = caches['segment'], caches['tag']
 
-    results = manager.list()
-    work = manager.Queue(num_workers)
+        i = 0
+        # renamed when done, so that a spool file is always complete
+        with open(spool_path + '.part', 'wb') as spool:
+            while True:
+                batch = in_queue.get()
+                if len(batch) == 0:  # exit signal
+                    log.info("Process {} segmentation cache: {}; tag cache: {}"
+                             .format(os.getpid(), segment_cache.stats(),
+                                     tag_cache.stats()))
+                    for name, cache in caches.items():
+                        cache.dump('{}.{}'.format(spool_path, name))
+                    break
+
+                result_buffer = []
+                for password, count in batch:
+
+                    chunks = getchunks(password, segment_cache)
+                    try:
+                        postagged_chunks = pos_tag(chunks, postagger, blacklist,
+                                                   tag_cache)
+                    except:
+                        log.error("Error: {}".format(chunks))
+                        raise
+
+                    result_buffer.append((postagged_chunks, count))
+                    i += 1
+
+                    if i % 100000 == 0:
+                        process_id = multiprocessing.current_process()._identity[0]
+                        log.info("Process {} has worked on {} passwords... "
+                                 "(segmentation cache: {}; tag cache: {})"
+                                 .format(process_id, i, segment_cache.stats(),
+                                         tag_cache.stats()))
+
+                pickle.dump(result_buffer, spool, -1)
+
+        os.rename(spool_path + '.part', spool_path)
+
+    work = multiprocessing.Queue(num_workers * 2)
+    # don't wait at exit for batches that no worker will read
+    work.cancel_join_thread()
+
+    with tempfile.TemporaryDirectory(prefix='spool') as spool_dir:
+        spools = [os.path.join(spool_dir, 'worker{:03d}.pickle'.format(i))
+                  for i in range(num_workers)]
+
+        # start for workers
+        pool = []
+        for spool_path in spools:
+            p = Process(target=do_work, args=(work, spool_path))
+            p.start()
+            pool.append(p)
 
-    # start for workers
-    pool = []
-    for i in range(num_workers):
-        p = Process(target=do_work, args=(work, results))
-        p.start()
-        pool.append(p)
+        if memory_budget:
+            passwords = tally_streaming(path, memory_budget)
+        else:
+            passwords = tally(path).items()
 
-    passwords = tally(path).items()
-    buff = []
-    for password, count in passwords:
-        buff.append((password, count))
-        if len(buff) == 10000:
-            work.put(buff)
-            buff = []
+        buff = []
+        for password, count in passwords:
+            buff.append((password, count))
+            if len(buff) == 10000:
+                put_checked(work, buff, pool)
+                buff = []
 
-    if len(buff): work.put(buff)
-    for i in range(num_workers): work.put([])  # send exit signal
+        if len(buff): put_checked(work, buff, pool)
+        for i in range(num_workers): put_checked(work, [], pool)  # send exit signal
 
-    for p in pool:
-        p.join()
+        for p in pool:
+            p.join()
+        check_workers(pool)
+        for spool_path in spools:
+            if not os.path.exists(spool_path):
+                raise RuntimeError("Spool file {} was not completed".format(spool_path))
+
+        builder = TaggedChunksBuilder()
+        for spool_path in spools:
+            for batch in read_spool(spool_path):
+                builder.extend(batch)
+        results = builder.build()
+
+        if cache_folder:
+            for name, fname in cache_files.items():
+                cache = LRUCache(cache_size)
+                for spool_path in spools:
+                    cache.update(LRUCache.load('{}.{}'.format(spool_path, name),
+                                               cache_size).items())
+                cache.dump(os.path.join(cache_folder, fname))
 
     return results
 
@@ -373,7 +627,7 @@ def increment_synset_count(tree, synset, count=1):
     received as argument.
     """
     index = tree.index
-    key = synset.name()
+    key = synset if isinstance(synset, str) else synset.name()
 
     if key in index:
         nodes = index[key]
@@ -384,60 +638,130 @@ def increment_synset_count(tree, synset, count=1):
             n.increment_value(count, cumulative=False)
 
 
-def fit_tree_cut_models(passwords, estimator, specificity, num_workers):
-    def do_work(passwords, noun_results, verb_results):
-        wn = new_wordnet_instance()
-
-        grammar_tagger = GrammarTagger()
-        tag_converter = TagsetConverter()
-        noun_tree = IndexedWordNetTree('n', wordnet=wn)
-        verb_tree = IndexedWordNetTree('v', wordnet=wn)
-
+def synset_leaf_ids(tree, name):
+    """ Return the ids of the leaves of an ArrayWordNetTree that hold the
+    count of a synset, i.e., the nodes incremented by
+    increment_synset_count(), each by count / len(ids).
+    """
+    ids = []
+    for n in tree.index[name]:
+        if n.has_children():
+            n = n.find('s.' + n.key)
+        ids.append(n.id)
+    return ids
+
+
+def count_synsets(passwords, synset_index, num_workers):
+    """ Count the occurrences of noun and verb synsets in tagged passwords.
+    Synsets are resolved with synset_index (see build_synset_index()).
+
+    Each worker adds its counts to its own row of a table in shared
+    memory, with a column per leaf of both trees, and the rows are summed
+    once all workers are done.
+
+    Returns:
+        a tuple of arrays (noun_counts, verb_counts) holding the count of
+        each leaf of ArrayWordNetTree('n') and ArrayWordNetTree('v'),
+        in the order given by leaves().
+    """
+    # compile the trees once, workers attach to the snapshots
+    paths = {'n': ArrayWordNetTree.snapshot_path('n'),
+             'v': ArrayWordNetTree.snapshot_path('v')}
+    leaf_ids = {pos: ArrayWordNetTree.load(path).leaf_ids()
+                for pos, path in paths.items()}
+    # noun leaves come first in a row, then verb leaves
+    offsets = {'n': 0, 'v': len(leaf_ids['n'])}
+    n_columns = len(leaf_ids['n']) + len(leaf_ids['v'])
+
+    def do_work(passwords, block_name, row):
+        counts = Counter()
         for chunks, count in passwords:
             for string, pos in chunks:
-                syn = synset(string, pos, wn, tag_converter)
-                if syn and syn.pos() == 'n':
-                    increment_synset_count(noun_tree, syn, count)
-                elif syn and syn.pos() == 'v':
-                    increment_synset_count(verb_tree, syn, count)
+                wn_pos = wordnet_pos(string, pos, tag_converter)
+                if wn_pos in paths:
+                    name = synset_index.first(string, wn_pos)
+                    if name is not None:
+                        counts[wn_pos, name] += count
+
+        columns, shares = [], []
+        trees = {pos: ArrayWordNetTree.load(path) for pos, path in paths.items()}
+        for (wn_pos, name), count in counts.items():
+            tree = trees[wn_pos]
+            if name in tree.ids:
+                ids = synset_leaf_ids(tree, name)
+                leaves = np.searchsorted(leaf_ids[wn_pos], ids) + offsets[wn_pos]
+                columns.extend(leaves.tolist())
+                shares.extend([float(count) / len(ids)] * len(ids))
+
+        shm = shared_memory.SharedMemory(name=block_name)
+        try:
+            table = np.ndarray((num_workers, n_columns), dtype=np.float64,
+                               buffer=shm.buf)
+            np.add.at(table[row], np.array(columns, dtype=np.int64), shares)
+            del table
+        finally:
+            shm.close()
+
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=max(num_workers * n_columns * 8, 1))
+    try:
+        table = np.ndarray((num_workers, n_columns), dtype=np.float64, buffer=shm.buf)
+        table[:] = 0
+
+        pool = []
+        share = math.ceil(len(passwords) / num_workers)
+        for i in range(num_workers):
+            work = passwords[i * share:i * share + share]
+            p = Process(target=do_work, args=(work, shm.name, i))
+            p.start()
+            pool.append(p)
+
+        for p in pool:
+            p.join()
+        # a failed worker leaves its row empty
+        check_workers(pool)
 
-        noun_results.append(np.array([leaf.value for leaf in noun_tree.leaves()]))
-        verb_results.append(np.array([leaf.value for leaf in verb_tree.leaves()]))
+        counts = table.sum(0)
+        del table
+    finally:
+        shm.close()
+        shm.unlink()
 
-    manager = Manager()
-    noun_results = manager.list()
-    verb_results = manager.list()
-    pool = []
+    return counts[:offsets['v']], counts[offsets['v']:]
 
-    share = math.ceil(len(passwords) / num_workers)
-    for i in range(num_workers):
-        work = passwords[i * share:i * share + share]
-        p = Process(target=do_work, args=(work, noun_results, verb_results))
-        p.start()
-        pool.append(p)
 
-    for p in pool:
-        p.join()
+def _counted_tree(pos, counts):
+    """ Return an ArrayWordNetTree with the given leaf counts (see
+    count_synsets()) and up-to-date internal counts.
+    """
+    tree = ArrayWordNetTree.snapshot(pos)
+    # the tree lists its leaves in the same order as IndexedWordNetTree
+    tree.value[tree.leaf_ids()] = counts
+    tree.updateCounts()
+    return tree
 
-    noun_counts = np.sum(noun_results, 0)
-    verb_counts = np.sum(verb_results, 0)
 
-    noun_tree = IndexedWordNetTree('n')
-    verb_tree = IndexedWordNetTree('v')
+def _fit_verb_model(verb_counts, estimator):
+    tcm_v = TreeCutModel('v', estimator=estimator)
+    tcm_v.fit_tree(_counted_tree('v', verb_counts))
+    return tcm_v
 
-    for i, leaf in enumerate(noun_tree.leaves()):
-        leaf.value = noun_counts[i]
-    for i, leaf in enumerate(verb_tree.leaves()):
-        leaf.value = verb_counts[i]
 
-    noun_tree.updateCounts()
-    verb_tree.updateCounts()
+def fit_tree_cut_models(noun_counts, verb_counts, estimator, specificity,
+                        num_workers=2):
+    """ Fit noun and verb tree cut models given the leaf counts returned
+    by count_synsets(). The verb model is fitted by another process,
+    while this one fits the noun model, splitting the noun tree across
+    the remaining workers (see TreeCutModel.fit_tree()).
+    """
+    with Pool(1) as pool:
+        verb_result = pool.apply_async(_fit_verb_model, (verb_counts, estimator))
 
-    tcm_n = TreeCutModel('n', estimator=estimator, specificity=specificity)
-    tcm_n.fit_tree(noun_tree)
+        tcm_n = TreeCutModel('n', estimator=estimator, specificity=specificity)
+        tcm_n.fit_tree(_counted_tree('n', noun_counts),
+                       num_workers=max(1, num_workers - 1))
 
-    tcm_v = TreeCutModel('v', estimator=estimator)
-    tcm_v.fit_tree(verb_tree)
+        tcm_v = verb_result.get()
 
     return tcm_n, tcm_v
 
@@ -445,48 +769,39 @@ def fit_tree_cut_models(passwords, estimator, specificity, num_workers):
 class MyManager(BaseManager): pass
 
 
-def fit_grammar(passwords, tagtype, estimator, tcm_n, tcm_v, num_workers):
-    def do_work(passwords, tcm_n, tcm_v, out_list):
-        # a fresh instance of wordnet
-        wordnet = new_wordnet_instance()
-
-        results = []
+def fit_grammar(passwords, tagtype, estimator, tcm_n, tcm_v, num_workers,
+                synset_index=None):
+    def do_work(passwords, classes, out_list):
+        # the semantic variations of each password are counted as they
+        # come, instead of expanding them into their cross product
+        counter = VariationCounter(GrammarTagger(), tagtype)
 
         for chunks, count in passwords:
             X = []  # list of list of tuples. X[0] holds one tuple for
             # every different synset of chunks[0]
 
             for string, pos in chunks:
-                syn = synset(string, pos, wordnet, tag_converter)
+                wn_pos = wordnet_pos(string, pos, tag_converter)
                 synlist = [None]  # in case synset is None
 
-                if syn is not None:  # abstract (generalize) synset
-                    if syn.pos() == 'n':
-                        synlist = tcm_n.predict(syn)
-                    elif syn.pos() == 'v':
-                        synlist = tcm_v.predict(syn)
+                if wn_pos == 'n' or wn_pos == 'v':
+                    syn = synset_index.first(string, wn_pos)
+                    if syn is not None:  # abstract (generalize) synset
+                        synlist = classes[wn_pos][syn]
 
                 chunkset = []  # all semantic variations of this chunk
                 for syn in set(synlist):
                     chunkset.append((string, pos, syn))
                 X.append(chunkset)
 
-            # navigate the cross-product of the chunksets
-            if len(X) > 1:
-                n_variations = reduce(lambda x, y: x * len(y), X, 1)
-                count_ = count / n_variations
-                for x in reduce(product, X):
-                    results.append((x, count_))
-            elif len(X) == 1:
-                for x in X[0]:
-                    results.append(([x], count))
+            if X:
+                counter.add(X, count)
             else:
                 log.warning("Unable to feed chunks to grammar: {}".format(chunks))
 
-        out_list.extend(results)
-        # log.info("Results delivered.")
+        out_list.append((counter.tags, counter.base_structures))
 
-    grammar = Grammar(estimator=estimator, tagtype=tagtype)
+    grammar = CompactGrammar(estimator=estimator, tagtype=tagtype)
 
     # feed grammar with the 'prior' vocabulary
     if estimator == 'laplace':
@@ -495,6 +810,12 @@ def fit_grammar(passwords, tagtype, estimator, tcm_n, tcm_v, num_workers):
         grammar.add_vocabulary(verb_vocab(tcm_v, postagger, min_length=2))
 
     if tagtype != 'pos':
+        if synset_index is None:
+            synset_index = build_synset_index(passwords, num_workers)
+
+        # synset -> classes tables, built once and inherited by the workers
+        classes = {'n': tcm_n.classes, 'v': tcm_v.classes}
+
         manager = Manager()
         results = manager.list()
         pool = []
@@ -504,40 +825,71 @@ def fit_grammar(passwords, tagtype, estimator, tcm_n, tcm_v, num_workers):
             # progressively empty passwords to free memory
             # work = [passwords.pop() for i in range(min(share, len(passwords)))]
             work = passwords[i * share:i * share + share]
-            p = Process(target=do_work, args=(work, tcm_n, tcm_v, results))
+            p = Process(target=do_work, args=(work, classes, results))
             p.start()
             pool.append(p)
 
         log.info("Pool has {} workers".format(len(pool)))
 
-        del passwords[:]  # this atrocity is really necessary to free memory
-
         for p in pool:
             p.join()
 
-        grammar.fit(results, num_workers=num_workers)
+        for tags, base_structures in results:
+            grammar.merge(tags, base_structures)
     else:
-        # add null synset to every segment before passing to grammar
-        for i in range(len(passwords)):
-            x, count = passwords[i]
-            x = [(word, pos, None) for word, pos in x]
-            passwords[i] = (x, count)
-
-        grammar.fit(passwords, num_workers=num_workers)
+        # add null synset to every segment before passing to grammar;
+        # the arrays are shared with the pool rather than pickled
+        passwords = passwords.with_null_synsets().share()
+        try:
+            grammar.fit(passwords, num_workers=num_workers)
+        finally:
+            passwords.release()
 
     return grammar
 
 
 def train_grammar(password_file, outfolder, tagtype='backoff',
-                  estimator='laplace', specificity=None, num_workers=2):
-    """Train a semantic password model"""
+                  estimator='laplace', specificity=None, num_workers=2,
+                  memory_budget=None, cache_size=100000, checkpoint_dir=None,
+                  sweep=None, cache_folder=None):
+    """ Train a semantic password model.
+
+    If sweep is a list of specificities, a noun tree cut model is also
+    saved for each one, as noun_treecut.a{specificity}.tcm (see
+    TreeCutModel.sweep()).
+
+    If checkpoint_dir is given, the output of each stage (tagged chunks,
+    tree leaf counts and tree cut models) is saved there, and a later call
+    with the same checkpoint_dir skips the stages whose output is already
+    saved for the same input and options. Changing tagtype, estimator or
+    specificity reuses the tagged chunks.
+
+    If cache_folder is given, the segmentation and POS tagging caches of
+    the workers are pre-warmed from it and saved back to it (see
+    tally_chunk_tag()).
+    """
+
+    os.makedirs(outfolder, exist_ok=True)
+    if cache_folder:
+        os.makedirs(cache_folder, exist_ok=True)
+
+    checkpoint = Checkpoint(checkpoint_dir) if checkpoint_dir else None
+    signature = input_signature(password_file)
+
+    def stage(name, params, compute):
+        if checkpoint is None:
+            return compute()
+        return checkpoint.run(name, params, compute)
 
     # Chunking and Part-of-Speech tagging
 
     log.info("Counting, chunking and POS tagging... ")
 
     with Timer("counting, chunking and POS tagging", log):
-        passwords = tally_chunk_tag(password_file, num_workers)
+        passwords = stage('tagged_chunks', signature,
+                          lambda: tally_chunk_tag(password_file, num_workers,
+                                                  memory_budget, cache_folder,
+                                                  cache_size))
     # print(passwords)
 
     # Train tree cut models
@@ -546,23 +898,45 @@ def train_grammar(password_file, outfolder, tagtype='backoff',
 
     with Timer("training tree cut models", log):
         if tagtype != 'pos':
-            tcm_n, tcm_v = fit_tree_cut_models(passwords, estimator,
-                                               specificity, num_workers)
+            synset_index = stage('synset_index', signature,
+                                 lambda: build_synset_index(passwords, num_workers))
+
+            noun_counts, verb_counts = stage(
+                'leaf_counts', signature,
+                lambda: count_synsets(passwords, synset_index, num_workers))
+
+            params = None if signature is None else \
+                dict(signature, estimator=estimator, specificity=specificity)
+            tcm_n, tcm_v = stage(
+                'tree_cut_models', params,
+                lambda: fit_tree_cut_models(noun_counts, verb_counts,
+                                            estimator, specificity, num_workers))
+
+            sweep_models = TreeCutModel.sweep(tcm_n.tree, sweep, 'n', estimator) \
+                if sweep else []
         else:
+            synset_index = None
             tcm_n = None
             tcm_v = None
+            sweep_models = []
 
     log.info("Training grammar...")
 
     with Timer("training grammar", log):
-        grammar = fit_grammar(passwords, tagtype, estimator, tcm_n, tcm_v, num_workers)
+        grammar = fit_grammar(passwords, tagtype, estimator, tcm_n, tcm_v,
+                              num_workers, synset_index)
 
     log.info("Persisting grammar")
+    # clears outfolder, so that no model of a previous run is left behind
     grammar.write_to_disk(outfolder)
-    noun_filepath = os.path.join(outfolder, 'noun_treecut.pickle')
-    verb_filepath = os.path.join(outfolder, 'verb_treecut.pickle')
-    pickle.dump(tcm_n, open(noun_filepath, 'wb'), -1)
-    pickle.dump(tcm_v, open(verb_filepath, 'wb'), -1)
+    for tcm in (tcm_n, tcm_v):
+        if tcm is not None:
+            tcm.save(os.path.join(outfolder, TreeCutModel.filename(tcm.pos)))
+    for model in sweep_models:
+        model.save(os.path.join(outfolder, TreeCutModel.filename(
+            'n', model.specificity)))
+    if synset_index is not None:
+        synset_index.dump(os.path.join(outfolder, SYNSET_INDEX_FILE))
 
     log.info("Done.")
 
@@ -584,4 +958,19 @@ def options():
                         choices=['pos_semantic', 'pos', 'backoff', 'word'])
     parser.add_argument('-w', '--num_workers', type=int, default=2,
                         help="number of cores available for parallel work")
+    parser.add_argument('--memory_budget', type=int, default=None,
+                        help="memory (in MB) available for counting passwords. \
+        When exceeded, counts are spilled to temporary files and merged later.")
+    parser.add_argument('--cache_size', type=int, default=100000,
+                        help="number of entries in each worker's segmentation \
+        and POS tagging caches")
+    parser.add_argument('--cache_folder', default=None,
+                        help="folder to keep the segmentation and POS tagging \
+        caches in, so that later runs start with warm caches")
+    parser.add_argument('--checkpoint_dir', default=None,
+                        help="folder to save the output of each training stage. \
+        A run using the same folder resumes from the last completed stage.")
+    parser.add_argument('--sweep', type=int, nargs='+', default=None,
+                        help="a list of abstraction levels (see -a). A noun tree \
+        cut model is saved for each one, computed in a single pass.")
     return parser.parse_args()
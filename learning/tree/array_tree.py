@@ -0,0 +1,322 @@
+""" A tree stored in flat NumPy arrays.
+
+DefaultTree links one Python object per node through left child and
+right sibling pointers, so finding a child or listing the leaves of a
+subtree means walking those pointers one node at a time. ArrayTree
+keeps the same structure in a handful of arrays indexed by integer node
+ids, so that whole-tree passes (e.g., updating counts) are array
+operations. ArrayTreeNode offers a node-like view of an id, so code
+written for DefaultTreeNode keeps working.
+"""
+
+import numpy as np
+
+from learning.tree.abstract import Tree
+from misc.arrays import StringPool, save_arrays, load_arrays
+
+
+class ArrayTree(Tree):
+    """ A tree whose nodes are numbered in preorder, i.e., a node comes
+    before its descendants and siblings keep their order. Thus, the
+    subtree of node i is made of nodes i:end[i].
+
+        keys       - StringPool with the key of each node
+        parent     - id of the parent of each node (-1 for the root)
+        depth      - distance of each node to the root
+        end        - one past the last id in the subtree of each node
+        child_ptr  - the children of node i are
+        child_ids    child_ids[child_ptr[i]:child_ptr[i + 1]]
+        value      - frequency of each node
+        leaf_count - number of leaves under each node (1 for leaves)
+    """
+
+    # arrays saved by save(), the ones in _copy_on_write are mapped
+    # copy-on-write by load(), so that every process can change its copy
+    _saved = ('parent', 'depth', 'end', 'child_ptr', 'child_ids', 'is_leaf',
+              'level_order', 'level_bounds', 'value', 'leaf_count')
+    _copy_on_write = ('value', 'leaf_count')
+
+    def __init__(self, keys, parent, value=None):
+        """
+        Args:
+            keys - list of node keys, in preorder
+            parent - sequence with the parent id of each node (-1 for the root)
+            value - optional - frequency of each node
+        """
+        n = len(keys)
+        parent = np.asarray(parent, dtype=np.int64)
+
+        if n == 0 or parent[0] != -1 or np.any(parent[1:] >= np.arange(1, n)):
+            raise ValueError("nodes must be in preorder, starting at the root")
+
+        self.keys = StringPool.from_strings(keys)
+        self.parent = parent
+
+        # children of a node are sorted by id, which keeps sibling order
+        self.child_ids = np.argsort(parent[1:], kind='stable') + 1
+        self.child_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(parent[1:], minlength=n), out=self.child_ptr[1:])
+        self.is_leaf = self.child_ptr[1:] == self.child_ptr[:-1]
+
+        depth = [0] * n
+        parents = parent.tolist()
+        for i in range(1, n):
+            depth[i] = depth[parents[i]] + 1
+        self.depth = np.array(depth, dtype=np.int64)
+
+        # nodes grouped by depth, each group in descending order of id,
+        # so that children are added to a parent from last to first
+        self.level_order = np.lexsort((-np.arange(n), self.depth))
+        self.level_bounds = np.cumsum(np.bincount(self.depth))[:-1]
+
+        self.end = np.arange(1, n + 1, dtype=np.int64)
+        for ids in reversed(self._levels()[1:]):
+            np.maximum.at(self.end, parent[ids], self.end[ids])
+
+        self.value = np.zeros(n) if value is None else np.array(value, dtype=np.float64)
+        self.leaf_count = self.is_leaf.astype(np.int64)
+
+        self._ids = None
+        self.root = ArrayTreeNode(self, 0)
+
+    def to_arrays(self):
+        """ Return a dict with the arrays that make up this tree, which
+        from_arrays() turns back into a tree.
+        """
+        arrays = {name: getattr(self, name) for name in self._saved}
+        arrays['key_data'] = self.keys.data
+        arrays['key_offsets'] = self.keys.offsets
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """ Make a tree out of the arrays returned by to_arrays(), without
+        copying them.
+        """
+        tree = cls.__new__(cls)
+        for name in cls._saved:
+            setattr(tree, name, arrays[name])
+        tree.keys = StringPool(arrays['key_data'], arrays['key_offsets'])
+        tree._ids = None
+        tree.root = ArrayTreeNode(tree, 0)
+        return tree
+
+    def save(self, folder):
+        """ Save the arrays of this tree to a folder (see load()). """
+        save_arrays(folder, self.to_arrays())
+
+    @classmethod
+    def load(cls, folder):
+        """ Memory-map a tree saved with save(). The structure is read-only
+        and shared by every process that loads it. Values and leaf counts
+        are copy-on-write: they can be changed, but changes are private
+        to the process.
+        """
+        return cls.from_arrays(load_arrays(folder, copy_on_write=cls._copy_on_write))
+
+    @classmethod
+    def from_tree(cls, tree):
+        """ Convert a DefaultTree (or any tree whose nodes implement
+        children()) into an ArrayTree with the same nodes and values.
+        """
+        return cls(*cls._flatten(tree.root))
+
+    @staticmethod
+    def _flatten(root):
+        """ Return the keys, parent ids and values of the nodes under root,
+        in preorder.
+        """
+        keys, parent, value = [], [], []
+        stack = [(root, -1)]
+
+        while stack:
+            node, parent_id = stack.pop()
+            node_id = len(keys)
+            keys.append(node.key)
+            parent.append(parent_id)
+            value.append(node.value)
+            for child in reversed(node.children()):
+                stack.append((child, node_id))
+
+        return keys, parent, value
+
+    def __len__(self):
+        return len(self.parent)
+
+    @property
+    def ids(self):
+        """A dict mapping each key to the list of ids of nodes with that key."""
+        if self._ids is None:
+            self._ids = dict()
+            for i, key in enumerate(self.keys):
+                self._ids.setdefault(key, []).append(i)
+        return self._ids
+
+    def _levels(self):
+        """Ids of nodes grouped by depth (see level_order)."""
+        return np.split(self.level_order, self.level_bounds)
+
+    def node(self, i):
+        return ArrayTreeNode(self, i)
+
+    @property
+    def index(self):
+        """ A mapping from keys to the list of nodes with that key, like
+        IndexedWordNetTree.index.
+        """
+        return _NodeIndex(self)
+
+    def get_nodes(self, key):
+        return self.index[key] if key in self.ids else None
+
+    def children_ids(self, i):
+        return self.child_ids[self.child_ptr[i]:self.child_ptr[i + 1]]
+
+    def leaf_ids(self, i=0):
+        """Return the ids of the leaves under node i, in preorder."""
+        ids = np.arange(i, self.end[i])
+        return ids[self.is_leaf[i:self.end[i]]]
+
+    def leaves(self):
+        return [ArrayTreeNode(self, i) for i in self.leaf_ids().tolist()]
+
+    def flat(self):
+        """ Return every node. Parents are guaranteed to preceed their
+        children.
+        """
+        return [ArrayTreeNode(self, i) for i in range(len(self))]
+
+    def ancestors(self, ids):
+        """Return the set of the given nodes and all their ancestors."""
+        parent = self.parent
+        result = set()
+        for i in ids:
+            i = int(i)
+            while i >= 0 and i not in result:
+                result.add(i)
+                i = int(parent[i])
+        return result
+
+    def updateAncestors(self, ids):
+        """ Like updateCounts(), after only the values of the given nodes
+        changed: only the values of their ancestors are recomputed.
+        """
+        value = self.value
+        for i in sorted(self.ancestors(ids), reverse=True):
+            if self.is_leaf[i]:
+                continue
+            # same order of additions as updateCounts()
+            total = 0.0
+            for c in self.children_ids(i)[::-1].tolist():
+                total += value[c]
+            value[i] = total
+
+    def updateCounts(self):
+        """ Set the value and leaf count of internal nodes to the sum of
+        the values and leaf counts of their children, bottom-up.
+        """
+        value = self.value
+        value[~self.is_leaf] = 0
+        leaf_count = self.leaf_count = self.is_leaf.astype(np.int64)
+
+        for ids in reversed(self._levels()[1:]):
+            parents = self.parent[ids]
+            np.add.at(value, parents, value[ids])
+            np.add.at(leaf_count, parents, leaf_count[ids])
+
+
+class _NodeIndex(object):
+    """ Read-only mapping from keys to lists of ArrayTreeNode. """
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    def __contains__(self, key):
+        return key in self.tree.ids
+
+    def __getitem__(self, key):
+        return [ArrayTreeNode(self.tree, i) for i in self.tree.ids[key]]
+
+    def __len__(self):
+        return len(self.tree.ids)
+
+    def __iter__(self):
+        return iter(self.tree.ids)
+
+
+class ArrayTreeNode(object):
+    """ A view of node `id` of an ArrayTree that behaves like a
+    WordNetTreeNode. Views are cheap and compare equal if they refer to
+    the same node.
+    """
+
+    __slots__ = ('tree', 'id')
+
+    def __init__(self, tree, id):
+        self.tree = tree
+        self.id = id
+
+    @property
+    def key(self):
+        return self.tree.keys[self.id]
+
+    @property
+    def value(self):
+        return self.tree.value[self.id].item()
+
+    @value.setter
+    def value(self, value):
+        self.tree.value[self.id] = value
+
+    @property
+    def leaf_count(self):
+        return self.tree.leaf_count[self.id].item()
+
+    @property
+    def parent(self):
+        parent = self.tree.parent[self.id]
+        return ArrayTreeNode(self.tree, parent.item()) if parent >= 0 else None
+
+    def children(self):
+        return [ArrayTreeNode(self.tree, i) for i in self.tree.children_ids(self.id).tolist()]
+
+    def child(self, key):
+        for i in self.tree.children_ids(self.id).tolist():
+            if self.tree.keys[i] == key:
+                return ArrayTreeNode(self.tree, i)
+        return None
+
+    def find(self, key):
+        return self.child(key)
+
+    def is_leaf(self):
+        return bool(self.tree.is_leaf[self.id])
+
+    def has_children(self):
+        return not self.is_leaf()
+
+    def leaves(self):
+        return [ArrayTreeNode(self.tree, i) for i in self.tree.leaf_ids(self.id).tolist()]
+
+    def flat(self):
+        return [ArrayTreeNode(self.tree, i) for i in range(self.id, self.tree.end[self.id])]
+
+    def increment_value(self, delta, cumulative=True):
+        tree = self.tree
+        i = self.id
+        while i >= 0:
+            tree.value[i] += delta
+            i = tree.parent[i] if cumulative else -1
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayTreeNode) and \
+            self.tree is other.tree and self.id == other.id
+
+    def __hash__(self):
+        return hash((id(self.tree), self.id))
+
+    def __str__(self):
+        return self.key
+
+    def __repr__(self):
+        return self.__str__()
@@ -8,41 +8,90 @@ Created on Mar 23, 2013
 
 """
 
+import numpy as np
+
+from functools import partial
+
 from . import _li_abe
 from . import _wagner
+from . import _search
+from ._search import SearchState
+from ..array_tree import ArrayTree
+from ..default_tree import DepthFirstIterator
 
 
 
 class li_abe:
 
-    def findcut(self, tree, estimator=None):
-        return self._findcut(tree.root, tree.root.value, estimator)
+    def findcut(self, tree, estimator=None, state=None, dirty=None, num_workers=1):
+        return self._findcut(tree, estimator, state, dirty, num_workers)
+
+    def _findcut(self, tree, estimator=None, state=None, dirty=None,
+                 num_workers=1, **args):
+        """ Returns the cut of minimum description length, as a list of
+        nodes in depth-first order (see _search.findcut()). tree is an
+        ArrayTree or a tree of linked nodes (e.g., WordNetTree).
+
+        state and dirty allow re-evaluating only part of the tree after
+        a previous search (see _search.SearchState). If num_workers > 1,
+        a full search is split across a pool of processes (see
+        _search.findcut_parallel()).
+        """
+        array_tree, get_node, samplesize, terms = self._prepare(tree, estimator)
+        dl = self._dl(samplesize, **args)
+
+        if num_workers > 1 and (dirty is None or state is None or state.D is None):
+            cut = _search.findcut_parallel(array_tree, terms.tolist(), dl,
+                                           num_workers, state)
+        else:
+            cut = _search.findcut(array_tree, terms.tolist(), dl, state, dirty)
+        return [get_node(i) for i in cut]
+
+    def _prepare(self, tree, estimator):
+        """ Returns the tree as an ArrayTree, a function that maps ids to
+        nodes of the given tree, the sample size and the ddl term of each
+        node.
+        """
+        if isinstance(tree, ArrayTree):
+            array_tree = tree
+            values, leaf_counts = tree.value, tree.leaf_count
+            get_node = tree.node
+        else:
+            array_tree = ArrayTree.from_tree(tree)
+            nodes = [node for depth, node in DepthFirstIterator(tree.root)]
+            values = np.array([node.value for node in nodes], dtype=np.float64)
+            leaf_counts = np.array([node.leaf_count for node in nodes])
+            get_node = nodes.__getitem__
 
-    def _findcut(self, node, samplesize, estimator=None, **args):
-        # bind common args for the sake of conciseness
-        findcut = lambda arg: self._findcut(arg, samplesize, estimator, **args)
-        desc_length = lambda arg: self.desc_length(arg, samplesize, estimator, **args)
+        samplesize = tree.root.value
 
-        if node.is_leaf():
-            return [node]
+        if estimator is not None:
+            probabilities = estimator.probability(values, leaf_counts)
         else:
-            c = []
+            probabilities = None
 
-            for child in node.children():
-                c.extend(findcut(child))
+        terms = _li_abe.ddl_terms(values, leaf_counts, samplesize, probabilities)
 
-            # using <= instead of < leads to better generalization
-            # deviates slightly from Li & Abe
-            if desc_length([node]) <= desc_length(c):
-                return [node]
-            else:
-                return c
+        return array_tree, get_node, samplesize, terms
 
     def desc_length(self, cut, sample_size, estimator=None, **args):
         """ Returns the description length of a cut """
         dl = _li_abe.compute_dl(cut, sample_size, estimator)
         return dl
 
+    def ddl_desc_length(self, ddl, len_cut, sample_size, **args):
+        """ Returns the description length of a cut given its size and
+        data description length
+        """
+        return _li_abe.dl(ddl, len_cut, sample_size)
+
+    def _dl(self, sample_size, **args):
+        """ Returns ddl_desc_length() as a function of ddl and len_cut,
+        which can be pickled and sent to the workers of
+        _search.findcut_parallel() under any start method.
+        """
+        return partial(_li_abe.dl, sample_size=sample_size)
+
 
 class wagner(li_abe):
     """
@@ -57,10 +106,11 @@ class wagner(li_abe):
 
     default_c = 50  # default weighting factor
 
-    def findcut(self, tree, weight=None, estimator=None):
+    def findcut(self, tree, weight=None, estimator=None, state=None, dirty=None,
+                num_workers=1):
         if weight is None:
             weight = wagner.default_c
-        return self._findcut(tree.root, tree.root.value, estimator, weight=weight)
+        return self._findcut(tree, estimator, state, dirty, num_workers, weight=weight)
 
     def desc_length(self, cut, sample_size, estimator=None, weight=50):
         """ Returns the description length of a cut """
@@ -68,6 +118,23 @@ class wagner(li_abe):
 
         return dl
 
+    def findcuts(self, tree, weights, estimator=None):
+        """ Returns one cut per weight, as findcut() would, with a single
+        traversal of the tree.
+        """
+        array_tree, get_node, samplesize, terms = self._prepare(tree, estimator)
+        weights = np.asarray(weights, dtype=np.float64)
+        dl = self._dl(samplesize, weight=weights)
+
+        cuts = _search.findcuts(array_tree, terms.tolist(), dl, len(weights))
+        return [[get_node(i) for i in cut] for cut in cuts]
+
+    def ddl_desc_length(self, ddl, len_cut, sample_size, weight=50):
+        return _wagner.dl(ddl, len_cut, sample_size, weight)
+
+    def _dl(self, sample_size, weight=50):
+        return partial(_wagner.dl, sample_size=sample_size, c=weight)
+
 #:::::::::::::::::::::
 # PUBLIC API
 #:::::::::::::::::::::
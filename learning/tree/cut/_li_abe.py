@@ -7,6 +7,10 @@ as described in Hang Li and Naoki Abe (1998).
 
 import math
 
+import numpy as np
+
+LOG2 = math.log(2)
+
 
 def pc(f, s):
     """^P(C) - probability of a category to occur in the sample.
@@ -69,12 +73,15 @@ def compute_ddl(cut, sample_size, estimator = None):
 
     cut - a list of tuples of the form (class_name, frequency, # of children (leaves) )
     """
+    values = np.array([node.value for node in cut], dtype=np.float64)
+    leaf_counts = np.array([node.leaf_count for node in cut])
+
     if estimator is not None:
-        prob = estimator.probability
+        probabilities = estimator.probability(values, leaf_counts)
     else:
-        prob = lambda node: pc(node.value, sample_size)
+        probabilities = None
 
-    return ddl([(node.value, pn(prob(node), node.leaf_count)) for node in cut])
+    return -ddl_terms(values, leaf_counts, sample_size, probabilities).sum()
 
 
 def compute_pdl(cut, sample_size):
@@ -92,6 +99,52 @@ def compute_dl(cut, sample_size, estimator=None):
     return compute_ddl(cut, sample_size, estimator) + compute_pdl(cut, sample_size)
 
 
+def ddl_terms(values, leaf_counts, sample_size, probabilities=None):
+    """ Returns an array with, for every node, its term in the data
+    description length of a cut, i.e., the ddl of a cut is minus the sum
+    of the terms of its nodes (see ddl()).
+
+    values        - array with the frequency of each node
+    leaf_counts   - array with the # of leaves of each node
+    probabilities - array with ^P(C) of each node, if not given by pc()
+    """
+    values = np.asarray(values, dtype=np.float64)
+
+    if probabilities is None:
+        probabilities = values / sample_size
+
+    p = np.asarray(probabilities, dtype=np.float64) / leaf_counts
+
+    terms = np.zeros(len(values))
+    positive = p > 0.0
+    terms[positive] = np.log(p[positive]) / LOG2 * values[positive]
+
+    return terms
+
+
+def description_lengths(values, leaf_counts, sample_size, probabilities=None):
+    """ Computes the data, parameter and total description lengths of a
+    cut in one pass over arrays (see compute_ddl(), compute_pdl() and
+    compute_dl()).
+
+    values        - array with the frequency of each node in the cut
+    leaf_counts   - array with the # of leaves of each node in the cut
+    probabilities - array with ^P(C) of each node, if not given by pc()
+
+    Returns:
+        a tuple (ddl, pdl, dl)
+    """
+    ddl_ = -ddl_terms(values, leaf_counts, sample_size, probabilities).sum()
+    pdl_ = pdl(len(values), sample_size)
+
+    return ddl_, pdl_, ddl_ + pdl_
+
+
+def dl(ddl, len_cut, sample_size):
+    """ Description length of a cut given its data description length. """
+    return ddl + pdl(len_cut, sample_size)
+
+
 def test_cut(cut, sample_size):
     ddl = compute_ddl(cut, sample_size)
     pdl = compute_pdl(cut, sample_size)
@@ -0,0 +1,243 @@
+"""
+Bottom-up search for the tree cut of minimum description length.
+
+The best cut of the subtree rooted at a node is either the node itself
+or the union of the best cuts of its children (Li & Abe, 1998). Both the
+data description length (a sum of per-node terms) and the parameter
+description length (a function of the number of nodes) of a union of
+cuts follow from two statistics of each part: the sum of their ddl terms
+and their size. So nodes are visited once, children before parents,
+keeping those two numbers per node, and each decision costs O(children).
+"""
+
+import heapq
+from multiprocessing import Pool
+
+import numpy as np
+
+
+class SearchState(object):
+    """ The statistics findcut() keeps for each node:
+
+        D      - sum of the ddl terms of the best cut under each node
+        K      - size of the best cut under each node
+        chosen - True if a node is the best cut of its subtree
+
+    Passing the state of a previous search to findcut(), along with the
+    nodes whose ddl terms changed since, re-evaluates only those nodes
+    and their ancestors.
+    """
+
+    def __init__(self):
+        self.D = None
+        self.K = None
+        self.chosen = None
+
+
+def findcut(tree, terms, dl, state=None, dirty=None):
+    """ Find the cut of minimum description length of a tree.
+
+    Args:
+        tree - an ArrayTree, only its structure is used
+        terms - the ddl term of each node, by id (see _li_abe.ddl_terms())
+        dl - a function (ddl, cut size) -> description length
+        state - optional - a SearchState, filled (or updated) in place
+        dirty - optional - ids of the nodes whose terms changed since
+            state was filled. If None, every node is evaluated.
+
+    Returns:
+        a list with the ids of the nodes in the cut, in preorder
+    """
+    n = len(tree)
+
+    if state is None:
+        state = SearchState()
+
+    if dirty is None or state.D is None:
+        state.D = [0] * n
+        state.K = [0] * n
+        state.chosen = [False] * n
+        structure = (tree.is_leaf.tolist(), tree.child_ptr.tolist(),
+                     tree.child_ids.tolist())
+        # children have greater ids than their parents
+        nodes = reversed(range(n))
+    else:
+        structure = (tree.is_leaf, tree.child_ptr, tree.child_ids)
+        nodes = sorted(tree.ancestors(dirty), reverse=True)
+
+    _evaluate(nodes, terms, dl, structure, state.D, state.K, state.chosen)
+
+    return _topmost(tree, state.chosen)
+
+
+def _evaluate(nodes, terms, dl, structure, D, K, chosen, offset=0):
+    """ Decide, for each node, between the node and the union of the best
+    cuts of its children. Nodes must come after their children. The
+    statistics of node i are kept at index i - offset of D, K and chosen.
+    """
+    is_leaf, child_ptr, child_ids = structure
+
+    for i in nodes:
+        j = i - offset
+        if is_leaf[i]:
+            D[j] = terms[i]
+            K[j] = 1
+            chosen[j] = True
+            continue
+
+        d = 0
+        k = 0
+        for c in child_ids[child_ptr[i]:child_ptr[i + 1]]:
+            d += D[c - offset]
+            k += K[c - offset]
+
+        # using <= instead of < leads to better generalization
+        # deviates slightly from Li & Abe
+        if dl(-terms[i], 1) <= dl(-d, k):
+            D[j] = terms[i]
+            K[j] = 1
+            chosen[j] = True
+        else:
+            D[j] = d
+            K[j] = k
+            chosen[j] = False
+
+
+def _topmost(tree, chosen):
+    """The cut is made of the topmost chosen nodes."""
+    n = len(tree)
+    end = tree.end.tolist()
+    cut = []
+    i = 0
+    while i < n:
+        if chosen[i]:
+            cut.append(i)
+            i = end[i]
+        else:
+            i += 1
+
+    return cut
+
+
+def frontier(tree, n_subtrees):
+    """ Split a tree into about n_subtrees disjoint subtrees of similar
+    size, by repeatedly replacing the largest subtree with the subtrees of
+    its children, starting from the root.
+
+    Returns:
+        a list with the ids of the roots of the subtrees, whose ancestors
+        are the only nodes left out of them
+    """
+    end = tree.end
+    heap = [(-int(end[0]), 0)]
+    roots = []
+    while heap and len(heap) + len(roots) < n_subtrees:
+        size, i = heapq.heappop(heap)
+        children = tree.children_ids(i).tolist()
+        if not children:
+            roots.append(i)
+            continue
+        for c in children:
+            heapq.heappush(heap, (-int(end[c] - c), c))
+    return sorted(roots + [i for size, i in heap])
+
+
+# the search shared with pool workers (see findcut_parallel())
+_worker_search = None
+
+
+def _init_worker(tree, terms, dl):
+    global _worker_search
+    structure = (tree.is_leaf.tolist(), tree.child_ptr.tolist(),
+                 tree.child_ids.tolist())
+    _worker_search = (tree.end, structure, terms, dl)
+
+
+def _search_subtree(root):
+    end, structure, terms, dl = _worker_search
+    size = int(end[root]) - root
+    D, K, chosen = [0] * size, [0] * size, [False] * size
+    _evaluate(reversed(range(root, root + size)), terms, dl, structure,
+              D, K, chosen, offset=root)
+    return root, D, K, chosen
+
+
+def findcut_parallel(tree, terms, dl, num_workers, state=None):
+    """ Same as findcut(), splitting the tree into subtrees (see frontier())
+    searched by a pool of num_workers processes. The decision at a node
+    only depends on the best cuts of its children, so the subtrees are
+    searched independently and their roots are then combined with the
+    rest of the tree, bottom-up.
+    """
+    n = len(tree)
+    if state is None:
+        state = SearchState()
+
+    state.D = D = [0] * n
+    state.K = K = [0] * n
+    state.chosen = chosen = [False] * n
+
+    roots = frontier(tree, 4 * num_workers)
+
+    with Pool(num_workers, initializer=_init_worker,
+              initargs=(tree, terms, dl)) as pool:
+        for root, d, k, c in pool.imap_unordered(_search_subtree, roots):
+            end = root + len(d)
+            D[root:end] = d
+            K[root:end] = k
+            chosen[root:end] = c
+
+    structure = (tree.is_leaf, tree.child_ptr, tree.child_ids)
+    top = tree.ancestors(roots) - set(roots)
+    _evaluate(sorted(top, reverse=True), terms, dl, structure, D, K, chosen)
+
+    return _topmost(tree, chosen)
+
+
+def findcuts(tree, terms, dl, n_cuts):
+    """ Same as findcut() for several description length functions at
+    once, e.g., one per weight of the Wagner variant. The statistics of
+    each node are kept in rows of n_cuts columns, one per function.
+
+    Args:
+        tree - an ArrayTree, only its structure is used
+        terms - the ddl term of each node, by id (see _li_abe.ddl_terms())
+        dl - a function (ddl, cut size) -> description length over arrays
+            of n_cuts elements
+        n_cuts - the number of cuts to find
+
+    Returns:
+        a list of n_cuts lists with the ids of the nodes in each cut
+    """
+    n = len(tree)
+    is_leaf = tree.is_leaf.tolist()
+    child_ptr = tree.child_ptr.tolist()
+    child_ids = tree.child_ids.tolist()
+
+    D = np.zeros((n, n_cuts))
+    K = np.zeros((n, n_cuts), dtype=np.int64)
+    chosen = np.zeros((n, n_cuts), dtype=bool)
+
+    D[tree.is_leaf] = np.asarray(terms)[tree.is_leaf, None]
+    K[tree.is_leaf] = 1
+    chosen[tree.is_leaf] = True
+
+    one = np.ones(n_cuts, dtype=np.int64)
+
+    for i in reversed(range(n)):
+        if is_leaf[i]:
+            continue
+
+        d = np.zeros(n_cuts)
+        k = np.zeros(n_cuts, dtype=np.int64)
+        for c in child_ids[child_ptr[i]:child_ptr[i + 1]]:
+            d += D[c]
+            k += K[c]
+
+        # using <= instead of < (see findcut())
+        node = dl(np.full(n_cuts, -terms[i]), one) <= dl(-d, k)
+        chosen[i] = node
+        D[i] = np.where(node, terms[i], d)
+        K[i] = np.where(node, 1, k)
+
+    return [_topmost(tree, column) for column in chosen.T.tolist()]
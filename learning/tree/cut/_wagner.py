@@ -19,5 +19,13 @@ def compute_dl(cut, sample_size, c, estimator=None):
     return pdl + weighting_factor*ddl
 
 
+def dl(ddl, len_cut, sample_size, c):
+    """ Description length of a cut given its data description length. """
+    pdl = _li_abe.pdl(len_cut, sample_size)
+    weighting_factor = c * (math.log(sample_size, 2) / sample_size)
+
+    return pdl + weighting_factor*ddl
+
+
 if __name__ == '__main__':
     pass
@@ -6,9 +6,12 @@ Inspired by Cormen's Introduction to Algorithms 3rd edition (p. 247).
 """
 
 from learning.tree.abstract import Tree, TreeNode
+from learning.tree.array_tree import ArrayTree, ArrayTreeNode
 import json
+import numpy as np
 from math import log
 from collections import deque
+from collections.abc import Mapping
 
 class DefaultTreeNode (TreeNode):
     """ A base class for tree nodes """
@@ -385,6 +388,7 @@ class TreeCut(object):
                 self.leaf2cut[c.key].add(c)
 
         self.cut_ids = set([id(c) for c in self.cut])
+        self._class_table = None
 
     def __iter__(self):
         return iter(self.cut)
@@ -407,11 +411,44 @@ class TreeCut(object):
             return None
 
     def abstract_synset(self, syn):
+        """ Returns the cut nodes that represent a synset, given as a
+        wordnet.Synset or as a synset name (str).
+        """
+        name = syn if isinstance(syn, str) else syn.name()
         try:
-            key = 's.' + syn.name()
+            key = 's.' + name
             return self.leaf2cut[key]
         except:
-            return self.leaf2cut[syn.name()]
+            return self.leaf2cut[name]
+
+    def class_table(self):
+        """ Return a dict mapping synset names to a tuple with the keys of
+        the cut nodes that represent them, i.e., the keys of the nodes
+        returned by abstract_synset(), sorted. Built on first use, unless
+        loaded with an ArrayTreeCut.
+        """
+        if getattr(self, '_class_table', None) is None:
+            leaves = dict()
+            for key, classes in self._leaf_classes():
+                leaves[key] = tuple(sorted(set(classes)))
+
+            table = dict()
+            for key in leaves:
+                # a synset with hyponyms is under its 's.' leaf (see
+                # abstract_synset()), so both keys may be a synset name
+                names = (key, key[2:]) if key.startswith('s.') else (key,)
+                for name in names:
+                    classes = leaves.get('s.' + name)
+                    table[name] = classes if classes is not None else leaves[name]
+
+            self._class_table = table
+
+        return self._class_table
+
+    def _leaf_classes(self):
+        """Iterate over (leaf key, keys of the cut nodes above it)."""
+        for key, nodes in self.leaf2cut.items():
+            yield key, [node.key for node in nodes]
 
     def __contains__(self, item):
         return id(item) in self.cut_ids
@@ -428,12 +465,210 @@ class TreeCut(object):
         self.tree = d['tree']
         cut_ids = set(d['cut']) # the ids of cut nodes
         self.cut = []
-        for depth, node in DepthFirstIterator(self.tree.root):
-            if node.id in cut_ids:
-                self.cut.append(node)
+        if isinstance(self.tree, ArrayTree):
+            # ids of an ArrayTree are in depth-first order already
+            self.cut = [self.tree.node(i) for i in sorted(cut_ids)]
+        else:
+            for depth, node in DepthFirstIterator(self.tree.root):
+                if node.id in cut_ids:
+                    self.cut.append(node)
         self._build_indexes()
 
 
+class ArrayTreeCut(TreeCut):
+    """ A TreeCut of an ArrayTree whose leaf -> cut nodes mapping is made
+    of arrays instead of a dict of sets, so that it can be saved and
+    memory-mapped along with the tree (see TreeCutModel.save()).
+
+        node_ids  - ids of the nodes in the cut, in preorder
+        leaf_keys - sorted utf-8 keys of the leaves under the cut
+        leaf_ptr  - the ids of the cut nodes above leaf_keys[i] are
+        leaf_cut    leaf_cut[leaf_ptr[i]:leaf_ptr[i + 1]]
+
+    The class table (see TreeCut.class_table()) can be given as arrays as
+    well, in the same layout (see class_arrays()), so that it is not built
+    when the tree cut is loaded.
+    """
+
+    def __init__(self, tree, node_ids, leaf_keys=None, leaf_ptr=None, leaf_cut=None,
+                 class_arrays=None):
+        self.tree = tree
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+
+        if leaf_keys is None:
+            leaf_keys, leaf_ptr, leaf_cut = self._leaf_arrays()
+        self.leaf_keys = leaf_keys
+        self.leaf_ptr = leaf_ptr
+        self.leaf_cut = leaf_cut
+
+        self.cut = [tree.node(i) for i in self.node_ids.tolist()]
+        self.leaf2cut = _LeafToCut(self)
+        self._class_arrays = class_arrays
+        self._class_table = None if class_arrays is None else _ClassTable(self, *class_arrays)
+
+    @classmethod
+    def from_treecut(cls, treecut):
+        """ Convert a TreeCut of any tree, converting the tree to an
+        ArrayTree (with the same values) if needed.
+        """
+        if isinstance(treecut, ArrayTreeCut):
+            return treecut
+
+        tree = treecut.tree
+        if isinstance(tree, ArrayTree):
+            return cls(tree, sorted(node.id for node in treecut.cut))
+
+        # ids of an ArrayTree are the depth-first order of the nodes
+        ids = dict()
+        for i, (depth, node) in enumerate(DepthFirstIterator(tree.root)):
+            ids[id(node)] = i
+
+        array_tree = ArrayTree.from_tree(tree)
+        value = array_tree.value.copy()
+        array_tree.updateCounts()  # for leaf counts
+        array_tree.value = value
+
+        return cls(array_tree, sorted(ids[id(node)] for node in treecut.cut))
+
+    def _leaf_arrays(self):
+        tree = self.tree
+        leaves = [tree.leaf_ids(i) for i in self.node_ids.tolist()]
+        owner = np.repeat(self.node_ids, [len(ids) for ids in leaves])
+        leaves = np.concatenate(leaves) if leaves else np.zeros(0, dtype=np.int64)
+
+        keys = tree.keys.tolist()
+        keys = np.array([keys[i].encode('utf-8', 'surrogateescape')
+                         for i in leaves.tolist()], dtype=bytes)
+        leaf_keys, key_ids = np.unique(keys, return_inverse=True)
+        key_ids = key_ids.reshape(-1)
+
+        # group cut nodes by key, dropping repeated (key, node) pairs
+        order = np.lexsort((owner, key_ids))
+        key_ids, owner = key_ids[order], owner[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (key_ids[1:] != key_ids[:-1]) | (owner[1:] != owner[:-1])
+        key_ids, leaf_cut = key_ids[first], owner[first]
+
+        leaf_ptr = np.zeros(len(leaf_keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(key_ids, minlength=len(leaf_keys)), out=leaf_ptr[1:])
+
+        return leaf_keys, leaf_ptr, leaf_cut
+
+    def class_arrays(self):
+        """ Return the class table as a tuple of arrays (class_names,
+        class_ptr, class_cut): the classes of the synset class_names[i]
+        (sorted, utf-8) are the keys of the cut nodes with ids
+        class_cut[class_ptr[i]:class_ptr[i + 1]].
+        """
+        if self._class_arrays is None:
+            keys = self.tree.keys
+            ids = {keys[i]: i for i in self.node_ids.tolist()}
+
+            table = sorted((name.encode('utf-8', 'surrogateescape'), classes)
+                           for name, classes in self.class_table().items())
+            class_names = np.array([name for name, classes in table], dtype=bytes)
+            class_ptr = np.zeros(len(table) + 1, dtype=np.int64)
+            np.cumsum([len(classes) for name, classes in table], out=class_ptr[1:])
+            class_cut = np.array([ids[key] for name, classes in table for key in classes],
+                                 dtype=np.int64)
+            self._class_arrays = (class_names, class_ptr, class_cut)
+
+        return self._class_arrays
+
+    def cut_ids_of(self, key):
+        """Return the ids of the cut nodes above the leaves with a key."""
+        encoded = key.encode('utf-8', 'surrogateescape')
+        leaf_keys = self.leaf_keys
+        i = int(np.searchsorted(leaf_keys, encoded))
+        if i == len(leaf_keys) or leaf_keys[i] != encoded:
+            return None
+        return self.leaf_cut[self.leaf_ptr[i]:self.leaf_ptr[i + 1]]
+
+    def _leaf_classes(self):
+        keys = self.tree.keys
+        cut_keys = {i: keys[i] for i in self.node_ids.tolist()}
+        ptr = self.leaf_ptr.tolist()
+        leaf_cut = self.leaf_cut.tolist()
+        for i, key in enumerate(self.leaf_keys.tolist()):
+            yield key.decode('utf-8', 'surrogateescape'), \
+                [cut_keys[c] for c in leaf_cut[ptr[i]:ptr[i + 1]]]
+
+    def __contains__(self, item):
+        if not isinstance(item, ArrayTreeNode) or item.tree is not self.tree:
+            return False
+        # node ids are sorted
+        i = int(np.searchsorted(self.node_ids, item.id))
+        return i < len(self.node_ids) and self.node_ids[i] == item.id
+
+    def __getstate__(self):
+        return {
+            'tree': self.tree,
+            'node_ids': self.node_ids,
+            'leaf_keys': self.leaf_keys,
+            'leaf_ptr': self.leaf_ptr,
+            'leaf_cut': self.leaf_cut,
+            'class_arrays': self._class_arrays
+        }
+
+    def __setstate__(self, d):
+        self.__init__(d['tree'], d['node_ids'], d['leaf_keys'], d['leaf_ptr'],
+                      d['leaf_cut'], d.get('class_arrays'))
+
+
+class _LeafToCut(object):
+    """ Read-only mapping from leaf keys to sets of cut nodes, like
+    TreeCut.leaf2cut, backed by the arrays of an ArrayTreeCut.
+    """
+
+    def __init__(self, treecut):
+        self.treecut = treecut
+
+    def __contains__(self, key):
+        return self.treecut.cut_ids_of(key) is not None
+
+    def __getitem__(self, key):
+        ids = self.treecut.cut_ids_of(key)
+        if ids is None:
+            raise KeyError(key)
+        tree = self.treecut.tree
+        return set(tree.node(i) for i in ids.tolist())
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __len__(self):
+        return len(self.treecut.leaf_keys)
+
+
+class _ClassTable(Mapping):
+    """ Read-only mapping from synset names to tuples of cut node keys,
+    like TreeCut.class_table(), backed by the arrays of an ArrayTreeCut
+    (see ArrayTreeCut.class_arrays()).
+    """
+
+    def __init__(self, treecut, class_names, class_ptr, class_cut):
+        self.tree_keys = treecut.tree.keys
+        self.class_names = class_names
+        self.class_ptr = class_ptr
+        self.class_cut = class_cut
+
+    def __getitem__(self, name):
+        encoded = name.encode('utf-8', 'surrogateescape')
+        i = int(np.searchsorted(self.class_names, encoded))
+        if i == len(self.class_names) or self.class_names[i] != encoded:
+            raise KeyError(name)
+        keys = self.tree_keys
+        return tuple(keys[c] for c in
+                     self.class_cut[self.class_ptr[i]:self.class_ptr[i + 1]].tolist())
+
+    def __iter__(self):
+        for name in self.class_names.tolist():
+            yield name.decode('utf-8', 'surrogateescape')
+
+    def __len__(self):
+        return len(self.class_names)
+
+
 class DepthFirstIterator(object):
 
     def __init__(self, node):
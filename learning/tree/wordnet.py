@@ -7,8 +7,17 @@ Created on 2013-03-25
 
 from nltk.corpus import wordnet as wn
 from learning.tree.default_tree import DefaultTree, DefaultTreeNode, DepthFirstIterator
+from learning.tree.array_tree import ArrayTree
 from collections import deque
 
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+# bump when the layout of the saved arrays changes
+SNAPSHOT_VERSION = 1
+
 class WordNetTreeNode(DefaultTreeNode):
 
     # a counter for ids. Everytime a node is created, next_id is assigned to it
@@ -329,5 +338,62 @@ class IndexedWordNetTree(WordNetTree):
         self.index = self.hashtable()
 
 
+class ArrayWordNetTree(ArrayTree):
+    """ The same tree as IndexedWordNetTree, with the same nodes in the
+    same order, stored as an ArrayTree. Nodes with a given key are
+    available through index or get_nodes(), like in IndexedWordNetTree.
+    """
+
+    def __init__(self, pos, wordnet=None):
+        tree = WordNetTree(pos, wordnet)
+        super(ArrayWordNetTree, self).__init__(*ArrayTree._flatten(tree.root))
+        self.pos = pos
+
+    @classmethod
+    def snapshot(cls, pos, wordnet=None, folder=None):
+        """ Load the tree from a snapshot saved in folder, building and
+        saving it on first use. Snapshots are specific to a version of
+        WordNet and are memory-mapped, so every process shares the same
+        read-only structure, while values and leaf counts are
+        copy-on-write (see ArrayTree.load()).
+
+        Args:
+            pos - 'n' for nouns and 'v' for verbs
+            wordnet - optional - an instance of WordNetCorpusReader
+            folder - optional - where snapshots are kept, snapshot_dir()
+                by default
+        """
+        tree = cls.load(cls.snapshot_path(pos, wordnet, folder))
+        tree.pos = pos
+        return tree
+
+    @classmethod
+    def snapshot_path(cls, pos, wordnet=None, folder=None):
+        """ Return the path of the snapshot of a tree, which can be passed
+        to load(), building the snapshot if it doesn't exist.
+        """
+        wordnet = wn if wordnet is None else wordnet
+        folder = snapshot_dir() if folder is None else folder
+        path = os.path.join(folder, 'wordnet-{}-{}.v{}'.format(
+            wordnet.get_version(), pos, SNAPSHOT_VERSION))
+
+        if not os.path.isdir(path):
+            log.info("Compiling WordNet tree snapshot {}".format(path))
+            os.makedirs(folder, exist_ok=True)
+            cls(pos, wordnet).save(path)
+
+        return path
+
+
+def snapshot_dir():
+    """ Return the folder where ArrayWordNetTree.snapshot() keeps the
+    compiled trees by default: semantic-guesser in $XDG_CACHE_HOME, or in
+    ~/.cache if it isn't set.
+    """
+    cache = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'semantic-guesser')
+
+
 if __name__ == '__main__':
     pass
@@ -0,0 +1,345 @@
+"""
+Helpers for storing strings and tables compactly in NumPy arrays.
+"""
+
+import json
+import mmap
+import os
+import shutil
+
+import numpy as np
+
+
+class StringPool(object):
+    """ An immutable list of strings stored as a single utf-8 buffer and an
+    array of offsets, i.e., string i is data[offsets[i]:offsets[i + 1]].
+
+    Compared to a list of str, it has no per-string object overhead and
+    it is made of plain arrays, so it can live in shared or mapped memory.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        return cls.from_bytes([s.encode('utf-8', 'surrogateescape') for s in strings])
+
+    @classmethod
+    def from_bytes(cls, blobs):
+        """Make a pool out of a list of bytes objects."""
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in blobs], out=offsets[1:])
+        data = np.frombuffer(b''.join(blobs), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.bytes(i).decode('utf-8', 'surrogateescape')
+
+    def bytes(self, i):
+        """Return string i, encoded."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end].tobytes()
+
+    def take(self, ids):
+        """Return a new pool with the strings at the given positions."""
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = self.offsets[ids]
+        lengths = self.offsets[ids + 1] - starts
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+        return StringPool(self.data[positions], offsets)
+
+    def extend(self, other):
+        """Return a new pool with the strings of this pool, then of other."""
+        data = np.concatenate([self.data, other.data])
+        offsets = np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]])
+        return StringPool(data, offsets)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        buffer = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [buffer[offsets[i]:offsets[i + 1]].decode('utf-8', 'surrogateescape')
+                for i in range(len(offsets) - 1)]
+
+
+# FNV-1a, 64 bits
+_FNV_OFFSET = 0xcbf29ce484222325
+_FNV_PRIME = 0x100000001b3
+_MASK = (1 << 64) - 1
+
+
+def hash_bytes(key):
+    """Return the 64-bit FNV-1a hash of a bytes object, as hash_pool()."""
+    h = _FNV_OFFSET
+    for byte in key:
+        h = ((h ^ byte) * _FNV_PRIME) & _MASK
+    return h
+
+
+def hash_pool(pool):
+    """ Return an array with the 64-bit FNV-1a hash of each string of a
+    StringPool. Strings are hashed together, one byte position at a time,
+    so the cost is a few array operations per byte of the longest string.
+    """
+    starts = pool.offsets[:-1]
+    lengths = pool.offsets[1:] - starts
+
+    # longest strings first, so the ones still being hashed are a prefix
+    order = np.argsort(-lengths, kind='stable')
+    starts, lengths = starts[order], lengths[order]
+    longest = int(lengths[0]) if len(lengths) else 0
+
+    h = np.full(len(order), _FNV_OFFSET, dtype=np.uint64)
+    prime = np.uint64(_FNV_PRIME)
+    with np.errstate(over='ignore'):
+        for k in range(longest):
+            n = _count_longer(lengths, k)
+            h[:n] ^= pool.data[starts[:n] + k]
+            h[:n] *= prime
+
+    hashes = np.empty_like(h)
+    hashes[order] = h
+    return hashes
+
+
+class HashIndex(object):
+    """ Maps the strings of a StringPool to their positions in the pool,
+    through a sorted array of their hashes (see hash_pool()). It takes 16
+    bytes per string and it can look up many strings with a few array
+    operations (see find_many()).
+
+        hashes - hashes of the strings, sorted
+        order  - position in the pool of the string of each hash
+    """
+
+    def __init__(self, pool, hashes=None, order=None):
+        self.pool = pool
+        if hashes is None:
+            unsorted = hash_pool(pool)
+            order = np.argsort(unsorted, kind='stable')
+            hashes = unsorted[order]
+        self.hashes = hashes
+        self.order = order
+
+    def extend(self, pool):
+        """ Return the index of pool, a pool that starts with the strings
+        of this index's pool, hashing only the strings added since.
+        """
+        n = len(self.pool)
+        added = hash_pool(StringPool(pool.data, pool.offsets[n:]))
+        hashes = np.concatenate([self.hashes, added])
+        order = np.concatenate([self.order, np.arange(n, len(pool), dtype=np.int64)])
+        resort = np.argsort(hashes, kind='stable')
+        return HashIndex(pool, hashes[resort], order[resort])
+
+    def find(self, key):
+        """ Return the position of a string (str or bytes) in the pool, or
+        -1 if it is not there.
+        """
+        if isinstance(key, str):
+            key = key.encode('utf-8', 'surrogateescape')
+        h = hash_bytes(key)
+        hashes = self.hashes
+        i = int(np.searchsorted(hashes, np.uint64(h)))
+        while i < len(hashes) and hashes[i] == h:
+            position = int(self.order[i])
+            if self.pool.bytes(position) == key:
+                return position
+            i += 1
+        return -1
+
+    def find_many(self, keys):
+        """ Return an array with the position of each of the keys (a list
+        of str or a StringPool) in the pool, -1 for the missing ones.
+        """
+        if not isinstance(keys, StringPool):
+            keys = StringPool.from_strings(keys)
+        if len(self.hashes) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        h = hash_pool(keys)
+        i = np.minimum(np.searchsorted(self.hashes, h), len(self.hashes) - 1)
+        found = self.hashes[i] == h
+        positions = np.where(found, self.order[i], -1)
+
+        # tell collisions from matches, checking the bytes of each match
+        same = _equal_strings(keys, self.pool, np.flatnonzero(found),
+                              positions[found])
+        for j in np.flatnonzero(found)[~same].tolist():
+            positions[j] = self.find(keys.bytes(j))
+
+        return positions
+
+
+def _count_longer(lengths, k):
+    """Number of lengths greater than k, given lengths sorted descending."""
+    return int(np.searchsorted(-lengths, -k, side='left'))
+
+
+def _equal_strings(a, b, i, j):
+    """Return a boolean array telling if a[i[n]] == b[j[n]], for every n."""
+    a_start, b_start = a.offsets[i], b.offsets[j]
+    length = a.offsets[i + 1] - a_start
+    equal = length == b.offsets[j + 1] - b_start
+
+    # compare the bytes of the pairs of strings of equal length
+    pairs = np.flatnonzero(equal & (length > 0))
+    if len(pairs):
+        n = length[pairs]
+        first = np.zeros(len(n), dtype=np.int64)
+        np.cumsum(n[:-1], out=first[1:])
+        within = np.arange(n.sum()) - np.repeat(first, n)
+        same = a.data[np.repeat(a_start[pairs], n) + within] == \
+            b.data[np.repeat(b_start[pairs], n) + within]
+        equal[pairs] = np.logical_and.reduceat(same, first)
+
+    return equal
+
+
+def reduce_segments(ufunc, values, lengths, out):
+    """ Combine, in place, out[i] with the next lengths[i] elements of
+    values using ufunc (e.g., np.add), and return out.
+    """
+    # empty segments are left unchanged
+    nonempty = np.flatnonzero(lengths)
+    if len(nonempty):
+        offsets = (np.cumsum(lengths) - lengths)[nonempty]
+        out[nonempty] = ufunc(out[nonempty], ufunc.reduceat(values, offsets))
+    return out
+
+
+def save_arrays(folder, arrays):
+    """ Save a dict of arrays to a folder, one .npy file per array, so
+    that load_arrays() can memory-map them. The files are written to a
+    temporary folder that is then renamed, so a reader never sees a
+    partially written folder.
+    """
+    tmp = '{}.tmp{}'.format(folder, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, name + '.npy'), arr)
+
+    try:
+        os.rename(tmp, folder)
+    except OSError:  # another process saved it first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_arrays(folder, mmap_mode='r', copy_on_write=()):
+    """ Memory-map the arrays saved by save_arrays().
+
+    Args:
+        mmap_mode - the mode of np.load(), 'r' for read-only arrays
+        copy_on_write - names of arrays mapped in mode 'c' instead, i.e.,
+            they can be written to, but changes stay private to this
+            process and are never written back to disk
+
+    Return:
+        a dict mapping names to arrays
+    """
+    arrays = dict()
+    for fname in os.listdir(folder):
+        if not fname.endswith('.npy'):
+            continue
+        name = fname[:-len('.npy')]
+        mode = 'c' if name in copy_on_write else mmap_mode
+        arrays[name] = np.load(os.path.join(folder, fname), mmap_mode=mode)
+    return arrays
+
+
+# arrays in a packed file start at multiples of this many bytes
+_ALIGNMENT = 64
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def save_packed(path, magic, version, arrays, meta=None):
+    """ Save a dict of arrays to a single file that load_packed() can
+    memory-map. The file starts with magic (bytes identifying the kind
+    of file), a JSON header with version, meta and the dtype, shape and
+    offset of each array, followed by the raw arrays. Like save_arrays(),
+    the file is written under a temporary name and then renamed.
+
+    Args:
+        magic - bytes at the beginning of the file
+        version - int - the version of the format of the file
+        arrays - a dict mapping names to arrays
+        meta - optional - any JSON-serializable object
+    """
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+
+    entries = []
+    header = b''
+    # offsets depend on the size of the header, which depends on the
+    # offsets, so lay out the file until the header size settles
+    while True:
+        offset = _aligned(len(magic) + 8 + len(header))
+        entries = []
+        for name, arr in arrays.items():
+            entries.append([name, arr.dtype.str, list(arr.shape), offset])
+            offset = _aligned(offset + arr.nbytes)
+        new_header = json.dumps({'version': version, 'meta': meta,
+                                 'arrays': entries}).encode('utf-8')
+        if len(new_header) == len(header):
+            break
+        header = new_header
+
+    tmp = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(magic)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for (name, _, _, offset), arr in zip(entries, arrays.values()):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(arr.tobytes())
+    os.replace(tmp, path)
+
+
+def is_packed(path, magic):
+    """Return True if the file at path starts with magic."""
+    with open(path, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+
+def load_packed(path, magic, copy_on_write=()):
+    """ Memory-map the arrays of a file saved by save_packed(). Arrays
+    are read-only, except for the ones named in copy_on_write (see
+    load_arrays()).
+
+    Return:
+        a tuple (version, meta, arrays), where arrays is a dict mapping
+        names to arrays
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("{} is not a {} file".format(path, magic))
+        size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(size).decode('utf-8'))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    arrays = dict()
+    for name, dtype, shape, offset in header['arrays']:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape, dtype=np.int64))
+        if count:
+            arr = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        else:  # may start past the end of the file
+            arr = np.empty(0, dtype=dtype)
+        arr = arr.reshape(shape)
+        if name not in copy_on_write:
+            arr.flags.writeable = False
+        arrays[name] = arr
+
+    return header['version'], header['meta'], arrays
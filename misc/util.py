@@ -4,8 +4,12 @@
 import os
 import sys
 import time
+import queue
+import pickle
 import logging
 
+from collections import OrderedDict
+
 class Timer:
 
     def __init__(self, title=None, logger=None):
@@ -69,5 +73,102 @@ def printprogress (iteration, total, prefix = '', suffix = '', decimals = 1, bar
         sys.stdout.write('\n')
     sys.stdout.flush()
 
+class LRUCache:
+    """ A bounded mapping that evicts its least recently used entries.
+    Hits and misses are counted, so the effectiveness of the cache can be
+    reported. The contents can be dumped to a file and used to pre-warm
+    the cache of a later run.
+    """
+
+    _missing = object()
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = self.data.get(key, LRUCache._missing)
+        if value is LRUCache._missing:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def update(self, items):
+        for key, value in items:
+            self.put(key, value)
+
+    def items(self):
+        return self.data.items()
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return "{} entries, {} hits, {} misses ({:.1f}% hit rate)".format(
+            len(self.data), self.hits, self.misses,
+            100 * self.hits / total if total else 0)
+
+    def dump(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(list(self.data.items()), f, -1)
+
+    @classmethod
+    def load(cls, path, maxsize=100000):
+        cache = cls(maxsize)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                cache.update(pickle.load(f))
+        return cache
+
+def check_workers(pool):
+    """ Raise RuntimeError if a process of the pool died with an error.
+    The remaining processes are terminated first, so that the parent
+    doesn't wait on them when it exits.
+    """
+    failed = [p for p in pool if not p.is_alive() and p.exitcode]
+    if failed:
+        for p in pool:
+            if p.is_alive():
+                p.terminate()
+        raise RuntimeError("Worker {} exited with code {}"
+                           .format(failed[0].name, failed[0].exitcode))
+
+def put_checked(work, item, pool, timeout=1):
+    """ Put an item in a bounded multiprocessing.Queue consumed by the
+    processes of a pool. Rather than blocking forever when the pool dies
+    and stops consuming, raises RuntimeError (see check_workers()).
+    """
+    while True:
+        try:
+            work.put(item, timeout=timeout)
+            return
+        except queue.Full:
+            check_workers(pool)
+
+def get_checked(results, pool, timeout=1):
+    """ Get an item from a multiprocessing.Queue fed by the processes of
+    a pool. Rather than blocking forever when the pool dies before sending
+    it, raises RuntimeError (see check_workers()).
+    """
+    while True:
+        try:
+            return results.get(timeout=timeout)
+        except queue.Empty:
+            check_workers(pool)
+
 def values_sorted_by_key(dictionary):
     return map(lambda x : x[1], sorted(dictionary.items()))
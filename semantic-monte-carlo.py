@@ -22,39 +22,70 @@ def generate_grammar(password_file, output_folder, python_env):
     pass
 
 
-def exec_sample(grammar_dir, sample_file, sample_size, python_env):
+def exec_sample(grammar_dir, sample_file, sample_size, python_env, log=True):
     cmd = "%s -m guessing.sample %d %s > %s" % (python_env, sample_size, grammar_dir, sample_file)
+    if log:
+        cmd += " --log"
     result = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
     result.communicate()
 
 
-def exec_score(path_to_grammar, sample_file, scored_sample_file, python_env, print_split=False):
+def exec_score(path_to_grammar, sample_file, scored_sample_file, python_env, print_split=False, log=True):
     if print_split:
         cmd = "%s -m guessing.score %s %s > %s --uppercase --camelcase --capitalized --print_split" \
               % (python_env, path_to_grammar, sample_file, scored_sample_file)
     else:
         cmd = "%s -m guessing.score %s %s > %s --uppercase --camelcase --capitalized" \
               % (python_env, path_to_grammar, sample_file, scored_sample_file)
+    if log:
+        cmd += " --log"
 
     _score = subprocess.Popen(
         cmd, shell=True, stdout=subprocess.PIPE)
     _score.communicate()
 
 
-def exec_strength(scored_sample_file, scored_test_file, monte_carlo_result_file):
+def sample_format(sample_file):
+    """ Tell whether the probabilities of a sample are log2 (all <= 0) or
+    linear (all >= 0). Returns True for log2, False for linear and None if
+    all of them are 0, which is valid in both.
+    """
+    log = None
+    with open(sample_file, "r") as f:
+        for line in f:
+            prob = float(line.strip("\r\n").split("\t")[-1])
+            if prob == 0:
+                continue
+            if log is None:
+                log = prob < 0
+            elif log != (prob < 0):
+                raise ValueError("%s mixes log2 and linear probabilities" % sample_file)
+    return log
+
+
+def bits(prob, log=True):
+    """-log2 of a probability, given as log2 if log is True."""
+    if log:
+        return -float(prob)
+    return -math.log2(max(float(prob), sys.float_info.min))
+
+
+def exec_strength(scored_sample_file, scored_test_file, monte_carlo_result_file, log=True):
     fin_scored_sample = open(scored_sample_file, "r")
     log_probs = []
     for line in fin_scored_sample:
         line = line.strip("\r\n")
         pwd, prob = line.split("\t")
-        logprob = -math.log2(max(float(prob), sys.float_info.min))
-        log_probs.append(logprob)
+        # log2 probabilities are -inf if not guessed
+        log_probs.append(bits(prob, log))
 
     fin_scored_sample.close()
     log_probs = numpy.fromiter(log_probs, float)
     log_probs.sort()
     log_n = math.log2(len(log_probs))
-    positions = (2 ** (log_probs - log_n)).cumsum()
+    # ranks too large for a float are inf
+    with numpy.errstate(over="ignore"):
+        positions = numpy.exp2(log_probs - log_n).cumsum()
     fin_scored_test = open(scored_test_file, "r")
 
     pwd_counter = defaultdict(lambda: [0, .0])
@@ -69,7 +100,7 @@ def exec_strength(scored_sample_file, scored_test_file, monte_carlo_result_file)
             print(e)
             sys.exit(-1)
         pwd_counter[pwd][0] += 1
-        pwd_counter[pwd][1] = -math.log2(max(float(prob), sys.float_info.min))
+        pwd_counter[pwd][1] = bits(prob, log)
         total += 1
     fin_scored_test.close()
     pwd_counter = dict(sorted(pwd_counter.items(), key=lambda x: x[1][1]))
@@ -79,7 +110,9 @@ def exec_strength(scored_sample_file, scored_test_file, monte_carlo_result_file)
     fout = open(monte_carlo_result_file, "w")
     for pwd, (cnt, lp) in pwd_counter.items():
         idx = bisect.bisect_right(log_probs, lp)
-        rank = math.ceil(max(positions[idx - 1] if idx > 0 else 1, prev_rank + addon))
+        rank = max(positions[idx - 1] if idx > 0 else 1, prev_rank + addon)
+        if math.isfinite(rank):
+            rank = math.ceil(rank)
         cracked += cnt
         prev_rank = rank
         fout.write(f"{pwd}\t{lp}\t{cnt}\t{rank}\t{cracked}\t{cracked / total * 100:5.2f}\n")
@@ -98,6 +131,10 @@ def main():
     parser.add_argument("--sample-size", dest="sample_size", type=int, required=False, default=100000)
     parser.add_argument("--env", dest="python_env", type=str, required=True)
     parser.add_argument('--print_split', dest="print_split", action="store_true")
+    parser.add_argument('--log', dest="log", action="store_true", default=True,
+                        help="sample and score log2 probabilities (default)")
+    parser.add_argument('--linear', dest="log", action="store_false",
+                        help="sample and score linear probabilities")
     args = parser.parse_args()
     _path_to_grammar = args.grammar_dir
     _python_env = args.python_env
@@ -110,15 +147,24 @@ def main():
     #     logging.info("Generating grammar done")
     if args.use_samples == "no_default":
         logging.info("Generating samples...")
-        exec_sample(_path_to_grammar, _sample_file, sample_size=args.sample_size, python_env=_python_env)
+        exec_sample(_path_to_grammar, _sample_file, sample_size=args.sample_size, python_env=_python_env,
+                    log=args.log)
         logging.info("Generating samples done")
     else:
         _sample_file = args.use_samples
+        try:
+            log = sample_format(_sample_file)
+        except ValueError as e:
+            parser.error(str(e))
+        if log is not None and log != args.log:
+            parser.error("%s has %s probabilities, run with %s" % (
+                _sample_file, "log2" if log else "linear", "--log" if log else "--linear"))
     logging.info("Scoring test set...")
-    exec_score(_path_to_grammar, args.test_file, _scored_test_file, _python_env, print_split=args.print_split)
+    exec_score(_path_to_grammar, args.test_file, _scored_test_file, _python_env, print_split=args.print_split,
+               log=args.log)
     logging.info("Scoring test done")
     logging.info("Evaluating strength...")
-    exec_strength(_sample_file, _scored_test_file, _guess_crack_file)
+    exec_strength(_sample_file, _scored_test_file, _guess_crack_file, log=args.log)
     logging.info("Evaluating strength done")
 
 
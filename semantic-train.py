@@ -18,4 +18,9 @@ if __name__ == '__main__':
                         opts.tagtype,
                         opts.estimator,
                         opts.abstraction,
-                        opts.num_workers)
+                        opts.num_workers,
+                        memory_budget=opts.memory_budget,
+                        cache_size=opts.cache_size,
+                        checkpoint_dir=opts.checkpoint_dir,
+                        sweep=opts.sweep,
+                        cache_folder=opts.cache_folder)
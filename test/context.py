@@ -3,9 +3,10 @@ import sys
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from learning import pos, model, train
-from learning.tree.cut import _li_abe, li_abe
+from learning import pos, model, train, checkpoint, chunks
+from learning.tree.cut import _li_abe, li_abe, wagner
 from learning.tree.wordnet import WordNetTreeNode, WordNetTree
 from learning.tree.default_tree import DefaultTree, DepthFirstIterator
+from learning.tree.array_tree import ArrayTree
 from learning.model import MleEstimator, LaplaceEstimator, Grammar
-from guessing import score
+from guessing import score, sample
@@ -0,0 +1,39 @@
+import io
+import os
+
+from context import checkpoint
+
+
+def _pipe(text):
+    """A file object reading text from a pipe, like a piped stdin."""
+    r, w = os.pipe()
+    with os.fdopen(w, 'w') as f:
+        f.write(text)
+    return os.fdopen(r)
+
+
+def test_stdin_inputs_are_not_checkpointed(tmp_path):
+    first, second = _pipe('password\n'), _pipe('123456\n')
+    assert checkpoint.input_signature(first) is None
+    assert checkpoint.input_signature(second) is None
+    assert checkpoint.input_signature(io.StringIO('qwerty\n')) is None
+
+    saved = checkpoint.Checkpoint(str(tmp_path))
+    tally = lambda f: f.read().split()
+    assert saved.run('tagged_chunks', checkpoint.input_signature(first),
+                     lambda: tally(first)) == ['password']
+    assert saved.run('tagged_chunks', checkpoint.input_signature(second),
+                     lambda: tally(second)) == ['123456']
+    assert not os.listdir(str(tmp_path))
+
+
+def test_regular_inputs_are_checkpointed(tmp_path):
+    path = tmp_path / 'passwords.txt'
+    path.write_text('password\n')
+    saved = checkpoint.Checkpoint(str(tmp_path / 'checkpoints'))
+
+    with open(str(path)) as f:
+        signature = checkpoint.input_signature(f)
+    assert signature['passwords'] == str(path)
+    assert saved.run('tagged_chunks', signature, lambda: 1) == 1
+    assert saved.run('tagged_chunks', signature, lambda: 2) == 1
@@ -0,0 +1,57 @@
+import pickle
+from multiprocessing import Pool
+
+from context import chunks
+
+
+ITEMS = [([('i', 'ppis1'), ('love', 'vv0'), ('you', 'ppy')], 3),
+         ([('123', None)], 5),
+         ([('password', 'nn1'), ('1', None)], 2),
+         ([('dragon', 'nn1')], 1)]
+
+
+def _build():
+    builder = chunks.TaggedChunksBuilder()
+    builder.extend(ITEMS)
+    return builder.build()
+
+
+def _total(passwords):
+    total = sum(count for x, count in passwords)
+    passwords.close()
+    return total
+
+
+def test_shared_chunks_survive_workers():
+    passwords = _build().share()
+
+    try:
+        with Pool(2) as pool:
+            totals = pool.map(_total, [passwords[:2], passwords[2:]], chunksize=1)
+            pool.close()
+            pool.join()
+
+        assert totals == [8, 3]
+        assert list(passwords) == ITEMS
+    finally:
+        passwords.release()
+
+    assert list(passwords) == ITEMS
+
+
+def test_shared_views():
+    passwords = _build()
+    triples = passwords.with_null_synsets().share()
+    head = triples[:2]
+
+    # the original is neither shared nor released with its view
+    assert 'blocks' not in passwords.__getstate__()
+    assert 'blocks' in pickle.loads(pickle.dumps(head)).__getstate__()
+    passwords.release()
+    assert list(head) == [([s + (None,) for s in x], count) for x, count in ITEMS[:2]]
+
+    # views still in use are moved to private memory
+    triples.release()
+    assert list(head) == [([s + (None,) for s in x], count) for x, count in ITEMS[:2]]
+    assert 'blocks' not in head.__getstate__()
+    assert list(passwords) == ITEMS
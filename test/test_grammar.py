@@ -1,4 +1,11 @@
-from learning.model import GrammarTagger
+import math
+import pickle
+
+import numpy as np
+
+from collections import Counter
+
+from learning.model import GrammarTagger, VariationCounter, Grammar, CompactGrammar
 
 
 def test_tagging():
@@ -36,4 +43,169 @@ def test_tagging():
     assert g._tag_pos(*chunk) == 'number6'
 
 
+def test_variation_counter():
+    counter = VariationCounter(GrammarTagger(), 'backoff')
+    X = [[('love', 'nn1', 'love.n.01'), ('love', 'nn1', 'passion.n.01')],
+         [('123', None, None)],
+         [('dogs', 'nn2', 'dog.n.01'), ('dogs', 'nn2', 'canine.n.02'),
+          ('dogs', 'nn2', None)]]
+    counter.add(X, 12)
+
+    # same as counting each of the 6 combinations with weight 12 / 6
+    assert counter.tags['love.n.01']['love'] == 6
+    assert counter.tags['number3']['123'] == 12
+    assert counter.tags['nn2']['dogs'] == 4
+    assert len(counter.base_structures) == 6
+    assert counter.base_structures['(love.n.01)(number3)(nn2)'] == 2
+    assert sum(counter.base_structures.values()) == 12
+
+    # variations of a single chunk are not split
+    counter.add([X[0]], 3)
+    assert counter.tags['love.n.01']['love'] == 9
+    assert counter.base_structures['(passion.n.01)'] == 3
+
+
+def test_compact_grammar():
+    tags = [{'nn': {'love': 3, 'dog': 1}, 'number3': {'123': 2}},
+            {'nn': {'dog': 2, 'cat': 1}, 'vb': {'run': 1}},
+            {'number3': {'123': 1, '007': 4}}]
+    structs = [{'(nn)(number3)': 2, '(nn)': 2},
+               {'(nn)(vb)': 1, '(nn)': 3},
+               {'(number3)': 5}]
+
+    grammar = Grammar()
+    # a small buffer forces several compactions
+    compact = CompactGrammar(buffer_size=2)
+    for t, s in zip(tags, structs):
+        grammar.merge(t, s)
+        compact.merge(t, s)
+
+    assert compact.tag_dicts['nn']['dog'] == 3
+    assert compact.tag_dicts['nn']['unseen'] == 0
+    assert compact.base_structures['(nn)'] == 5
+    for tag, terminals in grammar.tag_dicts.items():
+        assert dict(compact.tag_dicts[tag].items()) == dict(terminals)
+    assert dict(compact.base_structures.items()) == dict(grammar.base_structures)
+
+    X = [[('123', None, None)], [('007', None, None)], [('999', None, None)]]
+    assert list(compact.predict(X)) == list(grammar.predict(X))
+
+    # malformed keys are missing, not the empty base structure
+    compact.merge({}, {'': 1})
+    assert compact.base_structures[''] == 1
+    for key in ['nn', '(nn', '(nn)x']:
+        assert key not in compact.base_structures
+        assert compact.base_structures[key] == 0
+
+
+def test_sample():
+    grammar = Grammar()
+    grammar.merge({'nn': {'love': 5, 'dog': 3, 'cat': 2, 'unseen': 0},
+                   'number3': {'123': 6, '007': 4}},
+                  {'(nn)(number3)': 6, '(nn)': 3, '(number3)': 1})
+
+    sample = list(grammar.sample(20000, np.random.default_rng(0)))
+    assert len(sample) == 20000
+
+    freq = Counter(password for password, base_struct, p in sample)
+    assert 'unseen' not in freq
+    for password, base_struct, p in sample[:100]:
+        assert base_struct in grammar.base_structures
+        assert abs(freq[password] / len(sample) - p) < 0.02
+    probs = {password: p for password, base_struct, p in sample}
+    assert abs(probs['love123'] - 0.6 * 0.5 * 0.6) < 1e-12
+
+    # same sample, with log2 probabilities
+    linear = [p for _, _, p in grammar.sample(100, np.random.default_rng(1))]
+    logs = [p for _, _, p in grammar.sample(100, np.random.default_rng(1), log=True)]
+    assert np.allclose(np.log2(linear), logs)
+
+    X = [[('123', None, None)], [('999', None, None)]]
+    guessed, missed = grammar.predict(X, log=True)
+    assert math.isclose(guessed, math.log2(0.1 * 0.6))
+    assert missed == -math.inf
+
+
+def test_probability_table():
+    grammar = Grammar(estimator='laplace')
+    grammar.merge({'nn': {'love': 3, 'dog': 1}, 'number3': {'123': 2}},
+                  {'(nn)(number3)': 2})
+
+    table = grammar.probability_table
+    assert table.prob('nn', 'love') == (3 + 1) / (4 + 2)
+    assert table.prob('nn', 'cat') == 0
+    assert table.prob('vb', 'love') == 0
+    assert table.items('nn') == [('love', 4 / 6), ('dog', 2 / 6)]
+    assert grammar._get_tag_prob_estimator('number3').probability(2) == 1
+
+    # saved with the grammar
+    table = pickle.loads(pickle.dumps(grammar)).probability_table
+    assert table.prob('nn', 'dog') == 2 / 6
+
+    # recomputed after the counts change
+    grammar.merge({'nn': {'cat': 2}}, {'(nn)': 2})
+    assert grammar.probability_table.prob('nn', 'cat') == 3 / 9
+
+
+def test_probability_table_tab_terminals():
+    # keys are split at the first tab, so terminals may contain tabs
+    grammar = Grammar()
+    grammar.merge({'special1': {'\t': 3, '!': 1}, 'mixed3': {'a\tb': 1}},
+                  {'(special1)': 3, '(mixed3)': 1})
+
+    table = grammar.probability_table
+    assert table.prob('special1', '\t') == 3 / 4
+    assert table.prob('mixed3', 'a\tb') == 1
+    assert table.prob('mixed3', 'a') == 0
+    assert table.items('special1') == [('\t', 3 / 4), ('!', 1 / 4)]
+    assert table.items('mixed3') == [('a\tb', 1)]
+
+
+def test_predict_many():
+    grammar = Grammar()
+    grammar.merge({'number3': {'123': 6, '007': 4}, 'char2': {'ab': 1}},
+                  {'(number3)': 3, '(char2)(number3)': 1})
+
+    X = [[('123', None, None)], [('ab', None, None), ('007', None, None)],
+         [('999', None, None)], []]
+    strings, pos, synsets = zip(*[segment for x in X for segment in x])
+    lengths = [len(x) for x in X]
+
+    probs = grammar.predict_many(strings, pos, synsets, lengths)
+    assert probs.tolist() == list(grammar.predict(X))
+
+    probs = grammar.predict_many(strings, pos, synsets, lengths, log=True)
+    assert np.allclose(probs, list(grammar.predict(X, log=True)))
+
+
+def test_grammar_files(tmp_path):
+    grammar = Grammar(estimator='laplace')
+    grammar.merge({'number3': {'123': 6, '007': 4}, 'char2': {'ab': 1}},
+                  {'(number3)': 3, '(char2)(number3)': 1})
+    # models of a previous run are not left behind
+    (tmp_path / 'noun_treecut.tcm').write_bytes(b'stale')
+    grammar.write_to_disk(str(tmp_path))
+    assert not (tmp_path / 'noun_treecut.tcm').exists()
+
+    loaded = Grammar.from_files(str(tmp_path))
+    assert isinstance(loaded, CompactGrammar)
+    assert loaded.counter == grammar.counter
+    assert loaded.probability_table.prob('number3', '007') == \
+        grammar.probability_table.prob('number3', '007')
+    assert dict(loaded.base_structures.items()) == dict(grammar.base_structures)
+
+    X = [[('123', None, None)], [('ab', None, None), ('007', None, None)]]
+    assert list(loaded.predict(X)) == list(grammar.predict(X))
+
+    # loaded grammars can still be fit
+    loaded.merge({'char2': {'cd': 1}}, {'(char2)': 1})
+    assert loaded.tag_dicts['char2']['cd'] == 1
+
+    # older grammars are pickled
+    (tmp_path / 'grammar.bin').unlink()
+    with open(str(tmp_path / 'grammar.pickle'), 'wb') as f:
+        pickle.dump(grammar, f)
+    assert list(Grammar.from_files(str(tmp_path)).predict(X)) == list(grammar.predict(X))
+
+
 test_tagging()
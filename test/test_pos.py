@@ -1,4 +1,5 @@
 from context import pos, train
+from misc.util import LRUCache
 
 
 def test_backoff_tagger():
@@ -57,3 +58,23 @@ def test_chunk_and_pos():
 test_backoff_tagger()
 # test_tag_random_string()
 # test_chunk_and_pos()
+
+
+class CountingTagger(object):
+    def __init__(self):
+        self.calls = 0
+
+    def tag(self, tokens):
+        self.calls += 1
+        return [(token, 'nn1') for token in tokens]
+
+
+def test_cached_tags_are_not_shared():
+    tagger = CountingTagger()
+    cache = LRUCache(10)
+
+    tags = train.pos_tag(['love'], tagger, None, cache)
+    tags.append(('2', None))
+
+    assert train.pos_tag(['love'], tagger, None, cache) == [('love', 'nn1')]
+    assert tagger.calls == 1
@@ -0,0 +1,41 @@
+from context import model, sample
+from learning.sampler import GrammarSampler
+
+
+def test_reproducible_sample():
+    grammar = model.Grammar()
+    grammar.merge({'nn': {'love': 5, 'dog': 3, 'cat': 2},
+                   'number3': {'123': 6, '007': 4}},
+                  {'(nn)(number3)': 6, '(nn)': 3, '(number3)': 1})
+    sampler = GrammarSampler(grammar)
+
+    assert sample.shares(10, 3) == [4, 3, 3]
+
+    N = sample.CHUNK_SIZE + 10
+    first = ''.join(sample.sample(sampler, N, seed=7, num_workers=2))
+    second = ''.join(sample.sample(sampler, N, seed=7, num_workers=2))
+    assert first == second
+    assert first.count('\n') == N
+
+    other = ''.join(sample.sample(sampler, N, seed=8, num_workers=2))
+    assert other != first
+
+
+class BrokenSampler(object):
+    def sample(self, N, rng=None, batch_size=None, log=False):
+        raise ValueError("broken")
+
+
+def test_failed_workers_raise(tmp_path):
+    try:
+        list(sample.sample(BrokenSampler(), 10, seed=7, num_workers=2))
+        assert False, "expected RuntimeError"
+    except RuntimeError:
+        pass
+
+    try:
+        sample.sample_to_files(BrokenSampler(), 10, str(tmp_path / 'sample'),
+                               seed=7, num_workers=2)
+        assert False, "expected RuntimeError"
+    except RuntimeError:
+        pass
@@ -0,0 +1,68 @@
+import io
+import logging
+
+from collections import Counter
+
+from context import train, model, WordNetTreeNode, DefaultTree, ArrayTree
+
+
+class BrokenSynsetIndex(object):
+    def first(self, string, pos):
+        raise ValueError("broken")
+
+
+def test_count_synsets_raises_when_a_worker_fails():
+    passwords = [([('love', 'nn1')], 3), ([('dog', 'nn1')], 2)]
+    try:
+        train.count_synsets(passwords, BrokenSynsetIndex(), 2)
+        assert False, "expected RuntimeError"
+    except RuntimeError:
+        pass
+
+
+def _fake_counted_tree(pos, counts):
+    tree = DefaultTree(WordNetTreeNode('ENTITY'))
+    for path in [['ANIMAL', 'BIRD', 'crow'], ['ANIMAL', 'BIRD', 'eagle'],
+                 ['ANIMAL', 'INSECT', 'bee'], ['ARTIFACT', 'VEHICLE', 'car'],
+                 ['ARTIFACT', 'VEHICLE', 'bike']]:
+        tree.insert([pos + '_' + key for key in path], 0)
+    tree = ArrayTree.from_tree(tree)
+    tree.value[tree.leaf_ids()] = counts
+    tree.updateCounts()
+    return tree
+
+
+def test_fit_tree_cut_models(monkeypatch):
+    # WordNet trees are replaced by a small tree, also in the forked worker
+    monkeypatch.setattr(train, '_counted_tree', _fake_counted_tree)
+    noun_counts, verb_counts = [4, 4, 8, 1, 0], [0, 3, 0, 5, 5]
+
+    tcm_n, tcm_v = train.fit_tree_cut_models(noun_counts, verb_counts, 'mle',
+                                             10, num_workers=3)
+
+    expected_n = model.TreeCutModel('n', specificity=10)
+    expected_n.fit_tree(_fake_counted_tree('n', noun_counts))
+    expected_v = model.TreeCutModel('v')
+    expected_v.fit_tree(_fake_counted_tree('v', verb_counts))
+    for tcm, expected in [(tcm_n, expected_n), (tcm_v, expected_v)]:
+        assert tcm.pos == expected.pos
+        assert [n.key for n in tcm.treecut.cut] == \
+            [n.key for n in expected.treecut.cut]
+    assert tcm_n.treecut.cut[0].key.startswith('n_')
+    assert tcm_v.treecut.cut[0].key.startswith('v_')
+
+
+def test_tally_streaming_merges_spilled_runs(caplog):
+    # 37 distinct passwords, each repeated across the whole input
+    lines = ['{}{}\n'.format(word, i % 37)
+             for i, word in enumerate(['love', 'Dragon', 'caf\u00e9', 'a\tb'] * 150)]
+
+    with caplog.at_level(logging.INFO, logger=train.log.name):
+        counts = list(train.tally_streaming(io.StringIO(''.join(lines)),
+                                            memory_budget=0.002, num_partitions=4))
+    assert sum('Spilling' in r.message for r in caplog.records) > 1
+
+    passwords = [password for password, count in counts]
+    assert len(passwords) == len(set(passwords))
+    assert dict(counts) == train.tally(io.StringIO(''.join(lines)))
+    assert Counter(dict(counts)) == Counter(line.rstrip('\n').lower() for line in lines)
@@ -1,9 +1,14 @@
 # %cd test
 from context import _li_abe, \
-    li_abe, WordNetTreeNode, WordNetTree, DefaultTree, \
-    MleEstimator, LaplaceEstimator, DepthFirstIterator
+    li_abe, wagner, WordNetTreeNode, WordNetTree, DefaultTree, \
+    MleEstimator, LaplaceEstimator, DepthFirstIterator, ArrayTree, model
 
+import multiprocessing
 import pickle
+import numpy as np
+
+from learning.tree.cut import _search
+from learning.tree.wordnet import ArrayWordNetTree
 
 
 def test_description_length():
@@ -42,6 +47,21 @@ def test_description_length():
     assert all([abs(true - test) < 0.01 for true, test in zip(true_dl, test_dl)])
 
 
+def test_description_lengths_arrays():
+    # cut 3 of Table 4 of Li & Abe (1998), see test_description_length
+    values = np.array([8, 0, 2, 0])
+    leaf_counts = np.array([4, 1, 1, 1])
+    ddl, pdl, dl = _li_abe.description_lengths(values, leaf_counts, 10)
+    assert abs(ddl - 23.22) < 0.01
+    assert abs(pdl - 4.98) < 0.01
+    assert abs(dl - 28.20) < 0.01
+
+    laplace = LaplaceEstimator(10, 7, 1)
+    probabilities = laplace.probability(values, leaf_counts)
+    assert abs(probabilities[0] - 12 / 17) < 1e-12
+    assert abs(probabilities.sum() - 1) < 1e-12
+
+
 def test_dl_with_nodes():
     ANIMAL = WordNetTreeNode('ANIMAL')
     BIRD = WordNetTreeNode('BIRD')
@@ -90,6 +110,234 @@ def test_dl_with_nodes():
     assert cut_mle[1].key == 'INSECT'
 
 
+def test_array_tree():
+    tree = DefaultTree(WordNetTreeNode('ENTITY'))
+    tree.insert(['ANIMAL', 'BIRD', 'swallow'], 4)
+    tree.insert(['ANIMAL', 'BIRD', 'crow'], 4)
+    tree.insert(['ANIMAL', 'BIRD', 'eagle'], 4)
+    tree.insert(['ANIMAL', 'BIRD', 'bird'], 6)
+    tree.insert(['ANIMAL', 'INSECT', 'bug'], 0)
+    tree.insert(['ANIMAL', 'INSECT', 'bee'], 8)
+    tree.insert(['ANIMAL', 'INSECT', 'insect'], 0)
+    tree.insert(['ARTIFACT', 'VEHICLE', 'car'], 1)
+    tree.insert(['ARTIFACT', 'VEHICLE', 'bike'], 0)
+    tree.insert(['ARTIFACT', 'AIRPLANE', 'jet'], 4)
+    tree.insert(['ARTIFACT', 'AIRPLANE', 'helicopter'], 0)
+    tree.insert(['ARTIFACT', 'AIRPLANE', 'airplane'], 4)
+    tree.root.updateCounts()
+
+    array_tree = ArrayTree.from_tree(tree)
+    array_tree.updateCounts()
+
+    assert [n.key for n in array_tree.leaves()] == [n.key for n in tree.leaves()]
+    assert array_tree.root.value == 35
+    assert array_tree.root.leaf_count == 12
+    assert array_tree.index['BIRD'][0].value == 18
+    assert array_tree.index['BIRD'][0].find('crow').parent.key == 'BIRD'
+
+    laplace = LaplaceEstimator(35, 12, 1)
+    for estimator in [None, laplace]:
+        cut = li_abe.findcut(tree, estimator)
+        array_cut = li_abe.findcut(array_tree, estimator)
+        assert [n.key for n in array_cut] == [n.key for n in cut]
+        array_cut = li_abe.findcut(array_tree, estimator, num_workers=2)
+        assert [n.key for n in array_cut] == [n.key for n in cut]
+
+        weights = [1, 10, 100, 1000]
+        cuts = wagner.findcuts(array_tree, weights, estimator)
+        for weight, array_cut in zip(weights, cuts):
+            cut = wagner.findcut(tree, weight, estimator)
+            assert [n.key for n in array_cut] == [n.key for n in cut]
+
+
+def test_array_tree_save_load(tmp_path):
+    tree = DefaultTree(WordNetTreeNode('ANIMAL'))
+    tree.insert(['BIRD', 'crow'], 2)
+    tree.insert(['BIRD', 'eagle'], 2)
+    tree.insert(['INSECT', 'bee'], 2)
+
+    array_tree = ArrayTree.from_tree(tree)
+    array_tree.updateCounts()
+    array_tree.save(str(tmp_path / 'tree'))
+
+    loaded = ArrayTree.load(str(tmp_path / 'tree'))
+    assert [n.key for n in loaded.flat()] == [n.key for n in array_tree.flat()]
+    assert loaded.root.value == 6
+
+    # values are copy-on-write
+    loaded.index['crow'][0].increment_value(1)
+    loaded.updateCounts()
+    assert loaded.root.value == 7
+    assert ArrayTree.load(str(tmp_path / 'tree')).root.value == 6
+
+
+def test_findcut_parallel_spawn(monkeypatch):
+    tree = DefaultTree(WordNetTreeNode('ENTITY'))
+    tree.insert(['ANIMAL', 'BIRD', 'crow'], 4)
+    tree.insert(['ANIMAL', 'BIRD', 'eagle'], 4)
+    tree.insert(['ANIMAL', 'INSECT', 'bee'], 8)
+    tree.insert(['ARTIFACT', 'VEHICLE', 'car'], 1)
+    tree.insert(['ARTIFACT', 'VEHICLE', 'bike'], 0)
+    tree.root.updateCounts()
+    array_tree = ArrayTree.from_tree(tree)
+    array_tree.updateCounts()
+
+    expected = [[n.key for n in li_abe.findcut(array_tree)],
+                [n.key for n in wagner.findcut(array_tree, 10)]]
+
+    # workers receive the description length function by pickling
+    monkeypatch.setattr(_search, 'Pool', multiprocessing.get_context('spawn').Pool)
+    cuts = [li_abe.findcut(array_tree, num_workers=2),
+            wagner.findcut(array_tree, 10, num_workers=2)]
+    assert [[n.key for n in cut] for cut in cuts] == expected
+
+
+def test_findcut_deep_tree():
+    # deeper than the recursion limit
+    root = node = WordNetTreeNode('root')
+    for i in range(5000):
+        child = WordNetTreeNode(str(i))
+        node.add_child(child)
+        node = child
+    node.add_child(WordNetTreeNode('a', value=2))
+    node.add_child(WordNetTreeNode('b', value=2))
+    root.updateCounts()
+
+    cut = li_abe.findcut(DefaultTree(root))
+    assert len(cut) == 1
+    assert cut[0].key == 'root'
+
+
+class FakeSynset(object):
+    def __init__(self, name, parent=None):
+        self._name = name
+        self.parent = parent
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+
+    def name(self):
+        return self._name
+
+    def hyponyms(self):
+        return self.children
+
+    def hypernyms(self):
+        return [self.parent] if self.parent is not None else []
+
+    def hypernym_paths(self):
+        path = [self]
+        while path[0].parent is not None:
+            path.insert(0, path[0].parent)
+        return [path]
+
+
+class FakeWordNet(object):
+    def __init__(self):
+        entity = FakeSynset('entity.n.01')
+        animal = FakeSynset('animal.n.01', entity)
+        self._synsets = [entity, animal, FakeSynset('bird.n.01', animal),
+                         FakeSynset('car.n.01', entity)]
+
+    def get_version(self):
+        return 'fake'
+
+    def synsets(self, lemma):
+        return self._synsets[:1]
+
+    def all_synsets(self, pos):
+        return self._synsets
+
+
+def test_wordnet_snapshot(tmp_path, monkeypatch):
+    wordnet = FakeWordNet()
+    expected = ArrayWordNetTree('n', wordnet).to_arrays()
+
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    path = ArrayWordNetTree.snapshot_path('n', wordnet)
+    assert path.startswith(str(tmp_path / 'cache' / 'semantic-guesser'))
+
+    for tree in [ArrayWordNetTree.snapshot('n', wordnet),
+                 ArrayWordNetTree.snapshot('n', wordnet, str(tmp_path / 'other'))]:
+        assert tree.pos == 'n'
+        arrays = tree.to_arrays()
+        assert sorted(arrays) == sorted(expected)
+        for name in expected:
+            assert np.array_equal(arrays[name], expected[name])
+    assert (tmp_path / 'other').is_dir()
+
+
+def test_treecut_model_update():
+    def build(counts):
+        tree = DefaultTree(WordNetTreeNode('ENTITY'))
+        for path, count in counts:
+            tree.insert(path, count)
+        tree.root.updateCounts()
+        tree = ArrayTree.from_tree(tree)
+        tree.updateCounts()
+        return tree
+
+    counts = [(['ANIMAL', 'BIRD', 'crow'], 4), (['ANIMAL', 'BIRD', 'eagle'], 4),
+              (['ANIMAL', 'INSECT', 'bee'], 8), (['ANIMAL', 'INSECT', 'bug'], 0),
+              (['ARTIFACT', 'VEHICLE', 'car'], 1), (['ARTIFACT', 'VEHICLE', 'bike'], 0)]
+    changes = [('bug', 6), ('bee', -6), ('car', 3)]
+
+    updated = dict((path[-1], count) for path, count in counts)
+    for key, count in changes:
+        updated[key] += count
+    expected = model.TreeCutModel('n')
+    expected.fit_tree(build([(path, updated[path[-1]]) for path, _ in counts]))
+
+    m = model.TreeCutModel('n')
+    m.fit_tree(build(counts))
+    m.update(changes[:2])  # same sample size
+    m.update(changes[2:])
+
+    assert m.tree.root.value == expected.tree.root.value
+    assert [n.key for n in m.treecut.cut] == [n.key for n in expected.treecut.cut]
+
+
+def test_treecut_model_save_load(tmp_path):
+    tree = DefaultTree(WordNetTreeNode('ENTITY'))
+    tree.insert(['ANIMAL', 'BIRD', 'crow'], 4)
+    tree.insert(['ANIMAL', 'BIRD', 'eagle'], 4)
+    tree.insert(['ANIMAL', 'INSECT', 'bee'], 8)
+    tree.insert(['ARTIFACT', 'VEHICLE', 'car'], 1)
+    tree.insert(['ARTIFACT', 'VEHICLE', 'bee'], 3)
+    tree.root.updateCounts()
+
+    fitted = model.TreeCutModel('n', specificity=100)
+    fitted.fit_tree(tree)
+
+    old_path = str(tmp_path / 'noun_treecut.pickle')
+    with open(old_path, 'wb') as f:
+        pickle.dump(fitted, f)
+    fitted.save(str(tmp_path / 'noun_treecut.tcm'))
+
+    old = model.TreeCutModel.load(old_path)
+    loaded = model.TreeCutModel.from_folder(str(tmp_path), 'n')
+
+    assert loaded.specificity == 100
+    assert [n.key for n in loaded.treecut.cut] == [n.key for n in old.treecut.cut]
+    for key in ['crow', 'bee', 'car']:
+        assert sorted(loaded.predict(key)) == sorted(old.predict(key))
+    assert loaded.treecut.abstract('unknown') is None
+    # the class table is memory-mapped, not built
+    assert not loaded.treecut.class_arrays()[0].flags.writeable
+    assert loaded.classes == old.classes
+    assert loaded.predict_many(['bee', 'unknown']) == [tuple(sorted(old.predict('bee'))), None]
+    assert model.TreeCutModel.from_folder(str(tmp_path), 'v') is None
+
+
+def test_estimators_take_numpy_scalars():
+    mle = MleEstimator(10)
+    laplace = LaplaceEstimator(10, 5, 1)
+    for x in [2, 2.0, np.int64(2), np.float64(2), np.float32(2)]:
+        assert mle.probability(x) == 0.2
+        assert laplace.probability(x) == 0.2
+    assert mle.probability(np.arange(3)).tolist() == [0, 0.1, 0.2]
+
+
 def test_laplace_estimator():
     cut1 = [('ANIMAL', 10, 7)]
     cut2 = [('BIRD', 8, 4), ('INSECT', 2, 3)]